@@ -0,0 +1,346 @@
+# api.py
+"""
+Асинхронный HTTP API (ASGI) для автоматической отправки выгрузок ЯЗакупок.
+
+Запуск:
+    uvicorn api:api --host 0.0.0.0 --port 8000
+
+Эндпоинты:
+    POST /api/jobs?filename=<имя>.xlsx&formats=xlsx,json - тело запроса - файл .xlsx;
+                                        возвращает id задачи (202)
+    GET  /api/jobs/{job_id}             - статус задачи
+    GET  /api/jobs/{job_id}/result?format=xlsx|json - готовый свод
+    GET  /api/jobs/{job_id}/timings     - тайминги этапов и счетчики сборки
+    GET  /api/jobs/{job_id}/profile     - профиль сборки (только с X-Admin-Token)
+
+Профилирование задачи включается параметром profile=speedscope|collapsed (или profile=1)
+при отправке с заголовком X-Admin-Token либо для всех задач переменной SUMMARY_PROFILE.
+
+Перед постановкой в очередь выгрузка проходит контроль допуска (ess.admit_build): слишком
+большие отклоняются с кодом 413, большие идут в очередь низкого приоритета - одновременно
+строится не больше ess.LOW_PRIORITY_WORKERS таких сводов, и они не занимают все процессы пула.
+
+Загрузка принимается асинхронно и пишется на диск порциями, а построение свода
+(блокирующее, нагружающее процессор) выполняется в пуле процессов. Поэтому один процесс
+API держит сотни одновременных задач: ожидающие задачи не занимают ни поток, ни процесс.
+Процессы пула прогреваются при старте API и перезапускаются по числу задач и памяти
+(см. summary_workers).
+"""
+import asyncio
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse
+
+import excel_summary_script as ess
+import summary_profiling
+import summary_workers
+import summary_writers
+import xlsx_stream_reader
+
+# Количество процессов, одновременно строящих своды
+API_WORKERS = int(os.environ.get('API_WORKERS', os.cpu_count() or 1))
+
+# Сколько хранить завершенные задачи и их результаты
+API_JOB_TTL_SECONDS = int(os.environ.get('API_JOB_TTL_SECONDS', 3600))
+
+# Форматы, которые можно запросить у API
+API_FORMATS = ('xlsx', 'json')
+
+api = FastAPI(title='Свод КП', description='Построение свода КП из выгрузки ЯЗакупок')
+
+# Задачи хранятся в памяти процесса API: {id: описание задачи}
+jobs = {}
+
+_executor = None
+_job_slots = None
+_low_priority_slots = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        if summary_workers.WORKER_POOL_ENABLED:
+            _executor = summary_workers.WarmWorkerPool(workers=API_WORKERS)
+        else:
+            _executor = ProcessPoolExecutor(max_workers=API_WORKERS)
+    return _executor
+
+
+def _get_job_slots():
+    # Семафор ограничивает число задач, переданных в пул: остальные ждут в статусе queued
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(API_WORKERS)
+    return _job_slots
+
+
+def _get_low_priority_slots():
+    # Большие выгрузки сначала ждут место в очереди низкого приоритета, затем - общее место в пуле
+    global _low_priority_slots
+    if _low_priority_slots is None:
+        _low_priority_slots = asyncio.Semaphore(ess.LOW_PRIORITY_WORKERS)
+    return _low_priority_slots
+
+
+def run_summary_job(input_path, output_dir, formats, profile_format=None, deadline_seconds=None):
+    """
+    Строит свод один раз и записывает его во всех запрошенных форматах (ess.export_summary_formats).
+    Выполняется в процессе пула.
+
+    Args:
+        input_path: Путь к выгрузке
+        output_dir: Каталог для результатов
+        formats: Список форматов из API_FORMATS
+        profile_format: Формат профиля сборки из summary_profiling.PROFILE_FORMATS или None
+        deadline_seconds: Предельное время сборки (см. ess.build_limits) или None
+
+    Returns:
+        dict: {'results': {формат: путь}, 'profile': путь к профилю или None,
+               'stage_timings': {этап: секунды}, 'counters': {...}}
+    """
+    output_paths = {output_format: os.path.join(output_dir, f"summary.{output_format}") for output_format in formats}
+    # Профиль лежит рядом с результатами задачи и удаляется вместе с ними
+    profile_path = None
+    if profile_format:
+        profile_path = os.path.join(output_dir, f"profile{summary_profiling.PROFILE_FORMATS[profile_format]}")
+    limits = ess.build_limits(deadline_seconds) if deadline_seconds else contextlib.nullcontext()
+    with limits:
+        results = ess.export_summary_formats(input_path, output_paths, profile_path=profile_path)
+
+    stats = ess.get_build_stats()
+    return {
+        'results': results,
+        'profile': profile_path if profile_path and os.path.exists(profile_path) else None,
+        'stage_timings': stats['stage_timings'],
+        'counters': stats['counters']
+    }
+
+
+def _public_job(job):
+    """Описание задачи для ответа API (без путей к файлам)."""
+    return {
+        'job_id': job['job_id'],
+        'filename': job['filename'],
+        'status': job['status'],
+        'formats': job['formats'],
+        'submitted_at': job['submitted_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'error': job['error'],
+        'priority': job['priority'],
+        'profiled': bool(job['profile_format'])
+    }
+
+
+def _remove_dirs(paths):
+    for path in paths:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+async def _purge_expired_jobs():
+    """Удаляет завершенные задачи старше API_JOB_TTL_SECONDS вместе с файлами (файлы - в потоке)."""
+    now = time.time()
+    expired_dirs = []
+    for job_id, job in list(jobs.items()):
+        if job['finished_at'] and now - job['finished_at'] > API_JOB_TTL_SECONDS:
+            expired_dirs.append(job['work_dir'])
+            del jobs[job_id]
+    if expired_dirs:
+        await asyncio.to_thread(_remove_dirs, expired_dirs)
+
+
+def _get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='Задача не найдена')
+    return job
+
+
+async def _spool_request(request, destination_path):
+    """
+    Пишет тело запроса на диск, проверяя сигнатуру zip по первым байтам
+    и размер по мере поступления (см. ess.spool_upload_stream).
+    Запись на диск идет в потоке и порциями по ess.STREAM_UPLOAD_CHUNK_SIZE,
+    чтобы не останавливать цикл событий на время дисковых операций.
+    """
+    signature_length = len(xlsx_stream_reader.ZIP_SIGNATURE)
+    head = b''
+    written = 0
+    pending = bytearray()
+    destination = await asyncio.to_thread(open, destination_path, 'wb')
+    try:
+        async for chunk in request.stream():
+            if not chunk:
+                continue
+            if len(head) < signature_length:
+                head += chunk[:signature_length - len(head)]
+                if len(head) == signature_length and not xlsx_stream_reader.has_zip_signature(head):
+                    raise HTTPException(status_code=400, detail='Файл не является xlsx (нет сигнатуры zip)')
+            written += len(chunk)
+            if written > ess.STREAM_UPLOAD_MAX_SIZE:
+                raise HTTPException(status_code=413, detail='Файл больше допустимого размера')
+            pending += chunk
+            if len(pending) >= ess.STREAM_UPLOAD_CHUNK_SIZE:
+                await asyncio.to_thread(destination.write, bytes(pending))
+                pending.clear()
+        if pending:
+            await asyncio.to_thread(destination.write, bytes(pending))
+    finally:
+        await asyncio.to_thread(destination.close)
+    if not xlsx_stream_reader.has_zip_signature(head):
+        raise HTTPException(status_code=400, detail='Файл пустой или не является xlsx')
+
+
+async def _run_job(job):
+    queue = _get_low_priority_slots() if job['priority'] == 'low' else contextlib.nullcontext()
+    async with queue:
+        async with _get_job_slots():
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+            loop = asyncio.get_running_loop()
+            try:
+                outcome = await loop.run_in_executor(_get_executor(), run_summary_job,
+                                                     job['input_path'], job['work_dir'], job['formats'],
+                                                     job['profile_format'], job['deadline_seconds'])
+                job.update(outcome)
+                job['status'] = 'done'
+            except Exception as e:
+                job['status'] = 'error'
+                job['error'] = str(e)
+            finally:
+                job['finished_at'] = time.time()
+
+
+@api.post('/api/jobs', status_code=202)
+async def submit_job(request: Request, filename: str = 'upload.xlsx', formats: str = 'xlsx', profile: str = '',
+                     x_admin_token: str = Header(default=None)):
+    """Принимает выгрузку (тело запроса - файл .xlsx) и ставит построение свода в очередь."""
+    await _purge_expired_jobs()
+
+    requested_formats = [fmt.strip() for fmt in formats.split(',') if fmt.strip()]
+    unknown = [fmt for fmt in requested_formats if fmt not in API_FORMATS]
+    if not requested_formats or unknown:
+        raise HTTPException(status_code=400, detail=f"Доступные форматы: {', '.join(API_FORMATS)}")
+    if not ess.allowed_file(filename):
+        raise HTTPException(status_code=400, detail='Неподдерживаемый формат файла. Используйте .xlsx')
+    content_length = request.headers.get('content-length')
+    if content_length is not None:
+        if not content_length.strip().isdigit():
+            raise HTTPException(status_code=400, detail='Некорректный заголовок Content-Length')
+        if int(content_length) > ess.STREAM_UPLOAD_MAX_SIZE:
+            raise HTTPException(status_code=413, detail='Файл больше допустимого размера')
+    if profile and not summary_profiling.is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail='Профилирование доступно только с токеном администратора')
+
+    job_id = uuid.uuid4().hex
+    work_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix=f"summary_{job_id}_")
+    input_path = os.path.join(work_dir, 'input.xlsx')
+    try:
+        try:
+            await _spool_request(request, input_path)
+            await asyncio.to_thread(xlsx_stream_reader.validate_xlsx_structure, input_path)
+            estimate = await asyncio.to_thread(ess.admit_build, input_path)
+        except ess.AdmissionError as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        except xlsx_stream_reader.XlsxShapeError as e:
+            raise HTTPException(status_code=422, detail=f'Файл не похож на выгрузку ЯЗакупок: {e}')
+    except BaseException:
+        await asyncio.to_thread(_remove_dirs, [work_dir])
+        raise
+
+    job = {
+        'job_id': job_id,
+        'filename': filename,
+        'formats': requested_formats,
+        'status': 'queued',
+        'submitted_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'error': None,
+        'work_dir': work_dir,
+        'input_path': input_path,
+        'profile_format': summary_profiling.requested_profile_format(profile, x_admin_token),
+        'priority': estimate['priority'],
+        'deadline_seconds': estimate['deadline_seconds'],
+        'results': {},
+        'profile': None,
+        'stage_timings': {},
+        'counters': {}
+    }
+    jobs[job_id] = job
+    job['task'] = asyncio.create_task(_run_job(job))
+
+    response = _public_job(job)
+    response['status_url'] = f"/api/jobs/{job_id}"
+    return response
+
+
+@api.get('/api/jobs/{job_id}')
+async def job_status(job_id: str):
+    """Статус задачи: queued, running, done или error."""
+    return _public_job(_get_job(job_id))
+
+
+@api.get('/api/jobs/{job_id}/result')
+async def job_result(job_id: str, format: str = 'xlsx'):
+    """Готовый свод в одном из форматов, запрошенных при отправке."""
+    job = _get_job(job_id)
+    if job['status'] == 'error':
+        raise HTTPException(status_code=409, detail=f"Свод не построен: {job['error']}")
+    if job['status'] != 'done':
+        raise HTTPException(status_code=409, detail=f"Задача еще выполняется (статус {job['status']})")
+    if format not in job['results']:
+        raise HTTPException(status_code=404, detail=f"Формат {format} не запрашивался для этой задачи")
+
+    base_name = os.path.splitext(os.path.basename(job['filename']))[0]
+    return FileResponse(job['results'][format], media_type=summary_writers.FORMAT_MIMETYPES[format],
+                        filename=f"{base_name}_свод.{format}")
+
+
+@api.get('/api/jobs/{job_id}/timings')
+async def job_timings(job_id: str):
+    """Тайминги этапов сборки (загрузка, сопоставление, форматирование, запись) и счетчики."""
+    job = _get_job(job_id)
+    return {
+        'job_id': job_id,
+        'status': job['status'],
+        'queue_seconds': (job['started_at'] - job['submitted_at']) if job['started_at'] else None,
+        'total_seconds': (job['finished_at'] - job['started_at']) if job['finished_at'] and job['started_at'] else None,
+        'stage_timings': job['stage_timings'],
+        'counters': job['counters'],
+        'profile_available': bool(job['profile'])
+    }
+
+
+@api.get('/api/jobs/{job_id}/profile')
+async def job_profile(job_id: str, x_admin_token: str = Header(default=None)):
+    """Профиль сборки свода (speedscope или свернутые стеки - как запрошено при отправке)."""
+    if not summary_profiling.is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail='Требуется токен администратора')
+    job = _get_job(job_id)
+    if not job['profile']:
+        raise HTTPException(status_code=404, detail='Профиль сборки не сохранялся для этой задачи')
+    profile_path = job['profile']
+    return FileResponse(profile_path, media_type='application/octet-stream',
+                        filename=os.path.basename(profile_path))
+
+
+@api.on_event('startup')
+def start_executor():
+    # Процессы пула прогреваются до первой задачи
+    executor = _get_executor()
+    if isinstance(executor, summary_workers.WarmWorkerPool):
+        executor.start()
+
+
+@api.on_event('shutdown')
+def shutdown_executor():
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
@@ -1,60 +1,96 @@
 # app.py
+import multiprocessing
 import os
 import tempfile
-import gradio as gr
 import excel_summary_script as ess  # ваш файл
+import summary_profiling
+import summary_workers
+
+# gradio импортируется внутри функций: процессы пула (spawn) заново импортируют этот модуль,
+# и им не нужны ни gradio, ни интерфейс
+def run_build(input_file, output_format="xlsx", profile=False, admin_token=""):
+    import gradio as gr
 
-def run_build(input_file):
     if input_file is None:
-        return None, "⚠️ Файл не загружен.", gr.update(visible=False, value=None)
+        return None, "⚠️ Файл не загружен.", gr.update(visible=False, value=None), gr.update(visible=False, value=None)
 
     try:
-        wb = ess.build_summary_table(input_file.name)
-
-        # Сохраняем с понятным именем
+        # Сохраняем с понятным именем (xlsx - с оформлением, остальные форматы - только данные)
         original_name = os.path.splitext(os.path.basename(input_file.name))[0]
-        out_path = os.path.join(tempfile.gettempdir(), f"{original_name}_свод.xlsx")
-        wb.save(out_path)
+        out_path = os.path.join(tempfile.gettempdir(), f"{original_name}_свод.{output_format}")
+
+        # Профиль сборки (по флагу администратора или SUMMARY_PROFILE) сохраняется рядом с результатом
+        profile_format = summary_profiling.requested_profile_format(profile, admin_token)
+        profile_path = summary_profiling.profile_path_for(out_path, profile_format) if profile_format else None
+        ess.export_summary_with_admission(input_file.name, out_path, output_format, profile_path=profile_path)
 
-        return out_path, "✅ Готово! Нажмите кнопку ниже для скачивания.", gr.update(visible=True, value=out_path)
+        status_text = "✅ Готово! Нажмите кнопку ниже для скачивания."
+        profile_update = gr.update(visible=False, value=None)
+        if profile_path and os.path.exists(profile_path):
+            profile_update = gr.update(visible=True, value=[profile_path, profile_path + summary_profiling.TIMINGS_SUFFIX])
+        elif profile and not profile_format:
+            status_text += " Профилирование не выполнено: неверный токен администратора."
+        return out_path, status_text, gr.update(visible=True, value=out_path), profile_update
+    except ess.AdmissionError as e:
+        return None, f"⛔ {e}", gr.update(visible=False, value=None), gr.update(visible=False, value=None)
     except Exception as e:
-        return None, f"❌ Ошибка: {e}", gr.update(visible=False, value=None)
-
-with gr.Blocks(title="Свод КП", css="""
-    .yellow-button {background-color: #FFD700 !important; color: black !important; font-weight: bold !important;}
-    .input-section {border: 2px solid #4CAF50; border-radius: 10px; padding: 20px; background-color: #f0f8f0;}
-    .output-section {border: 2px solid #2196F3; border-radius: 10px; padding: 20px; background-color: #f0f4ff;}
-    .info-section {border: 2px solid #FF9800; border-radius: 10px; padding: 20px; background-color: #fff8e1;}
-""") as demo:
-    gr.Markdown("## 📊 Свод КП из выгрузки ЯЗакупок (YP)")
+        return None, f"❌ Ошибка: {e}", gr.update(visible=False, value=None), gr.update(visible=False, value=None)
+
+def build_interface():
+    import gradio as gr
+
+    with gr.Blocks(title="Свод КП", css="""
+        .yellow-button {background-color: #FFD700 !important; color: black !important; font-weight: bold !important;}
+        .input-section {border: 2px solid #4CAF50; border-radius: 10px; padding: 20px; background-color: #f0f8f0;}
+        .output-section {border: 2px solid #2196F3; border-radius: 10px; padding: 20px; background-color: #f0f4ff;}
+        .info-section {border: 2px solid #FF9800; border-radius: 10px; padding: 20px; background-color: #fff8e1;}
+    """) as demo:
+        gr.Markdown("## 📊 Свод КП из выгрузки ЯЗакупок (YP)")
     
-    with gr.Group(elem_classes="info-section"):
-        gr.Markdown("""
-        ### ⚠️ Важная информация
+        with gr.Group(elem_classes="info-section"):
+            gr.Markdown("""
+            ### ⚠️ Важная информация
         
-        1. **Загружайте Excel, выгруженный из ЯЗакупок БЕЗ изменений в нем**
-        2. Программа переформатирует только выгруженный Excel. Если КП не попали в Excel, то их и не будет в своде
-        3. Программа показывает цены в рублях, однако вы можете загружать в нее любую валюту. Необходимо будет вручную изменить валюту в Excel
-        4. **Проверяйте наличие всех позиций в переформатированном своде**
-        """)
+            1. **Загружайте Excel, выгруженный из ЯЗакупок БЕЗ изменений в нем**
+            2. Программа переформатирует только выгруженный Excel. Если КП не попали в Excel, то их и не будет в своде
+            3. Программа показывает цены в рублях без НДС: валюта и НДС определяются по заголовку колонки цены ("Цена, USD с НДС") или по самой цене ("95,50 €"), пересчет - по курсам из fx_rates.json. Проверьте курсы перед сравнением
+            4. **Проверяйте наличие всех позиций в переформатированном своде**
+            """)
     
-    with gr.Group(elem_classes="input-section"):
-        gr.Markdown("### 📥 Шаг 1: Загрузите файл")
-        file_in = gr.File(label="Выберите Excel файл (.xlsx)", file_types=[".xlsx"])
-        run_btn = gr.Button("▶️ Собрать свод", elem_classes="yellow-button", size="lg")
+        with gr.Group(elem_classes="input-section"):
+            gr.Markdown("### 📥 Шаг 1: Загрузите файл")
+            file_in = gr.File(label="Выберите Excel файл (.xlsx)", file_types=[".xlsx"])
+            format_in = gr.Dropdown(
+                label="Формат результата",
+                choices=[("Excel (.xlsx) с оформлением", "xlsx"), ("CSV (только данные)", "csv"),
+                         ("JSON Lines (только данные)", "jsonl"), ("Parquet (только данные)", "parquet")],
+                value="xlsx"
+            )
+            with gr.Accordion("Администрирование", open=False):
+                profile_in = gr.Checkbox(label="Профилировать сборку (профиль и тайминги этапов)", value=False)
+                admin_token_in = gr.Textbox(label="Токен администратора", type="password")
+            run_btn = gr.Button("▶️ Собрать свод", elem_classes="yellow-button", size="lg")
     
-    status = gr.Textbox(label="Статус обработки", interactive=False)
+        status = gr.Textbox(label="Статус обработки", interactive=False)
     
-    with gr.Group(elem_classes="output-section"):
-        gr.Markdown("### 📤 Шаг 2: Скачайте результат")
-        file_out = gr.File(label="Готовый файл", elem_id="file_out")
-        download_btn = gr.DownloadButton("⬇️ Скачать результат", elem_classes="yellow-button", size="lg", visible=False)
+        with gr.Group(elem_classes="output-section"):
+            gr.Markdown("### 📤 Шаг 2: Скачайте результат")
+            file_out = gr.File(label="Готовый файл", elem_id="file_out")
+            download_btn = gr.DownloadButton("⬇️ Скачать результат", elem_classes="yellow-button", size="lg", visible=False)
+            profile_out = gr.File(label="Профиль сборки", file_count="multiple", visible=False)
+
+        run_btn.click(
+            run_build,
+            inputs=[file_in, format_in, profile_in, admin_token_in],
+            outputs=[file_out, status, download_btn, profile_out]
+        )
 
-    run_btn.click(
-        run_build,
-        inputs=file_in,
-        outputs=[file_out, status, download_btn]
-    )
+    return demo
 
 if __name__ == "__main__":
-    demo.launch()
+    multiprocessing.freeze_support()
+    # Сборки выполняются в пуле прогретых процессов: прогреваем его до первого запроса
+    pool = summary_workers.get_worker_pool()
+    if pool is not None:
+        pool.start()
+    build_interface().launch()
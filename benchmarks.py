@@ -0,0 +1,314 @@
+# benchmarks.py
+"""
+Бенчмарки оптимизаций сопоставления товаров.
+
+Запуск:
+    python benchmarks.py classification [количество названий]
+    python benchmarks.py fuzzy [размер каталога] [количество запросов]
+    python benchmarks.py reader [поставщиков] [строк на лист]
+    python benchmarks.py reader_memory [поставщиков] [строк на лист]
+"""
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill
+
+import excel_summary_script as ess
+import xlsx_stream_reader
+
+# Фрагменты для генерации синтетических названий товаров
+NAME_PARTS = [
+    'Монитор', 'Dell', 'P2422HE', '24"', 'Кабель', 'USB', 'Type-C', '2м', 'SSD', 'накопитель',
+    'Samsung', '1TB', 'Телевизор', 'LG', 'OLED', '55"', 'Зарядное', 'устройство', '65W', 'Наушники',
+    'Sony', 'WH-1000XM5', 'Клавиатура', 'Logitech', 'K120', 'Мышь', 'беспроводная', 'Адаптер',
+    'питания', '220V', 'HDMI', '4K', '144Hz', 'Твердотельный', 'Kingston', 'Гарнитура', 'Шнур',
+    'PlayStation', 'геймпад', 'Блок', 'черный', 'белый', 'комплект', 'Ugreen', 'Baseus', 'IPS'
+]
+
+
+def generate_product_names(count, seed=42):
+    """
+    Генерирует синтетические названия товаров.
+
+    Args:
+        count: Количество названий
+        seed: Зерно генератора случайных чисел
+
+    Returns:
+        list: Список названий
+    """
+    rnd = random.Random(seed)
+    return [' '.join(rnd.sample(NAME_PARTS, rnd.randint(2, 7))) for _ in range(count)]
+
+
+def _legacy_word_weight(word):
+    """Исходная реализация determine_word_weight: 17 отдельных re.search на слово."""
+    rules = ess.current_rules()
+    word_lower = word.lower()
+    if word_lower in rules['word_weight_category_keywords']:
+        return 3
+    for pattern in rules['technical_patterns']:
+        if re.search(pattern, word_lower):
+            return 2
+    return 1
+
+
+def _legacy_classify(name):
+    """Исходная логика: вложенные проверки подстрок по категориям, веса слов и признак ТВ."""
+    clean_name = ess.clean_text_for_comparison(name)
+    categories = set()
+    for category_name, category_info in ess.current_rules()['product_categories'].items():
+        for keyword in category_info['keywords']:
+            if any(keyword.lower() in word.lower() for word in clean_name.split()):
+                categories.add(category_name)
+                break
+    weights = {word: _legacy_word_weight(word) for word in clean_name.split()}
+    is_tv = any(tv_keyword in name.upper() for tv_keyword in ['OLED', 'LG', 'ТЕЛЕВИЗОР'])
+    return weights, frozenset(categories), is_tv
+
+
+def benchmark_classification(count=100000):
+    """
+    Сравнивает исходную классификацию названий с объединенным однопроходным классификатором.
+
+    Args:
+        count: Количество названий
+
+    Returns:
+        dict: Время обоих вариантов и количество расхождений
+    """
+    names = generate_product_names(count)
+
+    ess._clean_text_cached.cache_clear()
+    started = time.perf_counter()
+    legacy_results = [_legacy_classify(name) for name in names]
+    legacy_time = time.perf_counter() - started
+
+    # Холодный кэш, чтобы сравнение было честным
+    ess._classify_product_name_cached.cache_clear()
+    ess._determine_word_weight_cached.cache_clear()
+    ess._clean_text_cached.cache_clear()
+    started = time.perf_counter()
+    new_results = [ess.classify_product_name(name) for name in names]
+    new_time = time.perf_counter() - started
+
+    mismatches = 0
+    for legacy, new in zip(legacy_results, new_results):
+        if legacy != (new['weights'], new['categories'], new['is_tv']):
+            mismatches += 1
+
+    return {
+        'names': count,
+        'legacy_seconds': legacy_time,
+        'combined_seconds': new_time,
+        'speedup': legacy_time / new_time if new_time else float('inf'),
+        'mismatches': mismatches
+    }
+
+
+def _perturb_model_number(name, rnd):
+    """Вносит в название искажение, типичное для КП: пробел/дефис в артикуле или опечатку."""
+    words = name.split()
+    index = max(range(len(words)), key=lambda i: sum(ch.isdigit() for ch in words[i]))
+    word = words[index]
+    kind = rnd.choice(['space', 'dash', 'typo'])
+    position = rnd.randint(1, len(word) - 1)
+    if kind == 'space':
+        word = word[:position] + ' ' + word[position:]
+    elif kind == 'dash':
+        word = word[:position] + '-' + word[position:]
+    else:
+        word = word[:position] + rnd.choice('0123456789ABCDEFGHKLMNPRSTUVXZ') + word[position + 1:]
+    words[index] = word
+    return ' '.join(words)
+
+
+def benchmark_fuzzy(catalog_size=20000, queries=500):
+    """
+    Оценивает точность и скорость генератора кандидатов MinHash/LSH
+    против полного перебора с точным коэффициентом Жаккара.
+
+    Args:
+        catalog_size: Количество названий в каталоге
+        queries: Количество искаженных названий для поиска
+
+    Returns:
+        dict: Полнота, точность и время LSH и полного перебора
+    """
+    rnd = random.Random(7)
+    settings = ess.current_rules()['fuzzy']
+    letters = 'ABCDEFGHKLMNPRSTUVXZ'
+    catalog = []
+    for name in generate_product_names(catalog_size):
+        model = ''.join(rnd.choice(letters) for _ in range(rnd.randint(1, 3))) + str(rnd.randint(100, 99999)) + \
+            ''.join(rnd.choice(letters) for _ in range(rnd.randint(0, 2)))
+        catalog.append(f"{name} {model}")
+    catalog = list(dict.fromkeys(catalog))
+    targets = rnd.sample(catalog, min(queries, len(catalog)))
+    query_names = [_perturb_model_number(target, rnd) for target in targets]
+
+    started = time.perf_counter()
+    lsh_index = ess.create_lsh_index(settings)
+    for name in catalog:
+        ess.lsh_add(lsh_index, name)
+    build_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    lsh_results = [ess.lsh_query(lsh_index, name) for name in query_names]
+    query_time = time.perf_counter() - started
+
+    # Полный перебор: точный коэффициент Жаккара со всеми названиями каталога
+    catalog_shingles = [(name, ess.name_shingles(name, settings['ngram'])) for name in catalog]
+    brute_queries = query_names[:min(50, len(query_names))]
+    started = time.perf_counter()
+    brute_results = []
+    for name in brute_queries:
+        shingles = ess.name_shingles(name, settings['ngram'])
+        matches = set()
+        for candidate, candidate_shingles in catalog_shingles:
+            union = len(shingles | candidate_shingles)
+            if union and len(shingles & candidate_shingles) / union >= settings['min_jaccard']:
+                matches.add(candidate)
+        brute_results.append(matches)
+    brute_time = time.perf_counter() - started
+
+    recall_target = sum(1 for target, found in zip(targets, lsh_results) if target in found) / len(targets)
+    exact_pairs = sum(len(matches) for matches in brute_results)
+    found_pairs = sum(len(matches & set(found)) for matches, found in zip(brute_results, lsh_results))
+    reported_pairs = sum(len(found) for found in lsh_results[:len(brute_results)])
+
+    return {
+        'catalog_size': len(catalog),
+        'queries': len(query_names),
+        'recall_true_duplicate': recall_target,
+        'recall_vs_brute_force': found_pairs / exact_pairs if exact_pairs else 1.0,
+        'precision_vs_brute_force': found_pairs / reported_pairs if reported_pairs else 1.0,
+        'lsh_build_seconds': build_time,
+        'lsh_query_ms': query_time / len(query_names) * 1000,
+        'brute_force_query_ms': brute_time / len(brute_queries) * 1000,
+        'query_speedup': (brute_time / len(brute_queries)) / (query_time / len(query_names))
+    }
+
+
+def generate_tender_export(path, suppliers=20, rows=2000, seed=11):
+    """
+    Создает синтетическую выгрузку ЯЗакупок: информационный лист и листы поставщиков,
+    где каждая пятая строка - аналог с желтой заливкой.
+
+    Args:
+        path: Путь к создаваемому файлу
+        suppliers: Количество листов поставщиков
+        rows: Количество строк на листе поставщика
+        seed: Зерно генератора случайных чисел
+    """
+    rnd = random.Random(seed)
+    names = generate_product_names(rows, seed=seed)
+    yellow_fill = PatternFill(start_color='FFFFFF00', end_color='FFFFFF00', fill_type='solid')
+
+    wb = openpyxl.Workbook(write_only=True)
+    info = wb.create_sheet('Информация')
+    info.append(['Закупка', 'Синтетическая'])
+    for supplier in range(1, suppliers + 1):
+        ws = wb.create_sheet(f"Поставщик {supplier}")
+        ws.append(['Наименование', 'Кол-во запрошенное', 'Кол-во предложенное', 'Цена', 'Срок', 'Комментарий'])
+        for index, name in enumerate(names):
+            name_cell = WriteOnlyCell(ws, value=name)
+            if index % 5 == 4:
+                name_cell.fill = yellow_fill
+            ws.append([name_cell, rnd.randint(1, 50), rnd.randint(1, 50), round(rnd.uniform(100, 99999), 2),
+                       f"{rnd.randint(1, 60)} дней", 'в наличии' if rnd.random() < 0.3 else None])
+    wb.save(path)
+
+
+def benchmark_reader(suppliers=20, rows=2000):
+    """
+    Сравнивает чтение листов поставщиков через openpyxl и потоковый XML-читатель.
+
+    Args:
+        suppliers: Количество листов поставщиков
+        rows: Количество строк на листе
+
+    Returns:
+        dict: Время обоих вариантов и количество расхождений в строках
+    """
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        generate_tender_export(path, suppliers, rows)
+
+        started = time.perf_counter()
+        wb = openpyxl.load_workbook(path)
+        openpyxl_rows = {name: list(ess.iter_supplier_rows(wb, name)) for name in wb.sheetnames[1:]}
+        openpyxl_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        stream_wb = xlsx_stream_reader.load_stream_workbook(path)
+        stream_rows = {name: list(ess.iter_supplier_rows(stream_wb, name)) for name in stream_wb.sheetnames[1:]}
+        stream_time = time.perf_counter() - started
+    finally:
+        os.remove(path)
+
+    mismatches = sum(1 for name, sheet_rows in openpyxl_rows.items()
+                     for left, right in zip(sheet_rows, stream_rows[name]) if left != right)
+    return {
+        'rows': suppliers * rows,
+        'openpyxl_seconds': openpyxl_time,
+        'stream_seconds': stream_time,
+        'speedup': openpyxl_time / stream_time if stream_time else float('inf'),
+        'mismatches': mismatches
+    }
+
+
+def benchmark_reader_memory(suppliers=20, rows=2000):
+    """
+    Сравнивает пиковое потребление памяти Python (tracemalloc) при чтении выгрузки
+    через openpyxl и потоковый читатель.
+
+    Args:
+        suppliers: Количество листов поставщиков
+        rows: Количество строк на листе
+
+    Returns:
+        dict: Размер файла и пиковая память каждого способа в МБ
+    """
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    result = {'rows': suppliers * rows}
+    try:
+        generate_tender_export(path, suppliers, rows)
+        result['file_mb'] = os.path.getsize(path) / 2 ** 20
+        for reader in ('openpyxl', 'stream'):
+            tracemalloc.start()
+            wb = ess.load_source_workbook(path, reader=reader)
+            for sheet_name in wb.sheetnames[1:]:
+                for _ in ess.iter_supplier_rows(wb, sheet_name):
+                    pass
+            result[f"{reader}_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+            del wb
+    finally:
+        os.remove(path)
+    return result
+
+
+BENCHMARKS = {
+    'classification': benchmark_classification,
+    'fuzzy': benchmark_fuzzy,
+    'reader': benchmark_reader,
+    'reader_memory': benchmark_reader_memory,
+}
+
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else 'classification'
+    args = [int(arg) for arg in sys.argv[2:]]
+    result = BENCHMARKS[name](*args)
+    for key, value in result.items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
@@ -1,10 +1,457 @@
 
+import hashlib
+import json
 import os
+import random
+import re
 import tempfile
-from flask import Flask, request, render_template_string, send_file, flash, redirect, url_for
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from copy import copy
+from functools import lru_cache
+from types import MappingProxyType
+from flask import Flask, request, render_template_string, send_file, flash, redirect, url_for, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import get_input_stream
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Alignment, Border, Side, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+import summary_profiling
+import summary_workers
+import summary_writers
+import xlsx_stream_reader
+
+# Инструментирование сборки свода: счетчики и тайминги этапов.
+# Хранится отдельно для каждого потока, чтобы параллельные запросы веб-приложения не смешивались.
+_build_stats = threading.local()
+
+def reset_build_stats():
+    """
+    Сбрасывает счетчики, тайминги этапов и кэш оценок пар текущей сборки.
+    """
+    _build_stats.counters = {}
+    _build_stats.stage_timings = {}
+    _build_stats.pair_scores = OrderedDict()
+
+def increment_stat(name, amount=1):
+    """
+    Увеличивает счетчик инструментирования.
+    
+    Args:
+        name: Название счетчика
+        amount: Величина увеличения (по умолчанию 1)
+    """
+    if not hasattr(_build_stats, 'counters'):
+        reset_build_stats()
+    _build_stats.counters[name] = _build_stats.counters.get(name, 0) + amount
+
+def get_build_stats():
+    """
+    Возвращает копию собранных счетчиков и таймингов этапов.
+    
+    Returns:
+        dict: {'counters': {...}, 'stage_timings': {этап: секунды}}
+    """
+    if not hasattr(_build_stats, 'counters'):
+        reset_build_stats()
+    return {
+        'counters': dict(_build_stats.counters),
+        'stage_timings': dict(_build_stats.stage_timings)
+    }
+
+@contextmanager
+def stage_timer(stage_name):
+    """
+    Замеряет время выполнения этапа и добавляет его к таймингам сборки.
+    
+    Args:
+        stage_name: Название этапа
+    """
+    check_build_budget()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_timing(stage_name, time.perf_counter() - started)
+
+def add_stage_timing(stage_name, seconds):
+    """
+    Добавляет длительность к таймингу этапа.
+    
+    Args:
+        stage_name: Название этапа
+        seconds: Длительность в секундах
+    """
+    if not hasattr(_build_stats, 'counters'):
+        reset_build_stats()
+    _build_stats.stage_timings[stage_name] = _build_stats.stage_timings.get(stage_name, 0.0) + seconds
+
+@contextmanager
+def build_profiler(profile_path):
+    """
+    Профилирует сборку семплирующим профилировщиком и сохраняет профиль
+    вместе с таймингами этапов (см. summary_profiling.save_profile).
+    Без пути или внутри уже профилируемой сборки ничего не делает.
+    
+    Args:
+        profile_path: Путь к файлу профиля (формат - по расширению) или None
+    """
+    if not profile_path or summary_profiling.is_profiling():
+        yield
+        return
+    profiler = summary_profiling.SamplingProfiler()
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        # Профиль сохраняется и для упавшей сборки; ошибка записи профиля не скрывает ошибку сборки
+        try:
+            summary_profiling.save_profile(profiler, profile_path, get_build_stats())
+            print(f"Профиль сборки сохранен: {profile_path} ({profiler.sample_count} отсчетов)")
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить профиль {profile_path}: {e}")
+
+# Контроль допуска: стоимость сборки оценивается по объему листов и числу аналогов до обработки.
+# Сборки в пределах ADMISSION_BUDGETS идут в обычную очередь, в пределах ADMISSION_LIMITS -
+# в очередь низкого приоритета, сверх лимитов отклоняются с понятным сообщением.
+# Лимиты задаются переменными SUMMARY_BUDGET_<РЕСУРС> и SUMMARY_LIMIT_<РЕСУРС> (например, SUMMARY_LIMIT_ROWS).
+def _env_limits(prefix, defaults):
+    return {name: int(os.environ.get(f"{prefix}{name.upper()}", value)) for name, value in defaults.items()}
+
+ADMISSION_BUDGETS = _env_limits('SUMMARY_BUDGET_', {
+    'rows': 50000,
+    'cells': 500000,
+    'merged_ranges': 2000,
+    'uncompressed_bytes': 100 * 1024 * 1024,
+    'comparisons': 2000000
+})
+ADMISSION_LIMITS = _env_limits('SUMMARY_LIMIT_', {
+    'rows': 500000,
+    'cells': 5000000,
+    'merged_ranges': 20000,
+    'uncompressed_bytes': 1024 * 1024 * 1024,
+    'comparisons': 20000000
+})
+
+ADMISSION_RESOURCE_LABELS = {
+    'rows': 'строк',
+    'cells': 'ячеек',
+    'merged_ranges': 'объединенных диапазонов',
+    'uncompressed_bytes': 'байт XML листов',
+    'comparisons': 'сравнений аналогов'
+}
+
+# Предельное время сборки по очередям (секунды)
+BUILD_DEADLINE_SECONDS = {
+    'normal': int(os.environ.get('SUMMARY_DEADLINE_SECONDS', 300)),
+    'low': int(os.environ.get('SUMMARY_LOW_PRIORITY_DEADLINE_SECONDS', 1800))
+}
+
+# Очередь низкого приоритета: сколько больших сводов строится одновременно и сколько ждать места
+LOW_PRIORITY_WORKERS = int(os.environ.get('SUMMARY_LOW_PRIORITY_WORKERS', 1))
+LOW_PRIORITY_WAIT_SECONDS = int(os.environ.get('SUMMARY_LOW_PRIORITY_WAIT_SECONDS', 120))
+
+_low_priority_slots = threading.BoundedSemaphore(LOW_PRIORITY_WORKERS)
+
+# Лимиты текущей сборки (срок и число сравнений) - отдельно для каждого потока
+_build_limits = threading.local()
+
+class AdmissionError(ValueError):
+    """Сборка отклонена контролем допуска или прервана по лимиту; status_code - HTTP-код ответа."""
+
+    def __init__(self, message, status_code=413):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def __reduce__(self):
+        # Код ответа сохраняется при передаче ошибки из процесса пула (см. summary_workers)
+        return type(self), (str(self), self.status_code)
+
+def _format_resource(name, value):
+    return f"{value:,} {ADMISSION_RESOURCE_LABELS[name]}".replace(',', ' ')
+
+def estimate_build_cost(filename):
+    """
+    Оценивает стоимость сборки по объему листов, не разбирая их (см. xlsx_stream_reader.scan_sheet_costs).
+    
+    Число сравнений аналогов оценивается как в check_comparison_estimate: аналоги × основные товары.
+    Поставщики обычно предлагают одни и те же позиции, поэтому оба множителя берутся по самому
+    длинному листу поставщика (аналоги - желтые наименования) - это нижняя граница.
+    Аналоги, отмеченные только отступом, здесь не видны - их учитывает check_comparison_estimate
+    после группировки.
+    
+    Args:
+        filename: Путь к выгрузке или список путей для объединения выгрузок
+        
+    Returns:
+        dict: {'rows', 'cells', 'merged_ranges', 'uncompressed_bytes' - суммы по листам,
+               'comparisons': оценка числа сравнений аналогов, 'analogs', 'main_products': ее множители,
+               'sheets': число листов, 'complete': False, если подсчет прерван на лимите объема}
+    """
+    paths = filename if isinstance(filename, (list, tuple)) else [filename]
+    estimate = {'rows': 0, 'cells': 0, 'merged_ranges': 0, 'uncompressed_bytes': 0, 'analogs': 0,
+                'main_products': 0, 'sheets': 0, 'complete': True}
+    for path in paths:
+        costs = xlsx_stream_reader.scan_sheet_costs(path, max_bytes=ADMISSION_LIMITS['uncompressed_bytes'])
+        for index, cost in enumerate(costs):
+            for name in ('rows', 'cells', 'merged_ranges', 'uncompressed_bytes'):
+                estimate[name] += cost[name]
+            # Первый лист - информация о закупке, товары и аналоги только на листах поставщиков
+            if index > 0:
+                estimate['analogs'] = max(estimate['analogs'], cost['yellow_name_cells'])
+                estimate['main_products'] = max(estimate['main_products'],
+                                                cost['name_cells'] - cost['yellow_name_cells'])
+            estimate['sheets'] += 1
+            estimate['complete'] = estimate['complete'] and cost['complete']
+    estimate['comparisons'] = estimate['analogs'] * estimate['main_products']
+    return estimate
+
+def admit_build(filename):
+    """
+    Этап допуска: оценивает стоимость сборки и выбирает очередь.
+    
+    Args:
+        filename: Путь к выгрузке или список путей для объединения выгрузок
+        
+    Returns:
+        dict: Оценка (см. estimate_build_cost) и 'priority' ('normal' или 'low'), 'deadline_seconds'
+        
+    Raises:
+        AdmissionError: Выгрузка превышает ADMISSION_LIMITS
+        XlsxShapeError: Файл не является xlsx ожидаемой структуры
+    """
+    estimate = estimate_build_cost(filename)
+    over_limit = [name for name in ADMISSION_BUDGETS if estimate[name] > ADMISSION_LIMITS[name]]
+    if over_limit or not estimate['complete']:
+        over_limit = over_limit or ['uncompressed_bytes']
+        details = ', '.join(f"{_format_resource(name, estimate[name])} (допустимо до "
+                            f"{_format_resource(name, ADMISSION_LIMITS[name])})" for name in over_limit)
+        raise AdmissionError(f"Выгрузка слишком велика для построения свода: {details}. "
+                             f"Разделите закупку на несколько выгрузок.")
+    
+    over_budget = [name for name in ADMISSION_BUDGETS if estimate[name] > ADMISSION_BUDGETS[name]]
+    estimate['priority'] = 'low' if over_budget else 'normal'
+    estimate['deadline_seconds'] = BUILD_DEADLINE_SECONDS[estimate['priority']]
+    if over_budget:
+        print(f"Большая выгрузка ({', '.join(_format_resource(name, estimate[name]) for name in over_budget)}) - "
+              f"очередь низкого приоритета")
+    return estimate
+
+@contextmanager
+def build_limits(deadline_seconds, comparison_limit=None):
+    """
+    Ограничивает сборку в текущем потоке сроком и числом сравнений аналогов.
+    Проверки выполняются в check_build_budget на границах этапов и в циклах сборки.
+    
+    Args:
+        deadline_seconds: Предельное время сборки в секундах
+        comparison_limit: Предельное число сравнений (по умолчанию ADMISSION_LIMITS['comparisons'])
+    """
+    _build_limits.deadline = time.monotonic() + deadline_seconds
+    _build_limits.deadline_seconds = deadline_seconds
+    _build_limits.comparisons = comparison_limit or ADMISSION_LIMITS['comparisons']
+    try:
+        yield
+    finally:
+        _build_limits.deadline = None
+
+@contextmanager
+def low_priority_slot(wait_seconds=None):
+    """
+    Место в очереди низкого приоритета: одновременно строится не больше LOW_PRIORITY_WORKERS больших сводов.
+    
+    Raises:
+        AdmissionError: Место не освободилось за wait_seconds (по умолчанию LOW_PRIORITY_WAIT_SECONDS)
+    """
+    if not _low_priority_slots.acquire(timeout=LOW_PRIORITY_WAIT_SECONDS if wait_seconds is None else wait_seconds):
+        raise AdmissionError('Очередь больших выгрузок занята, повторите попытку позже', 503)
+    try:
+        yield
+    finally:
+        _low_priority_slots.release()
+
+def check_build_budget():
+    """
+    Прерывает сборку, если истек срок или превышен бюджет сравнений (см. build_limits).
+    Вне build_limits ничего не делает.
+    
+    Raises:
+        AdmissionError: Лимит сборки исчерпан
+    """
+    deadline = getattr(_build_limits, 'deadline', None)
+    if deadline is None:
+        return
+    if time.monotonic() > deadline:
+        raise AdmissionError(f"Построение свода не уложилось в {_build_limits.deadline_seconds} с и остановлено. "
+                             f"Разделите закупку на несколько выгрузок.", 504)
+    comparisons = getattr(_build_stats, 'counters', {}).get('similarity_comparisons', 0)
+    if comparisons > _build_limits.comparisons:
+        raise AdmissionError(f"Сопоставление аналогов превысило бюджет: "
+                             f"{_format_resource('comparisons', _build_limits.comparisons)}")
+
+def check_comparison_estimate(main_products_count, analogs_count, leftovers_count=0):
+    """
+    Отклоняет сборку до сопоставления, если аналогов и основных товаров столько,
+    что число сравнений (аналоги × основные товары) превышает бюджет текущей сборки.
+    При глобальном назначении к оценке добавляются попарные сравнения аналогов,
+    не привязанных к основным товарам (leftovers_count² / 2), - перед их кластеризацией.
+    
+    Raises:
+        AdmissionError: Оценка числа сравнений больше лимита
+    """
+    if getattr(_build_limits, 'deadline', None) is None:
+        return
+    leftover_pairs = leftovers_count * (leftovers_count - 1) // 2
+    estimate = main_products_count * analogs_count + leftover_pairs
+    if estimate > _build_limits.comparisons:
+        details = f"{analogs_count} аналогов × {main_products_count} основных товаров"
+        if leftover_pairs:
+            details += f" + пары {leftovers_count} непривязанных аналогов"
+        raise AdmissionError(f"Слишком много аналогов для сопоставления: {details} = "
+                             f"{_format_resource('comparisons', estimate)} "
+                             f"(допустимо до {_format_resource('comparisons', _build_limits.comparisons)})")
+
+# Правила сопоставления (синонимы, стоп-слова, категории, пороги) хранятся во внешнем файле
+DEFAULT_MATCHING_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'matching_rules.json')
+
+# Настройки нечеткого сопоставления, если в файле правил нет раздела "fuzzy"
+DEFAULT_FUZZY_SETTINGS = {
+    'enabled': False,
+    'ngram': 3,
+    'num_perm': 64,
+    'bands': 16,
+    'min_jaccard': 0.5,
+    'seed': 1
+}
+_MINHASH_PRIME = (1 << 61) - 1
+
+_matching_rules_cache = {}  # {путь: (mtime_ns, скомпилированные правила)}
+_matching_rules_by_key = {}  # {cache_key: скомпилированные правила} - для кэшей, зависящих от правил
+_matching_rules_lock = threading.Lock()
+_active_rules = threading.local()
+
+def _compile_matching_rules(raw_rules, source_path):
+    """
+    Компилирует загруженные правила в неизменяемые структуры для быстрого поиска.
+    
+    Args:
+        raw_rules: Словарь правил из JSON-файла
+        source_path: Путь к файлу правил
+        
+    Returns:
+        MappingProxyType: Неизменяемый словарь скомпилированных правил
+    """
+    version = str(raw_rules['version'])
+    content_hash = hashlib.sha1(json.dumps(raw_rules, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+    
+    product_categories = {}
+    category_keyword_index = {}
+    for category in raw_rules['product_categories']:
+        keywords = tuple(category['keywords'])
+        product_categories[category['name']] = MappingProxyType({
+            'keywords': keywords,
+            'standard_name': category['standard_name']
+        })
+        for keyword in keywords:
+            category_keyword_index.setdefault(keyword.lower(), []).append(category['name'])
+    
+    technical_patterns = tuple(raw_rules['technical_patterns'])
+    tv_keywords = tuple(raw_rules['tv_keywords'])
+    
+    # Нечеткое сопоставление (MinHash + LSH): коэффициенты хеш-функций генерируются детерминированно
+    fuzzy = dict(DEFAULT_FUZZY_SETTINGS)
+    fuzzy.update(raw_rules.get('fuzzy', {}))
+    if fuzzy['num_perm'] % fuzzy['bands'] != 0:
+        raise ValueError(f"fuzzy.num_perm ({fuzzy['num_perm']}) должно делиться на fuzzy.bands ({fuzzy['bands']})")
+    coefficients_rng = random.Random(fuzzy['seed'])
+    fuzzy['coefficients'] = tuple(
+        (coefficients_rng.randrange(1, _MINHASH_PRIME), coefficients_rng.randrange(0, _MINHASH_PRIME))
+        for _ in range(fuzzy['num_perm'])
+    )
+    
+    return MappingProxyType({
+        'version': version,
+        'cache_key': f"{version}:{content_hash}",
+        'source_path': source_path,
+        'stop_words': frozenset(raw_rules['stop_words']),
+        'min_word_length': int(raw_rules['min_word_length']),
+        'synonyms': MappingProxyType({word: tuple(values) for word, values in raw_rules['synonyms'].items()}),
+        'word_weight_category_keywords': frozenset(raw_rules['word_weight_category_keywords']),
+        'technical_patterns': technical_patterns,
+        # Все технические шаблоны объединены в одно регулярное выражение: один поиск вместо 17
+        'technical_patterns_re': re.compile('|'.join(technical_patterns)),
+        'product_categories': MappingProxyType(product_categories),
+        'category_keyword_index': MappingProxyType({keyword: tuple(names) for keyword, names in category_keyword_index.items()}),
+        'category_matcher': _build_keyword_matcher(category_keyword_index.keys()),
+        'tv_keywords': tv_keywords,
+        'tv_keywords_re': re.compile('|'.join(re.escape(keyword) for keyword in tv_keywords)),
+        'quantity_similarity': MappingProxyType(dict(raw_rules['quantity_similarity'])),
+        'blends': MappingProxyType(dict(raw_rules['blends'])),
+        'thresholds': MappingProxyType(dict(raw_rules['thresholds'])),
+        'fuzzy': MappingProxyType(fuzzy)
+    })
+
+def get_matching_rules(rules_path=None):
+    """
+    Возвращает скомпилированные правила сопоставления.
+    Файл перечитывается, только если он изменился с момента последней загрузки (горячая перезагрузка).
+    
+    Args:
+        rules_path: Путь к файлу правил (по умолчанию MATCHING_RULES_PATH или matching_rules.json рядом со скриптом)
+        
+    Returns:
+        MappingProxyType: Скомпилированные правила
+    """
+    rules_path = os.path.abspath(rules_path or os.environ.get('MATCHING_RULES_PATH') or DEFAULT_MATCHING_RULES_PATH)
+    mtime = os.stat(rules_path).st_mtime_ns
+    
+    cached = _matching_rules_cache.get(rules_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    
+    with _matching_rules_lock:
+        cached = _matching_rules_cache.get(rules_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(rules_path, encoding='utf-8') as rules_file:
+            rules = _compile_matching_rules(json.load(rules_file), rules_path)
+        _matching_rules_cache[rules_path] = (mtime, rules)
+        _matching_rules_by_key[rules['cache_key']] = rules
+        print(f"Загружены правила сопоставления версии {rules['version']} из {rules_path}")
+        return rules
+
+def activate_matching_rules(rules_path=None):
+    """
+    Делает правила активными для текущего потока (вызывается в начале каждой сборки свода).
+    
+    Args:
+        rules_path: Путь к файлу правил (опционально)
+        
+    Returns:
+        MappingProxyType: Активные правила
+    """
+    _active_rules.rules = get_matching_rules(rules_path)
+    return _active_rules.rules
+
+def current_rules():
+    """
+    Возвращает правила, активные в текущем потоке.
+    
+    Returns:
+        MappingProxyType: Скомпилированные правила
+    """
+    rules = getattr(_active_rules, 'rules', None)
+    if rules is None:
+        rules = activate_matching_rules()
+    return rules
 
 def apply_borders_to_range(worksheet, start_row, start_col, end_row, end_col):
     """
@@ -48,6 +495,23 @@ def apply_currency_format_to_price_columns(worksheet, headers_row_2, start_data_
                 cell = worksheet.cell(row=row, column=col_idx)
                 cell.number_format = currency_format
 
+def apply_currency_format_to_metric_columns(worksheet, metric_start_col, start_data_row, end_data_row):
+    """
+    Применяет валютный формат к денежным расчетным колонкам (см. PRICE_METRIC_HEADERS).
+    
+    Args:
+        worksheet: Лист Excel для форматирования
+        metric_start_col: Первая расчетная колонка (1-based)
+        start_data_row: Начальная строка с данными (1-based)
+        end_data_row: Конечная строка с данными (1-based)
+    """
+    currency_format = '#,##0.00 ₽'
+    
+    # "Лучший поставщик" - текст, остальные расчетные колонки - суммы
+    for col_idx in (metric_start_col, metric_start_col + 2, metric_start_col + 3):
+        for row in range(start_data_row, end_data_row + 1):
+            worksheet.cell(row=row, column=col_idx).number_format = currency_format
+
 def highlight_minimum_prices(worksheet, headers_row_2, start_data_row, end_data_row):
     """
     Выделяет минимальные цены зеленым цветом в каждой строке.
@@ -95,13 +559,59 @@ def highlight_minimum_prices(worksheet, headers_row_2, start_data_row, end_data_
                 if price == min_price:
                     valid_cells[i].font = green_font
 
-def set_column_widths_and_wrap_text(worksheet, headers_row_2):
+# Ширина колонки Excel по умолчанию и предел ширины, рассчитанной по содержимому
+DEFAULT_COLUMN_WIDTH = 8.43
+MAX_AUTO_COLUMN_WIDTH = 50
+
+# Ширина колонок без заданной ширины оценивается по выборке из стольких строк свода
+COLUMN_WIDTH_SAMPLE_ROWS = 2000
+
+def wide_row_values(row_data, sheet_names):
+    """
+    Значения строки широкого свода по колонкам - в том виде, в каком они пишутся на лист.
+    
+    Args:
+        row_data: Строка свода с метриками (см. compute_price_metrics)
+        sheet_names: Поставщики в порядке колонок свода
+        
+    Yields:
+        tuple: (номер колонки, значение)
+    """
+    yield 1, row_data['name']
+    yield 2, row_data['requested_qty']
+    
+    col = 3
+    for sheet_name in sheet_names:
+        if sheet_name in row_data['suppliers']:
+            vals = row_data['suppliers'][sheet_name]
+            for i in range(4):
+                yield col + i, vals[i]
+        col += 4
+    
+    yield col, row_data['min_price']
+    yield col + 1, row_data['best_supplier']
+    yield col + 2, row_data['price_spread']
+    yield col + 3, row_data['best_total']
+
+def _text_needs_wrap(value, width):
+    return isinstance(value, str) and (len(value) > width or '\n' in value)
+
+def set_column_widths_and_wrap_text(worksheet, headers_row_2, summary_rows=(), sheet_names=(), start_row=3):
     """
-    Устанавливает ширину колонок и включает перенос текста для всех ячеек.
+    Устанавливает ширину колонок и перенос текста по данным свода в памяти, не обходя ячейки листа.
+    
+    Ширина колонок с заданной шириной (наименование, блоки поставщиков, метрики) не меняется,
+    остальные расширяются по самому длинному значению в выборке строк (COLUMN_WIDTH_SAMPLE_ROWS).
+    Перенос текста задается на уровне колонок (для пустых и новых ячеек), а в ячейках - только
+    в заголовках и там, где текст не помещается в ширину колонки: числа и короткий текст
+    переносить нечего.
     
     Args:
         worksheet: Лист Excel для форматирования
         headers_row_2: Список заголовков второй строки
+        summary_rows: Строки свода, записанные на лист с start_row (см. wide_row_values)
+        sheet_names: Поставщики в порядке колонок свода
+        start_row: Первая строка данных на листе
     """
     # Устанавливаем ширину колонки A (Наименование)
     worksheet.column_dimensions['A'].width = 63.45
@@ -111,29 +621,61 @@ def set_column_widths_and_wrap_text(worksheet, headers_row_2):
         'Количество предложенное': 10.27,
         'Комментарий поставщика': 22.73,
         'Сроки поставки': 8.45,
-        'Цена без НДС за шт': 17.18
+        'Цена без НДС за шт': 17.18,
+        'Минимальная цена': 17.18,
+        'Лучший поставщик': 22.73,
+        'Разброс цен': 17.18,
+        'Сумма по мин. цене': 17.18
     }
     
+    # Самые длинные значения колонок без заданной ширины - по равномерной выборке строк
+    summary_rows = summary_rows if isinstance(summary_rows, list) else list(summary_rows)
+    sample_step = max(1, -(-len(summary_rows) // COLUMN_WIDTH_SAMPLE_ROWS))
+    max_lengths = {}
+    for row_data in summary_rows[::sample_step]:
+        for col_idx, value in wide_row_values(row_data, sheet_names):
+            if value is not None:
+                max_lengths[col_idx] = max(max_lengths.get(col_idx, 0), len(str(value)))
+    
     # Устанавливаем ширину колонок
+    widths = {1: worksheet.column_dimensions['A'].width}
     for col_idx, header in enumerate(headers_row_2, start=1):
+        if col_idx == 1:
+            continue
+        column_letter = get_column_letter(col_idx)
         if header in column_widths:
-            # Получаем букву колонки из ячейки второй строки (не объединенной)
-            column_letter = worksheet.cell(row=2, column=col_idx).column_letter
-            worksheet.column_dimensions[column_letter].width = column_widths[header]
-    
-    # Включаем перенос текста для всех ячеек
-    for row in worksheet.iter_rows():
-        for cell in row:
-            if cell.alignment:
-                # Сохраняем существующее выравнивание и добавляем перенос текста
-                cell.alignment = Alignment(
-                    horizontal=cell.alignment.horizontal,
-                    vertical=cell.alignment.vertical,
-                    wrap_text=True
-                )
-            else:
-                # Устанавливаем только перенос текста
-                cell.alignment = Alignment(wrap_text=True)
+            widths[col_idx] = worksheet.column_dimensions[column_letter].width = column_widths[header]
+        elif max_lengths.get(col_idx, 0) + 2 > DEFAULT_COLUMN_WIDTH:
+            widths[col_idx] = worksheet.column_dimensions[column_letter].width = min(
+                max_lengths[col_idx] + 2, MAX_AUTO_COLUMN_WIDTH)
+        else:
+            # Измерение колонки со стилем создается с шириной 13, поэтому ширину по умолчанию задаем явно
+            widths[col_idx] = worksheet.column_dimensions[column_letter].width = DEFAULT_COLUMN_WIDTH
+    
+    # Перенос текста на уровне колонок - один общий стиль вместо стиля каждой ячейки
+    wrap_alignment = Alignment(wrap_text=True)
+    for col_idx in range(1, len(headers_row_2) + 1):
+        worksheet.column_dimensions[get_column_letter(col_idx)].alignment = wrap_alignment
+    
+    # В ячейке сохраняем ее выравнивание и добавляем перенос (объекты выравнивания общие)
+    wrapped_alignments = {}
+    
+    def wrap_cell(row_idx, col_idx):
+        cell = worksheet.cell(row=row_idx, column=col_idx)
+        key = (cell.alignment.horizontal, cell.alignment.vertical)
+        alignment = wrapped_alignments.get(key)
+        if alignment is None:
+            alignment = wrapped_alignments[key] = Alignment(horizontal=key[0], vertical=key[1], wrap_text=True)
+        cell.alignment = alignment
+    
+    # Заголовки переносятся всегда, данные - только если текст не помещается в колонку
+    for row_idx in (1, 2):
+        for col_idx in range(1, len(headers_row_2) + 1):
+            wrap_cell(row_idx, col_idx)
+    for row_idx, row_data in enumerate(summary_rows, start=start_row):
+        for col_idx, value in wide_row_values(row_data, sheet_names):
+            if _text_needs_wrap(value, widths.get(col_idx, DEFAULT_COLUMN_WIDTH)):
+                wrap_cell(row_idx, col_idx)
 
 def format_header_rows(worksheet, max_col):
     """
@@ -401,43 +943,179 @@ def is_analog_cell(cell):
     # Проверяем отступы (начинается с пробелов)
     if isinstance(cell.value, str) and cell.value.startswith('      '):
         return True
-    
+
     return False
 
-def find_best_main_product_for_analog(analog_name, main_products_list, all_data_sequence, analog_qty=None):
+# Кэши уровня книги. Одни и те же наименования повторяются на листах всех поставщиков,
+# поэтому разбор наименования выполняется один раз на уникальную строку, а проверка
+# заливки - один раз на индекс стиля. Кэш живет, пока жива книга.
+_workbook_caches = weakref.WeakKeyDictionary()
+
+def get_workbook_cache(wb):
+    """
+    Возвращает кэш разбора строк для книги.
+
+    Args:
+        wb: Книга из load_source_workbook
+
+    Returns:
+        dict: {'yellow_by_style': {индекс стиля: желтая заливка}, 'names': {значение: (наименование, отступ)}}
+    """
+    cache = _workbook_caches.get(wb)
+    if cache is None:
+        cache = _workbook_caches[wb] = {'yellow_by_style': {}, 'names': {}}
+    return cache
+
+def describe_row_name(wb, name_value):
+    """
+    Разбирает значение ячейки наименования: очищенное название и признак отступа.
+    Результат кэшируется на уровне книги по строке.
+
+    Args:
+        wb: Книга из load_source_workbook
+        name_value: Значение ячейки наименования
+
+    Returns:
+        tuple: (наименование без пробелов по краям, начинается ли значение с отступа)
+    """
+    if not isinstance(name_value, str):
+        return str(name_value), False
+    names = get_workbook_cache(wb)['names']
+    info = names.get(name_value)
+    if info is None:
+        info = names[name_value] = (name_value.strip(), name_value.startswith('      '))
+    return info
+
+def get_row_item_type(item, main_product_name):
+    """
+    Определяет тип позиции (как get_item_type), используя признак аналога, сохраненный при чтении листа.
+
+    Args:
+        item: Позиция из iter_supplier_items
+        main_product_name: Название основного товара для сравнения
+
+    Returns:
+        str: 'main', 'variant' или 'analog'
+    """
+    if not item['is_analog']:
+        return 'main'
+    if item['product_name'] == main_product_name:
+        return 'variant'
+    return 'analog'
+
+# Способ чтения исходной выгрузки: 'auto' - потоковый XML с откатом на openpyxl,
+# 'stream' - только потоковый, 'openpyxl' - только openpyxl
+SOURCE_READERS = ('auto', 'stream', 'openpyxl')
+DEFAULT_SOURCE_READER = 'auto'
+
+def load_source_workbook(filename, reader=None):
+    """
+    Загружает выгрузку ЯЗакупок.
+
+    Потоковый читатель разбирает XML листов напрямую и хранит только колонки A-F,
+    openpyxl используется как запасной вариант для файлов нестандартной структуры.
+    Из архива распаковываются только нужные части (книга, стили, общие строки и листы),
+    порциями по мере разбора; строки листов поставщиков хранятся в памяти целиком.
+
+    Args:
+        filename: Путь к файлу (.xlsx) или список путей - тогда выгрузки объединяются
+            (см. load_merged_workbook)
+        reader: Способ чтения из SOURCE_READERS (по умолчанию - переменная окружения
+            SUMMARY_XLSX_READER или DEFAULT_SOURCE_READER)
+
+    Returns:
+        StreamWorkbook или openpyxl.Workbook: Книга для iter_supplier_rows и extract_payment_terms
+    """
+    if isinstance(filename, (list, tuple)):
+        if len(filename) > 1:
+            return load_merged_workbook(filename, reader=reader)
+        filename = filename[0]
+
+    reader = reader or os.environ.get('SUMMARY_XLSX_READER') or DEFAULT_SOURCE_READER
+    if reader not in SOURCE_READERS:
+        raise ValueError(f"Неизвестный способ чтения: {reader!r}. Доступны: {', '.join(SOURCE_READERS)}")
+
+    if reader != 'openpyxl':
+        try:
+            wb = xlsx_stream_reader.load_stream_workbook(filename)
+            increment_stat('stream_reader_used')
+            return wb
+        except xlsx_stream_reader.XlsxShapeError as e:
+            if reader == 'stream':
+                raise
+            print(f"Потоковое чтение невозможно ({e}), используется openpyxl")
+
+    increment_stat('openpyxl_reader_used')
+    return openpyxl.load_workbook(filename)
+
+def iter_supplier_rows(wb, sheet_name):
+    """
+    Перебирает строки листа поставщика начиная со второй в компактном виде.
+
+    Args:
+        wb: Книга из load_source_workbook (потоковая или openpyxl)
+        sheet_name: Имя листа поставщика
+
+    Yields:
+        tuple: (номер строки, значение A, желтая заливка A, (значения колонок B-F))
+    """
+    if isinstance(wb, xlsx_stream_reader.StreamWorkbook):
+        yield from wb.supplier_rows(sheet_name)
+        return
+
+    # Потоковый читатель определяет заливку по индексу стиля сам; для openpyxl кэшируем результат is_yellow_cell
+    yellow_by_style = get_workbook_cache(wb)['yellow_by_style']
+    padding = [None] * xlsx_stream_reader.SUPPLIER_COLUMNS
+    for row_idx, row in enumerate(wb[sheet_name].iter_rows(min_row=2), start=2):
+        name_cell = row[0]
+        style_id = name_cell.style_id
+        is_yellow = yellow_by_style.get(style_id)
+        if is_yellow is None:
+            is_yellow = yellow_by_style[style_id] = is_yellow_cell(name_cell)
+        values = ([cell.value for cell in row[1:xlsx_stream_reader.SUPPLIER_COLUMNS]] + padding)[:xlsx_stream_reader.SUPPLIER_COLUMNS - 1]
+        yield row_idx, name_cell.value, is_yellow, tuple(values)
+
+def find_best_main_product_for_analog(analog_name, main_products_list, main_product_quantities, analog_qty=None,
+                                      use_category_blocking=True, fuzzy_scores=None):
     """
     Находит наиболее подходящий основной товар для аналога на основе текстового сопоставления и количества.
     
     Args:
         analog_name: Название аналога
         main_products_list: Список названий основных товаров
-        all_data_sequence: Все данные для анализа позиций
+        main_product_quantities: {основной товар: запрошенное количество} (см. group_supplier_items)
         analog_qty: Количество аналога (опционально)
+        use_category_blocking: Не сравнивать товары из разных категорийных корзин
+        fuzzy_scores: {основной товар: оценка нечеткого сходства} из LSH (опционально)
         
     Returns:
         str: Название наиболее подходящего основного товара
     """
     if not main_products_list:
         return None
-    
-    # Создаем словарь количеств основных товаров
-    main_product_quantities = {}
-    for item in all_data_sequence:
-        item_type = get_item_type(item['name_cell'], "")
-        if item_type == 'main':
-            main_product_quantities[item['product_name']] = item['requested_qty']
+    check_build_budget()
     
     best_product = None
     best_similarity = 0
     
     print(f"\n--- ПОИСК ЛУЧШЕГО ОСНОВНОГО ТОВАРА ДЛЯ АНАЛОГА: '{analog_name}' (кол-во: {analog_qty}) ---")
     
+    analog_categories = detect_product_categories(analog_name)
+    
     # Проверяем каждый основной товар
     for main_product in main_products_list:
         main_qty = main_product_quantities.get(main_product, None)
         
+        # Блокировка: товары из разных категорий не сравниваем
+        if use_category_blocking and not categories_compatible(analog_categories, detect_product_categories(main_product)):
+            increment_stat('comparisons_skipped_by_category')
+            continue
+        increment_stat('similarity_comparisons')
+        
         # Рассчитываем сходство с учетом количества
-        similarity = calculate_weighted_similarity(analog_name, main_product, qty1=analog_qty, qty2=main_qty)
+        fuzzy_score = fuzzy_scores.get(main_product) if fuzzy_scores else None
+        similarity = calculate_weighted_similarity(analog_name, main_product, qty1=analog_qty, qty2=main_qty,
+                                                   fuzzy_score=fuzzy_score)
         print(f"  Сходство с '{main_product}' (кол-во: {main_qty}): {similarity:.3f}")
         
         # Проверяем, можно ли группировать с учетом количества
@@ -457,6 +1135,35 @@ def find_best_main_product_for_analog(analog_name, main_products_list, all_data_
         print(f"  ИТОГ: подходящий основной товар НЕ найден")
         return None
 
+def normalize_supplier_name(name):
+    """
+    Нормализует название поставщика для сравнения: без кавычек, пробелов по краям и регистра.
+    
+    Args:
+        name: Название поставщика (имя листа или заголовок)
+        
+    Returns:
+        str: Нормализованное название
+    """
+    return str(name).replace('"', '').replace("'", '').strip().lower()
+
+def supplier_name_matches(sheet_name, header_value):
+    """
+    Проверяет, относится ли заголовок к поставщику с данным именем листа.
+    
+    Args:
+        sheet_name: Имя листа поставщика
+        header_value: Заголовок (например, объединенная ячейка на информационном листе)
+        
+    Returns:
+        bool: True если заголовок соответствует поставщику
+    """
+    sheet_name_clean = normalize_supplier_name(sheet_name)
+    header_lower = header_value.lower()
+    return (sheet_name_clean in header_lower or
+            header_lower in sheet_name_clean or
+            any(word in header_lower for word in sheet_name_clean.split() if len(word) > 2))
+
 def extract_payment_terms(wb, sheet_names):
     """
     Извлекает условия оплаты с первого листа для каждого поставщика.
@@ -471,6 +1178,11 @@ def extract_payment_terms(wb, sheet_names):
     """
     payment_terms = {}
     
+    # Объединенная книга (несколько выгрузок) содержит уже извлеченные условия оплаты
+    precomputed_terms = getattr(wb, 'payment_terms', None)
+    if precomputed_terms is not None:
+        return {sheet_name: precomputed_terms[sheet_name] for sheet_name in sheet_names if sheet_name in precomputed_terms}
+    
     # Получаем первый лист (обычно это лист с общей информацией)
     first_sheet_name = wb.sheetnames[0]
     first_ws = wb[first_sheet_name]
@@ -512,10 +1224,7 @@ def extract_payment_terms(wb, sheet_names):
                     
                     # Проверяем, соответствует ли заголовок одному из поставщиков
                     for sheet_name in sheet_names:
-                        sheet_name_clean = sheet_name.replace('"', '').replace("'", '').strip()
-                        if (sheet_name_clean.lower() in header_value.lower() or
-                            header_value.lower() in sheet_name_clean.lower() or
-                            any(word in header_value.lower() for word in sheet_name_clean.lower().split() if len(word) > 2)):
+                        if supplier_name_matches(sheet_name, header_value):
                             supplier_columns[sheet_name] = {
                                 'start_col': merged_range.min_col,
                                 'end_col': merged_range.max_col,
@@ -568,10 +1277,168 @@ def extract_payment_terms(wb, sheet_names):
             print(f"Условия оплаты для '{sheet_name}' НЕ найдены в колонках {col_info['start_col']}-{col_info['end_col']}")
     
     return payment_terms
+
+# Сколько выгрузок разбирается параллельно в режиме объединения (по умолчанию - по числу ядер)
+MERGE_MAX_WORKERS = int(os.environ.get('SUMMARY_MERGE_WORKERS', os.cpu_count() or 1))
+
+def read_export_for_merge(filename, reader=None):
+    """
+    Разбирает одну выгрузку для объединения: строки листов поставщиков и условия оплаты.
+    Выполняется в процессе пула, поэтому результат - простые структуры без ссылок на книгу.
+    
+    Args:
+        filename: Путь к выгрузке (.xlsx)
+        reader: Способ чтения выгрузки (см. load_source_workbook)
+        
+    Returns:
+        dict: {'filename', 'sheet_names', 'rows': {лист: строки iter_supplier_rows}, 'payment_terms',
+               'price_headers': {лист: заголовок колонки цены}}
+    """
+    wb = load_source_workbook(filename, reader=reader)
+    sheet_names = wb.sheetnames[1:]
+    # Условия оплаты ищутся в том же порядке поставщиков, что и при своде одной выгрузки
+    ordered_sheet_names = sort_suppliers_by_filled_prices(wb, sheet_names)
+    return {
+        'filename': filename,
+        'sheet_names': sheet_names,
+        'rows': {sheet_name: list(iter_supplier_rows(wb, sheet_name)) for sheet_name in sheet_names},
+        'payment_terms': extract_payment_terms(wb, ordered_sheet_names),
+        'price_headers': {sheet_name: supplier_price_header(wb, sheet_name) for sheet_name in sheet_names}
+    }
+
+def merge_supplier_key(sheet_name):
+    """Ключ объединения поставщиков из разных выгрузок: нормализованное имя с одиночными пробелами."""
+    return ' '.join(normalize_supplier_name(sheet_name).split())
+
+def supplier_keys_overlap(key1, key2):
+    """
+    Проверяет, содержится ли одно имя поставщика в другом целыми словами
+    ('ромашка' и 'ооо ромашка' - да, 'поставщик 1' и 'поставщик 12' - нет).
+    
+    Args:
+        key1, key2: Ключи из merge_supplier_key
+        
+    Returns:
+        bool: True если слова одного имени идут подряд в другом
+    """
+    words1, words2 = key1.split(), key2.split()
+    if len(words1) > len(words2):
+        words1, words2 = words2, words1
+    if not words1:
+        return False
+    return any(words2[i:i + len(words1)] == words1 for i in range(len(words2) - len(words1) + 1))
+
+def match_export_suppliers(sheet_names, merged_names, name_by_key):
+    """
+    Сопоставляет листы поставщиков очередной выгрузки с поставщиками предыдущих выгрузок.
+    Листы одной выгрузки - всегда разные поставщики ('Альфа' и 'Альфа Плюс' в одной выгрузке
+    не объединяются), поэтому каждый поставщик предыдущих выгрузок достается не более чем одному листу:
+    сначала по совпадению имени, затем по вхождению имени целыми словами (если кандидат один).
+    
+    Args:
+        sheet_names: Листы поставщиков выгрузки
+        merged_names: Поставщики, объединенные из предыдущих выгрузок
+        name_by_key: {ключ merge_supplier_key: поставщик} для предыдущих выгрузок
+        
+    Returns:
+        dict: {лист: поставщик предыдущих выгрузок}; листов новых поставщиков в словаре нет
+    """
+    targets = {}
+    for sheet_name in sheet_names:
+        target = name_by_key.get(merge_supplier_key(sheet_name))
+        if target is not None and target not in targets.values():
+            targets[sheet_name] = target
+    
+    for sheet_name in sheet_names:
+        if sheet_name in targets:
+            continue
+        key = merge_supplier_key(sheet_name)
+        candidates = [name for name in merged_names
+                      if name not in targets.values() and supplier_keys_overlap(merge_supplier_key(name), key)]
+        if len(candidates) == 1:
+            targets[sheet_name] = candidates[0]
+            name_by_key.setdefault(key, candidates[0])
+    return targets
+
+def load_merged_workbook(filenames, reader=None, max_workers=None):
+    """
+    Загружает несколько выгрузок ЯЗакупок и объединяет их в одну книгу.
+    
+    Каждая выгрузка разбирается ровно один раз, выгрузки читаются параллельно в пуле процессов.
+    Листы поставщиков объединяются по нормализованному имени (как в extract_payment_terms):
+    совпадающие имена и имена, одно из которых содержится в другом целыми словами
+    ('Ромашка' и 'ООО Ромашка'), считаются одним поставщиком. Совпадение по отдельным словам
+    здесь не используется - иначе все поставщики с общей формой собственности слились бы в одного.
+    Листы ищутся только среди поставщиков предыдущих выгрузок (см. match_export_suppliers).
+    Основные товары с одинаковыми названиями объединяются дальше обычным сопоставлением.
+    
+    Args:
+        filenames: Пути к выгрузкам (.xlsx)
+        reader: Способ чтения выгрузок (см. load_source_workbook)
+        max_workers: Число процессов (по умолчанию MERGE_MAX_WORKERS)
+        
+    Returns:
+        StreamWorkbook: Объединенная книга для iter_supplier_rows и extract_payment_terms
+    """
+    filenames = list(filenames)
+    if not filenames:
+        raise ValueError('Не переданы выгрузки для объединения')
+    
+    workers = min(len(filenames), max_workers or MERGE_MAX_WORKERS)
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            exports = list(executor.map(read_export_for_merge, filenames, [reader] * len(filenames)))
+    else:
+        exports = [read_export_for_merge(filename, reader) for filename in filenames]
+    
+    merged_names = []
+    name_by_key = {}
+    supplier_rows = {}
+    last_row_idx = {}
+    payment_terms = {}
+    supplier_headers = {}
+    
+    for export in exports:
+        targets = match_export_suppliers(export['sheet_names'], merged_names, name_by_key)
+        for sheet_name in export['sheet_names']:
+            target = targets.get(sheet_name)
+            if target is None:
+                # Поставщик встретился впервые: в своде он будет под именем листа из первой выгрузки
+                target = sheet_name
+                name_by_key.setdefault(merge_supplier_key(sheet_name), target)
+                merged_names.append(target)
+                supplier_rows[target] = []
+                last_row_idx[target] = 0
+            elif target != sheet_name:
+                print(f"Лист '{sheet_name}' из {export['filename']} объединен с поставщиком '{target}'")
+            
+            # Номера строк сдвигаются, чтобы строки следующей выгрузки шли после предыдущей:
+            # от порядка строк зависит поиск аналогов без основного товара выше по листу
+            offset = last_row_idx[target]
+            for row_idx, name_value, is_yellow, values in export['rows'][sheet_name]:
+                supplier_rows[target].append((offset + row_idx, name_value, is_yellow, values))
+                last_row_idx[target] = offset + row_idx
+            
+            if sheet_name in export['payment_terms'] and target not in payment_terms:
+                payment_terms[target] = export['payment_terms'][sheet_name]
+            # Валюта поставщика определяется по заголовку цены его листа в первой выгрузке
+            if target not in supplier_headers:
+                header = [None] * xlsx_stream_reader.SUPPLIER_COLUMNS
+                header[PRICE_COLUMN_INDEX] = export['price_headers'][sheet_name]
+                supplier_headers[target] = tuple(header)
+    
+    increment_stat('merged_exports', len(exports))
+    print(f"Объединено выгрузок: {len(exports)}, поставщиков: {len(merged_names)}")
+    
+    # Информационного листа у объединенной книги нет: условия оплаты уже извлечены из каждой выгрузки
+    return xlsx_stream_reader.StreamWorkbook(['Сводная информация'] + merged_names, None, supplier_rows, {},
+                                             payment_terms=payment_terms, supplier_headers=supplier_headers)
     
 def clean_text_for_comparison(text):
     """
     Очищает текст для сравнения: убирает лишние символы, приводит к нижнему регистру.
+    Результат кэшируется: одни и те же названия сравниваются многократно.
     
     Args:
         text: Исходный текст
@@ -579,10 +1446,12 @@ def clean_text_for_comparison(text):
     Returns:
         str: Очищенный текст
     """
-    import re
     if not isinstance(text, str):
         text = str(text)
-    
+    return _clean_text_cached(text)
+
+@lru_cache(maxsize=65536)
+def _clean_text_cached(text):
     # Приводим к нижнему регистру
     text = text.lower()
     
@@ -604,59 +1473,104 @@ def determine_word_weight(word):
     Returns:
         int: Вес слова (1, 2 или 3)
     """
-    import re
-    
-    # Ключевые слова категорий (вес x3)
-    category_keywords = {
-        'зарядное', 'зарядка', 'адаптер', 'блок', 'питания',
-        'кабель', 'провод', 'шнур', 'cord', 'cable',
-        'накопитель', 'диск', 'ssd', 'hdd', 'память', 'storage', 'твердотельный',
-        'телевизор', 'тв', 'tv', 'oled', 'led', 'qled',
-        'консоль', 'playstation', 'xbox', 'геймпад', 'джойстик',
-        'наушники', 'гарнитура', 'headphones', 'earphones',
-        'мышь', 'клавиатура', 'mouse', 'keyboard'
-    }
-    
-    # Технические характеристики (вес x2)
-    technical_patterns = [
-        r'\d+gb', r'\d+tb', r'\d+мб', r'\d+гб',  # Объем памяти
-        r'\d+"', r'\d+дюйм',  # Размеры экранов
-        r'\d+вт', r'\d+w',  # Мощность
-        r'usb', r'type-c', r'lightning', r'hdmi',  # Интерфейсы
-        r'\d+hz', r'\d+гц',  # Частота
-        r'4k', r'8k', r'hd', r'fullhd',  # Разрешение
-        r'\d+a', r'\d+ампер',  # Ток
-        r'\d+v', r'\d+вольт'  # Напряжение
-    ]
-    
+    return _determine_word_weight_cached(word, current_rules()['cache_key'])
+
+@lru_cache(maxsize=65536)
+def _determine_word_weight_cached(word, rules_key):
+    rules = _matching_rules_by_key[rules_key]
     word_lower = word.lower()
     
-    # Проверяем ключевые слова категорий
-    if word_lower in category_keywords:
+    # Проверяем ключевые слова категорий (вес x3)
+    if word_lower in rules['word_weight_category_keywords']:
         return 3
     
-    # Проверяем технические характеристики
-    for pattern in technical_patterns:
-        if re.search(pattern, word_lower):
-            return 2
+    # Проверяем технические характеристики (вес x2)
+    if rules['technical_patterns_re'].search(word_lower):
+        return 2
     
     # Обычные слова
     return 1
     
-def calculate_weighted_similarity(text1, text2, qty1=None, qty2=None):
+# Размер кэша оценок пар в пределах одной сборки (вытесняются давно не использованные пары)
+PAIR_SCORE_CACHE_SIZE = int(os.environ.get('SUMMARY_PAIR_CACHE_SIZE', 200000))
+
+def name_token_features(text):
+    """
+    Значимые слова названия для сравнения: без служебных и слишком коротких слов.
+    Названия с одинаковым набором слов получают один и тот же объект (идентификатор признаков).
+    
+    Args:
+        text: Название товара
+        
+    Returns:
+        frozenset: Значимые слова названия
+    """
+    return _name_token_features_cached(clean_text_for_comparison(text), current_rules()['cache_key'])
+
+@lru_cache(maxsize=65536)
+def _name_token_features_cached(clean_text, rules_key):
+    rules = _matching_rules_by_key[rules_key]
+    stop_words = rules['stop_words']
+    min_word_length = rules['min_word_length']
+    return frozenset(word for word in clean_text.split()
+                     if word not in stop_words and len(word) >= min_word_length)
+
+def _quantity_key(qty):
+    """Количество в ключе кэша: равные количества ('5', 5, 5.0) дают один ключ."""
+    if qty is None:
+        return None
+    try:
+        return float(qty) if qty != '' else 0.0
+    except (ValueError, TypeError):
+        return ('нечисловое', str(qty))
+
+def calculate_weighted_similarity(text1, text2, qty1=None, qty2=None, fuzzy_score=None):
     """
     Рассчитывает взвешенное сходство между двумя текстами с учетом синонимов и количества.
     ПРИОРИТЕТ: Сначала сравниваются количества, затем текстовое сходство.
     
+    Оценки кэшируются в пределах сборки по ключу (признаки названия 1, признаки названия 2,
+    количества, нечеткое сходство): одну и ту же пару сравнивают сиротские аналоги, основное
+    сопоставление и проверка неподходящих аналогов. Попадания и промахи - в счетчиках
+    pair_score_cache_hits / pair_score_cache_misses.
+    
     Args:
         text1: Первый текст для сравнения (обычно аналог)
         text2: Второй текст для сравнения (обычно основной товар)
         qty1: Запрашиваемое количество для первого товара (опционально)
         qty2: Запрашиваемое количество для второго товара (опционально)
+        fuzzy_score: Оценка нечеткого сходства названий из LSH (опционально)
         
     Returns:
         float: Коэффициент сходства от 0.0 до 1.0
     """
+    rules = current_rules()
+    words1 = name_token_features(text1)
+    words2 = name_token_features(text2)
+    
+    if not hasattr(_build_stats, 'pair_scores'):
+        reset_build_stats()
+    pair_scores = _build_stats.pair_scores
+    key = (rules['cache_key'], words1, words2, _quantity_key(qty1), _quantity_key(qty2), fuzzy_score)
+    similarity = pair_scores.get(key)
+    if similarity is not None:
+        pair_scores.move_to_end(key)
+        increment_stat('pair_score_cache_hits')
+        return similarity
+    increment_stat('pair_score_cache_misses')
+    
+    similarity = _score_token_features(words1, words2, qty1, qty2, fuzzy_score, rules)
+    pair_scores[key] = similarity
+    if len(pair_scores) > PAIR_SCORE_CACHE_SIZE:
+        pair_scores.popitem(last=False)
+        increment_stat('pair_score_cache_evictions')
+    return similarity
+
+def _score_token_features(words1, words2, qty1, qty2, fuzzy_score, rules):
+    """Оценка сходства по значимым словам названий (см. calculate_weighted_similarity)."""
+    qty_scores = rules['quantity_similarity']
+    blends = rules['blends']
+    
     # ПРИОРИТЕТНАЯ ПРОВЕРКА КОЛИЧЕСТВА
     qty_similarity = 0.0
     has_quantity_data = False
@@ -670,76 +1584,29 @@ def calculate_weighted_similarity(text1, text2, qty1=None, qty2=None):
             
             if q1 == q2 and q1 > 0:
                 # ТОЧНОЕ совпадение количества - максимальный приоритет
-                qty_similarity = 1.0
-                print(f"  ⭐ ТОЧНОЕ совпадение количества: {q1} = {q2} (приоритет: 1.0)")
+                qty_similarity = qty_scores['exact']
+                print(f"  ⭐ ТОЧНОЕ совпадение количества: {q1} = {q2} (приоритет: {qty_similarity})")
             elif q1 != q2 and q1 > 0 and q2 > 0:
                 # Количества не совпадают - сильно снижаем приоритет
-                qty_similarity = 0.1  # Очень низкий приоритет для разных количеств
-                print(f"  ❌ Количества НЕ совпадают: {q1} ≠ {q2} (приоритет: 0.1)")
+                qty_similarity = qty_scores['different']  # Очень низкий приоритет для разных количеств
+                print(f"  ❌ Количества НЕ совпадают: {q1} ≠ {q2} (приоритет: {qty_similarity})")
             else:
                 # Одно из количеств равно 0 или пустое
-                qty_similarity = 0.3  # Средний приоритет
-                print(f"  ⚠️ Неполные данные о количестве: {q1}, {q2} (приоритет: 0.3)")
+                qty_similarity = qty_scores['partial']  # Средний приоритет
+                print(f"  ⚠️ Неполные данные о количестве: {q1}, {q2} (приоритет: {qty_similarity})")
         except (ValueError, TypeError):
             # Если не удалось преобразовать в числа
-            qty_similarity = 0.3
+            qty_similarity = qty_scores['partial']
             has_quantity_data = False
-            print(f"  ⚠️ Ошибка обработки количества: {qty1}, {qty2} (приоритет: 0.3)")
+            print(f"  ⚠️ Ошибка обработки количества: {qty1}, {qty2} (приоритет: {qty_similarity})")
     else:
         # Нет данных о количестве
-        qty_similarity = 0.5  # Нейтральный приоритет
-        print(f"  ℹ️ Нет данных о количестве (приоритет: 0.5)")
-    # Словарь синонимов для лучшего сопоставления
-    synonyms = {
-        'ssd': ['накопитель', 'твердотельный', 'диск'],
-        'накопитель': ['ssd', 'твердотельный', 'диск'],
-        'твердотельный': ['ssd', 'накопитель', 'диск'],
-        'диск': ['ssd', 'накопитель', 'твердотельный'],
-        'телевизор': ['тв', 'tv'],
-        'тв': ['телевизор', 'tv'],
-        'tv': ['телевизор', 'тв'],
-        'кабель': ['провод', 'шнур'],
-        'провод': ['кабель', 'шнур'],
-        'шнур': ['кабель', 'провод'],
-        'зарядное': ['зарядка', 'адаптер'],
-        'зарядка': ['зарядное', 'адаптер'],
-        'адаптер': ['зарядное', 'зарядка'],
-        'устройство': ['девайс', 'прибор'],
-        'девайс': ['устройство', 'прибор'],
-        'прибор': ['устройство', 'девайс'],
-        # Добавляем синонимы для АКБ и батарей
-        'акб': ['батарея', 'аккумулятор', 'аккумуляторная'],
-        'батарея': ['акб', 'аккумулятор', 'аккумуляторная'],
-        'аккумулятор': ['акб', 'батарея', 'аккумуляторная'],
-        'аккумуляторная': ['акб', 'батарея', 'аккумулятор'],
-        # Добавляем синонимы для ТСД
-        'тсд': ['терминал', 'сбора', 'данных'],
-        'терминал': ['тсд'],
-        # Добавляем синонимы для ЗУ и зарядных устройств
-        'зу': ['зарядное', 'устройство', 'зарядка', 'кредл', 'зарядный'],
-        'зарядное': ['зу', 'зарядка', 'адаптер', 'кредл', 'зарядный'],
-        'устройство': ['зу', 'девайс', 'прибор'],
-        'кредл': ['зу', 'зарядное', 'зарядка', 'зарядный'],
-        'зарядный': ['зу', 'зарядное', 'кредл', 'зарядка']
-    }
-    
-    # Очищаем тексты
-    clean_text1 = clean_text_for_comparison(text1)
-    clean_text2 = clean_text_for_comparison(text2)
-    
-    # Разбиваем на слова
-    words1 = set(clean_text1.split())
-    words2 = set(clean_text2.split())
-    
-    # Исключаем служебные слова
-    stop_words = {'и', 'или', 'с', 'для', 'на', 'в', 'от', 'до', 'по', 'без', 'при', 'под', 'над', 'за', 'к', 'у'}
-    words1 = words1 - stop_words
-    words2 = words2 - stop_words
-    
-    # Исключаем слишком короткие слова (менее 3 символов)
-    words1 = {w for w in words1 if len(w) >= 3}
-    words2 = {w for w in words2 if len(w) >= 3}
+        qty_similarity = qty_scores['missing']  # Нейтральный приоритет
+        print(f"  ℹ️ Нет данных о количестве (приоритет: {qty_similarity})")
+    # Словарь синонимов для лучшего сопоставления (из правил)
+    synonyms = rules['synonyms']
     
+    # Слова уже очищены, без служебных и коротких слов (см. name_token_features)
     if not words1 or not words2:
         return 0.0
     
@@ -773,18 +1640,23 @@ def calculate_weighted_similarity(text1, text2, qty1=None, qty2=None):
     
     text_similarity = (similarity1 + similarity2) / 2
     
+    # Нечеткое сходство по символьным n-граммам выручает при опечатках и разных разделителях в артикулах
+    if fuzzy_score is not None and fuzzy_score > text_similarity:
+        print(f"  🔎 Нечеткое сходство названий {fuzzy_score:.3f} выше текстового {text_similarity:.3f}")
+        text_similarity = fuzzy_score
+    
     # КОМБИНИРОВАННАЯ ОЦЕНКА: Количество имеет приоритет над текстом
-    if has_quantity_data and qty_similarity == 1.0:
+    if has_quantity_data and qty_similarity == qty_scores['exact']:
         # Точное совпадение количества - текстовое сходство становится вторичным
-        final_similarity = 0.7 + (text_similarity * 0.3)  # 70% за количество + 30% за текст
+        final_similarity = blends['exact_qty_base'] + (text_similarity * blends['exact_qty_text'])  # 70% за количество + 30% за текст
         print(f"  🎯 ПРИОРИТЕТ по количеству: итоговое сходство = {final_similarity:.3f}")
-    elif has_quantity_data and qty_similarity == 0.1:
+    elif has_quantity_data and qty_similarity == qty_scores['different']:
         # Разные количества - сильно снижаем итоговую оценку
-        final_similarity = text_similarity * 0.2  # Только 20% от текстового сходства
+        final_similarity = text_similarity * blends['different_qty_text']  # Только 20% от текстового сходства
         print(f"  ⬇️ ШТРАФ за разные количества: итоговое сходство = {final_similarity:.3f}")
     else:
         # Стандартная логика: комбинируем количество и текст
-        final_similarity = (qty_similarity * 0.4) + (text_similarity * 0.6)  # 40% количество + 60% текст
+        final_similarity = (qty_similarity * blends['standard_qty']) + (text_similarity * blends['standard_text'])  # 40% количество + 60% текст
         print(f"  ⚖️ СТАНДАРТНАЯ оценка: итоговое сходство = {final_similarity:.3f}")
     
     # Ограничиваем результат до 1.0
@@ -805,8 +1677,9 @@ def should_group_items(similarity, qty1, qty2):
     Returns:
         bool: True если товары следует группировать
     """
-    base_threshold = 0.25  # Базовый порог для одинаковых количеств
-    different_qty_threshold = 0.7  # Высокий порог для разных количеств
+    thresholds = current_rules()['thresholds']
+    base_threshold = thresholds['base']  # Базовый порог для одинаковых количеств (0.25)
+    different_qty_threshold = thresholds['different_qty']  # Высокий порог для разных количеств (0.7)
     
     # Проверяем, известны ли количества и различаются ли они
     if qty1 is not None and qty2 is not None:
@@ -832,65 +1705,263 @@ def should_group_items(similarity, qty1, qty2):
         print(f"  📊 Нет данных о количестве → базовый порог {base_threshold:.0%}, сходство {similarity:.3f}")
         return similarity >= base_threshold
     
-def generate_main_product_name(analog_name):
+def _build_keyword_matcher(keywords):
     """
-    Генерирует стандартное название основного товара на основе категории аналога.
+    Строит объединенное регулярное выражение для поиска всех ключевых слов за один проход.
+    
+    Выражение с опережающей проверкой находит в каждой позиции самое длинное ключевое слово,
+    а остальные ключевые слова, начинающиеся в той же позиции, являются его префиксами -
+    их добавляем через заранее посчитанное замыкание.
     
     Args:
-        analog_name: Название аналога
+        keywords: Итерируемое множество ключевых слов
         
     Returns:
-        str: Стандартное название основного товара для данной категории
+        tuple: (скомпилированное выражение, {ключевое слово: frozenset ключевых слов-префиксов})
+    """
+    ordered = sorted(set(keywords), key=len, reverse=True)
+    pattern = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in ordered) + '))')
+    prefix_closure = {
+        keyword: frozenset(other for other in ordered if keyword.startswith(other))
+        for keyword in ordered
+    }
+    return pattern, prefix_closure
+
+def _find_keywords(matcher, text):
     """
-    # Очищаем название
-    clean_name = clean_text_for_comparison(analog_name)
-    words = set(clean_name.split())
-    
-    # Определяем категории по ключевым словам (порядок важен - более специфичные категории первыми)
-    categories = {
-        'монитор': {
-            'keywords': ['монитор', 'monitor', 'dell', 'acer', 'samsung', 'philips', 'bravus', 'lime', 'ips', 'lcd', 'led', 'p2422he', 'p2423de', 'u2424h', 'b247y', 's24a604', 'ut241y', '24b2n4200', 'bvq2737pc', 't238a'],
-            'standard_name': 'Монитор'
-        },
-        'телевизор': {
-            'keywords': ['телевизор', 'тв', 'tv'],  # Убрал oled, led, qled - они есть и в мониторах
-            'standard_name': 'Телевизор OLED'
-        },
-        'кабель': {
-            'keywords': ['кабель', 'провод', 'шнур', 'cable', 'cord'],
-            'standard_name': 'Кабель USB'
-        },
-        'накопитель': {
-            'keywords': ['накопитель', 'ssd', 'hdd', 'твердотельный', 'диск', 'storage'],
-            'standard_name': 'SSD Накопитель'
-        },
-        'зарядка': {
-            'keywords': ['зарядное', 'зарядка', 'адаптер', 'блок', 'питания'],
-            'standard_name': 'Зарядное Устройство'
-        },
-        'консоль': {
-            'keywords': ['playstation', 'xbox', 'консоль', 'ps5', 'геймпад'],
-            'standard_name': 'Игровая Консоль'
-        },
-        'наушники': {
-            'keywords': ['наушники', 'гарнитура', 'headphones', 'earphones'],
-            'standard_name': 'Наушники'
+    Возвращает все ключевые слова, входящие в текст как подстроки.
+    
+    Args:
+        matcher: Результат _build_keyword_matcher
+        text: Текст для поиска
+        
+    Returns:
+        set: Найденные ключевые слова
+    """
+    pattern, prefix_closure = matcher
+    found = set()
+    for match in pattern.finditer(text):
+        found |= prefix_closure[match.group(1)]
+    return found
+
+def classify_product_name(product_name):
+    """
+    Классифицирует название товара за один проход: веса слов, категории и признак телевизора.
+    Результат кэшируется (ключ включает версию правил), поэтому его нельзя изменять.
+    
+    Args:
+        product_name: Название товара
+        
+    Returns:
+        dict: {
+            'clean_name': очищенное название,
+            'weights': {слово: вес},
+            'categories': frozenset категорий,
+            'category_keywords': frozenset найденных ключевых слов категорий,
+            'primary_category': первая категория в порядке правил или None,
+            'is_tv': True если название содержит ключевые слова телевизора
         }
+    """
+    return _classify_product_name_cached(product_name, current_rules()['cache_key'])
+
+@lru_cache(maxsize=65536)
+def _classify_product_name_cached(product_name, rules_key):
+    rules = _matching_rules_by_key[rules_key]
+    clean_name = clean_text_for_comparison(product_name)
+    
+    category_keywords = _find_keywords(rules['category_matcher'], clean_name)
+    categories = set()
+    for keyword in category_keywords:
+        categories.update(rules['category_keyword_index'][keyword])
+    
+    primary_category = None
+    for category_name in rules['product_categories']:
+        if category_name in categories:
+            primary_category = category_name
+            break
+    
+    raw_name = product_name if isinstance(product_name, str) else str(product_name)
+    
+    return {
+        'clean_name': clean_name,
+        'weights': {word: _determine_word_weight_cached(word, rules_key) for word in clean_name.split()},
+        'categories': frozenset(categories),
+        'category_keywords': frozenset(category_keywords),
+        'primary_category': primary_category,
+        'is_tv': bool(rules['tv_keywords_re'].search(raw_name.upper()))
     }
+
+def detect_product_categories(product_name):
+    """
+    Определяет все категории товара по ключевым словам категорий из правил сопоставления.
+    Использует тот же поиск по вхождению подстроки, что и generate_main_product_name.
     
-    # Ищем подходящую категорию
-    for category_name, category_info in categories.items():
-        keywords = category_info['keywords']
-        # Проверяем, есть ли ключевые слова этой категории в названии товара
-        # Используем более гибкий поиск - проверяем вхождение подстроки
-        found_keywords = []
-        for keyword in keywords:
-            if any(keyword.lower() in word.lower() for word in clean_name.split()):
-                found_keywords.append(keyword)
+    Args:
+        product_name: Название товара
+        
+    Returns:
+        frozenset: Названия категорий (пустое множество, если категория не определена)
+    """
+    return classify_product_name(product_name)['categories']
+
+def categories_compatible(categories1, categories2):
+    """
+    Проверяет, попадают ли два товара в общую категорийную корзину (блокировка).
+    Товары без категории сравниваются со всеми.
+    
+    Args:
+        categories1: Категории первого товара
+        categories2: Категории второго товара
+        
+    Returns:
+        bool: True если пару нужно сравнивать
+    """
+    if not categories1 or not categories2:
+        return True
+    return bool(categories1 & categories2)
+
+def name_shingles(product_name, ngram=3):
+    """
+    Разбивает название на символьные n-граммы без учета пробелов и знаков препинания,
+    поэтому "P2422HE" и "P2422 HE" дают одинаковый набор.
+    
+    Args:
+        product_name: Название товара
+        ngram: Длина n-граммы
+        
+    Returns:
+        frozenset: Множество n-грамм
+    """
+    compact = clean_text_for_comparison(product_name).replace(' ', '')
+    if len(compact) <= ngram:
+        return frozenset([compact]) if compact else frozenset()
+    return frozenset(compact[i:i + ngram] for i in range(len(compact) - ngram + 1))
+
+def compute_minhash_signature(shingles, fuzzy_settings):
+    """
+    Вычисляет MinHash-сигнатуру множества n-грамм.
+    
+    Args:
+        shingles: Множество n-грамм
+        fuzzy_settings: Раздел 'fuzzy' скомпилированных правил
+        
+    Returns:
+        tuple: Сигнатура длины num_perm
+    """
+    if not shingles:
+        return tuple([_MINHASH_PRIME] * fuzzy_settings['num_perm'])
+    hashed = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+    return tuple(
+        min([(a * value + b) % _MINHASH_PRIME for value in hashed])
+        for a, b in fuzzy_settings['coefficients']
+    )
+
+def create_lsh_index(fuzzy_settings=None):
+    """
+    Создает пустой LSH-индекс для поиска похожих названий.
+    
+    Args:
+        fuzzy_settings: Раздел 'fuzzy' правил (по умолчанию из активных правил)
+        
+    Returns:
+        dict: LSH-индекс
+    """
+    return {
+        'settings': fuzzy_settings or current_rules()['fuzzy'],
+        'signatures': {},
+        'buckets': {}
+    }
+
+def lsh_signature(lsh_index, product_name):
+    """
+    Возвращает MinHash-сигнатуру названия (для уже добавленных в индекс - из индекса).
+    
+    Args:
+        lsh_index: LSH-индекс
+        product_name: Название товара
         
-        if found_keywords:
-            print(f"  Определена категория '{category_name}' для аналога '{analog_name[:50]}...' по ключевым словам: {found_keywords}")
-            return category_info['standard_name']
+    Returns:
+        tuple: MinHash-сигнатура
+    """
+    settings = lsh_index['settings']
+    signature = lsh_index['signatures'].get(product_name)
+    if signature is None:
+        signature = compute_minhash_signature(name_shingles(product_name, settings['ngram']), settings)
+    return signature
+
+def _lsh_band_keys(signature, settings):
+    rows_per_band = settings['num_perm'] // settings['bands']
+    for band in range(settings['bands']):
+        yield (band, signature[band * rows_per_band:(band + 1) * rows_per_band])
+
+def lsh_add(lsh_index, product_name):
+    """
+    Добавляет название в LSH-индекс.
+    
+    Args:
+        lsh_index: LSH-индекс
+        product_name: Название товара
+    """
+    if product_name in lsh_index['signatures']:
+        return
+    signature = lsh_signature(lsh_index, product_name)
+    lsh_index['signatures'][product_name] = signature
+    for band_key in _lsh_band_keys(signature, lsh_index['settings']):
+        lsh_index['buckets'].setdefault(band_key, []).append(product_name)
+
+def lsh_query(lsh_index, product_name, min_jaccard=None):
+    """
+    Находит в индексе названия-кандидаты, похожие на заданное, за сублинейное время.
+    
+    Args:
+        lsh_index: LSH-индекс
+        product_name: Название для поиска
+        min_jaccard: Минимальная оценка сходства Жаккара (по умолчанию из правил)
+        
+    Returns:
+        dict: {название кандидата: оценка сходства Жаккара по MinHash}
+    """
+    settings = lsh_index['settings']
+    if min_jaccard is None:
+        min_jaccard = settings['min_jaccard']
+    signature = lsh_signature(lsh_index, product_name)
+    
+    candidates = set()
+    for band_key in _lsh_band_keys(signature, settings):
+        candidates.update(lsh_index['buckets'].get(band_key, ()))
+    
+    scores = {}
+    for candidate in candidates:
+        candidate_signature = lsh_index['signatures'][candidate]
+        matches = sum(1 for left, right in zip(signature, candidate_signature) if left == right)
+        estimate = matches / settings['num_perm']
+        if estimate >= min_jaccard:
+            scores[candidate] = estimate
+    increment_stat('lsh_candidates', len(candidates))
+    return scores
+
+def generate_main_product_name(analog_name):
+    """
+    Генерирует стандартное название основного товара на основе категории аналога.
+    
+    Args:
+        analog_name: Название аналога
+        
+    Returns:
+        str: Стандартное название основного товара для данной категории
+    """
+    # Классифицируем название за один проход
+    classification = classify_product_name(analog_name)
+    clean_name = classification['clean_name']
+    
+    # Берем первую подходящую категорию (порядок категорий в правилах важен)
+    category_name = classification['primary_category']
+    if category_name:
+        category_info = current_rules()['product_categories'][category_name]
+        found_keywords = [keyword for keyword in category_info['keywords']
+                          if keyword.lower() in classification['category_keywords']]
+        print(f"  Определена категория '{category_name}' для аналога '{analog_name[:50]}...' по ключевым словам: {found_keywords}")
+        return category_info['standard_name']
     
     # Если категория не определена, используем старый алгоритм
     print(f"  Категория не определена для аналога '{analog_name[:50]}...', используем старый алгоритм")
@@ -949,395 +2020,1453 @@ def find_misplaced_analogs(main_product_name, analogs_list, main_product_qty=Non
     
     return misplaced_analogs
 
-def collect_data_sequentially(wb, sheet_names):
+def assign_analogs_globally(all_analogs_for_matching, main_products_order, main_product_quantities,
+                            is_blocked=None, lsh_index=None):
+    """
+    Глобально назначает аналоги основным товарам.
+    
+    Матрица сходства "аналог x основной товар" строится один раз. Ограничений на число аналогов
+    у одного товара нет, поэтому оптимальное назначение - лучший допустимый товар для каждого аналога
+    (при равенстве - более ранний товар). Оставшиеся аналоги кластеризуются между собой
+    (связные компоненты по парам, прошедшим should_group_items), и каждый кластер становится
+    виртуальным основным товаром. Результат не зависит от порядка обработки аналогов.
+    
+    Args:
+        all_analogs_for_matching: {название аналога: [строки аналога]}
+        main_products_order: Список основных товаров (дополняется виртуальными товарами)
+        main_product_quantities: {основной товар: запрошенное количество} (см. group_supplier_items)
+        is_blocked: Функция (название1, название2) -> True, если пару не нужно сравнивать (опционально)
+        lsh_index: LSH-индекс основных товаров для нечеткого сходства (опционально)
+        
+    Returns:
+        tuple: (analogs_by_main_product, virtual_main_products)
+    """
+    print("\n=== ГЛОБАЛЬНОЕ НАЗНАЧЕНИЕ АНАЛОГОВ ===")
+    
+    original_main_products = list(main_products_order)
+    analog_names = list(all_analogs_for_matching.keys())
+    analog_quantities = {
+        name: (items[0]['requested_qty'] if items else None)
+        for name, items in all_analogs_for_matching.items()
+    }
+    
+    # Матрица сходства аналогов с исходными основными товарами (строится один раз)
+    analogs_by_main_product = {}
+    leftovers = []
+    for analog_name in analog_names:
+        check_build_budget()
+        analog_qty = analog_quantities[analog_name]
+        fuzzy_scores = lsh_query(lsh_index, analog_name) if lsh_index else {}
+        best_main_product = None
+        best_similarity = None
+        for main_product in original_main_products:
+            if is_blocked and is_blocked(analog_name, main_product):
+                continue
+            increment_stat('similarity_comparisons')
+            main_qty = main_product_quantities.get(main_product)
+            similarity = calculate_weighted_similarity(analog_name, main_product, qty1=analog_qty, qty2=main_qty,
+                                                       fuzzy_score=fuzzy_scores.get(main_product))
+            if not should_group_items(similarity, analog_qty, main_qty):
+                continue
+            if best_similarity is None or similarity > best_similarity:
+                best_similarity = similarity
+                best_main_product = main_product
+        
+        if best_main_product is not None:
+            analogs_by_main_product.setdefault(best_main_product, []).append({
+                'name': analog_name,
+                'items': all_analogs_for_matching[analog_name]
+            })
+            print(f"  '{analog_name}' → '{best_main_product}' (сходство: {best_similarity:.3f})")
+        else:
+            leftovers.append(analog_name)
+    
+    # Кластеризация оставшихся аналогов: объединение пар, прошедших проверку группировки
+    check_comparison_estimate(len(original_main_products), len(analog_names), len(leftovers))
+    parents = {name: name for name in leftovers}
+    positions = {name: position for position, name in enumerate(leftovers)}
+    
+    def find_root(name):
+        while parents[name] != name:
+            parents[name] = parents[parents[name]]
+            name = parents[name]
+        return name
+    
+    for i, first_name in enumerate(leftovers):
+        check_build_budget()
+        for second_name in leftovers[i + 1:]:
+            if is_blocked and is_blocked(first_name, second_name):
+                continue
+            increment_stat('similarity_comparisons')
+            first_qty = analog_quantities[first_name]
+            second_qty = analog_quantities[second_name]
+            similarity = calculate_weighted_similarity(first_name, second_name, qty1=first_qty, qty2=second_qty)
+            if should_group_items(similarity, first_qty, second_qty):
+                first_root, second_root = find_root(first_name), find_root(second_name)
+                if first_root != second_root:
+                    # Корнем остается аналог, встретившийся раньше, - так порядок кластеров стабилен
+                    if positions[first_root] < positions[second_root]:
+                        parents[second_root] = first_root
+                    else:
+                        parents[first_root] = second_root
+    
+    clusters = {}
+    for name in leftovers:
+        clusters.setdefault(find_root(name), []).append(name)
+    
+    # Каждый кластер становится виртуальным основным товаром (кластеры с одинаковым названием объединяются)
+    virtual_main_products = {}
+    for root_name, members in clusters.items():
+        virtual_main_name = generate_main_product_name(root_name)
+        if virtual_main_name not in virtual_main_products:
+            virtual_main_products[virtual_main_name] = []
+            main_products_order.append(virtual_main_name)
+            print(f"  Создан виртуальный основной товар '{virtual_main_name}' для {len(members)} аналогов")
+        for analog_name in members:
+            virtual_main_products[virtual_main_name].append({
+                'name': analog_name,
+                'items': all_analogs_for_matching[analog_name]
+            })
+    
+    return analogs_by_main_product, virtual_main_products
+
+def iter_supplier_items(wb, sheet_names):
+    """
+    Стадия "чтение": выдает позиции листов поставщиков в порядке листов и строк.
+
+    Args:
+        wb: Книга из load_source_workbook
+        sheet_names: Листы поставщиков
+
+    Yields:
+        dict: {'sheet_name', 'row_idx', 'is_analog', 'product_name', 'requested_qty',
+               'offered_data': [кол-во, цена, срок, комментарий]}
+    """
+    for sheet_name in sheet_names:
+        check_build_budget()
+        for row_idx, name_value, is_yellow, values in iter_supplier_rows(wb, sheet_name):
+            if not name_value:
+                continue
+
+            product_name, has_indent = describe_row_name(wb, name_value)
+
+            yield {
+                'sheet_name': sheet_name,
+                'row_idx': row_idx,
+                'is_analog': is_yellow or has_indent,
+                'product_name': product_name,
+                'requested_qty': values[0],
+                'offered_data': list(values[1:5])
+            }
+
+def classify_supplier_items(items):
+    """
+    Стадия "классификация": отмечает "сиротские" аналоги - аналоги, выше которых на том же
+    листе нет ни одного основного товара. Позиции приходят по листам в порядке строк,
+    поэтому достаточно помнить листы, на которых основной товар уже встречался.
+
+    Args:
+        items: Позиции из iter_supplier_items
+
+    Yields:
+        dict: Та же позиция с признаком 'is_orphan'
+    """
+    sheets_with_main_product = set()
+    for item in items:
+        if item['is_analog']:
+            item['is_orphan'] = item['sheet_name'] not in sheets_with_main_product
+        else:
+            sheets_with_main_product.add(item['sheet_name'])
+            item['is_orphan'] = False
+        yield item
+
+def group_supplier_items(items):
+    """
+    Стадия "группировка": индексирует позиции по названиям товаров за один проход.
+    Следующим стадиям не нужен полный список строк - они обращаются к позициям товара по названию.
+
+    Аналоги канонизируются: названия, совпадающие после clean_text_for_comparison (регистр,
+    пробелы, знаки препинания), сводятся в одну сущность с предложениями всех поставщиков.
+    Сущность называется по первому написанию, а сопоставление выполняется один раз на сущность;
+    несколько предложений одного поставщика по сущности выводятся отдельными строками (_analog_summary_rows).
+    Аналоги с названием основного товара остаются вариантами этого товара.
+
+    Args:
+        items: Позиции из classify_supplier_items
+
+    Returns:
+        dict: {
+            'main_products_order': основные товары в порядке первого появления,
+            'main_product_quantities': {основной товар: запрошенное количество},
+            'items_by_name': {название: позиции с этим названием в порядке появления},
+            'analog_entities': {название сущности: позиции всех ее написаний в порядке появления}
+                - аналоги для сопоставления (без вариантов) в порядке первого появления,
+            'orphan_analogs': [{'name', 'sheet_name', 'row_idx'}] - сиротские аналоги,
+                по одному на сущность (name - название сущности)
+        }
+    """
+    main_products_order = []
+    main_product_quantities = {}
+    items_by_name = {}
+    analog_names = {}
+
+    for sequence, item in enumerate(items):
+        item['sequence'] = sequence
+        product_name = item['product_name']
+        items_by_name.setdefault(product_name, []).append(item)
+        if item['is_analog']:
+            analog_names.setdefault(product_name, None)
+        else:
+            if product_name not in main_product_quantities:
+                main_products_order.append(product_name)
+            main_product_quantities[product_name] = item['requested_qty']
+
+    # Канонизация аналогов: основные товары известны только после прохода, поэтому
+    # варианты (аналоги с названием основного товара) отделяются здесь
+    entity_by_key = {}
+    entity_of = {}
+    analog_entities = {}
+    for analog_name in analog_names:
+        if analog_name in main_product_quantities:
+            continue
+        entity_name = entity_by_key.setdefault(clean_text_for_comparison(analog_name), analog_name)
+        entity_of[analog_name] = entity_name
+        entity_items = analog_entities.setdefault(entity_name, [])
+        if entity_items:
+            # Второе написание - восстанавливаем порядок строк выгрузки
+            increment_stat('analog_spellings_collapsed')
+            entity_items.extend(items_by_name[analog_name])
+            entity_items.sort(key=lambda entity_item: entity_item['sequence'])
+        else:
+            entity_items.extend(items_by_name[analog_name])
+
+    # Сиротские аналоги - по одному на сущность, в порядке первой сиротской позиции
+    orphan_items = sorted((item for analog_name in analog_names for item in items_by_name[analog_name]
+                           if item['is_analog'] and item['is_orphan']),
+                          key=lambda item: item['sequence'])
+    orphan_analogs = []
+    seen_orphans = set()
+    for item in orphan_items:
+        entity_name = entity_of.get(item['product_name'], item['product_name'])
+        if entity_name not in seen_orphans:
+            seen_orphans.add(entity_name)
+            orphan_analogs.append({'name': entity_name, 'sheet_name': item['sheet_name'], 'row_idx': item['row_idx']})
+
+    return {
+        'main_products_order': main_products_order,
+        'main_product_quantities': main_product_quantities,
+        'items_by_name': items_by_name,
+        'analog_entities': analog_entities,
+        'orphan_analogs': orphan_analogs
+    }
+
+def _entity_items(product_index, name):
+    """Позиции сущности аналога; для сиротского аналога с названием основного товара - позиции названия."""
+    entity_items = product_index['analog_entities'].get(name)
+    return entity_items if entity_items is not None else product_index['items_by_name'][name]
+
+def match_analogs(product_index, use_category_blocking=True, use_fuzzy_matching=None, assignment_mode='greedy'):
+    """
+    Стадия "сопоставление": привязывает аналоги к основным товарам и создает виртуальные товары.
+
+    Args:
+        product_index: Результат group_supplier_items
+        use_category_blocking: Сравнивать аналоги только с товарами из общей категорийной корзины
+        use_fuzzy_matching: Учитывать нечеткое сходство MinHash/LSH (по умолчанию - из правил сопоставления)
+        assignment_mode: 'greedy' - аналоги по очереди (исходная логика), 'global' - глобальное назначение
+
+    Returns:
+        dict: {
+            'main_products_order': основные товары, включая виртуальные, в порядке вывода,
+            'analogs_by_main_product': {основной товар: [{'name', 'items'}]},
+            'orphan_analogs_by_main_product': {основной товар: [сиротские аналоги]},
+            'virtual_main_products': {виртуальный товар: [{'name', 'items'}]}
+        }
+    """
+    main_products_order = list(product_index['main_products_order'])
+    main_product_quantities = product_index['main_product_quantities']
+    items_by_name = product_index['items_by_name']
+
+    # Нечеткое сопоставление - LSH-индекс по названиям основных товаров
+    if use_fuzzy_matching is None:
+        use_fuzzy_matching = current_rules()['fuzzy']['enabled']
+    lsh_index = None
+    if use_fuzzy_matching:
+        lsh_index = create_lsh_index()
+        for main_product in main_products_order:
+            lsh_add(lsh_index, main_product)
+        print(f"Нечеткое сопоставление включено: в LSH-индексе {len(main_products_order)} основных товаров")
+
+    # Группируем сиротские аналоги (аналоги ТВ или любых других товаров без основного товара)
+    orphan_analogs = product_index['orphan_analogs']
+    orphan_analogs_by_main_product = {}
+
+    if orphan_analogs:
+        # Аналоги ТВ не привязываются к основным товарам
+        regular_analogs = [a for a in orphan_analogs if not classify_product_name(a['name'])['is_tv']]
+
+        # Обрабатываем обычные сиротские аналоги
+        if regular_analogs and main_products_order:
+            for analog in regular_analogs:
+                # Количество аналога - из первой позиции сущности
+                analog_qty = _entity_items(product_index, analog['name'])[0]['requested_qty']
+
+                # Находим наиболее подходящий основной товар для этого аналога
+                best_main_product = find_best_main_product_for_analog(
+                    analog['name'],
+                    main_products_order,
+                    main_product_quantities,
+                    analog_qty,
+                    use_category_blocking=use_category_blocking,
+                    fuzzy_scores=lsh_query(lsh_index, analog['name']) if lsh_index else None
+                )
+
+                if best_main_product:
+                    orphan_analogs_by_main_product.setdefault(best_main_product, []).append(analog)
+
+    # ВСЕ аналоги для текстового сопоставления - канонические сущности без вариантов
+    # (аналогов, название которых совпадает с основным товаром)
+    all_analogs_for_matching = product_index['analog_entities']
+
+    # Блокировка - распределяем основные товары и аналоги по категорийным корзинам
+    product_categories = {}
+    category_buckets = {}
+    for product_name in list(main_products_order) + list(all_analogs_for_matching.keys()):
+        if product_name in product_categories:
+            continue
+        categories = detect_product_categories(product_name)
+        product_categories[product_name] = categories
+        for category in (categories or {'без категории'}):
+            category_buckets.setdefault(category, []).append(product_name)
+
+    if use_category_blocking:
+        print("\n=== КАТЕГОРИЙНЫЕ КОРЗИНЫ ===")
+        for category, bucket in category_buckets.items():
+            print(f"  {category}: {len(bucket)} товаров")
+
+    def pair_is_blocked(name1, name2):
+        if not use_category_blocking:
+            return False
+        if name1 not in product_categories:
+            product_categories[name1] = detect_product_categories(name1)
+        if name2 not in product_categories:
+            product_categories[name2] = detect_product_categories(name2)
+        if categories_compatible(product_categories[name1], product_categories[name2]):
+            return False
+        increment_stat('comparisons_skipped_by_category')
+        return True
+
+    # Умное сопоставление аналогов с проверкой сходства
+    print("\n=== УМНОЕ СОПОСТАВЛЕНИЕ АНАЛОГОВ ===")
+
+    analogs_by_main_product = {}
+    virtual_main_products = {}  # Для хранения виртуальных основных товаров
+
+    if assignment_mode == 'global':
+        # Глобальное назначение: полная матрица сходства, решение не зависит от порядка аналогов
+        analogs_by_main_product, virtual_main_products = assign_analogs_globally(
+            all_analogs_for_matching, main_products_order, main_product_quantities,
+            is_blocked=pair_is_blocked, lsh_index=lsh_index
+        )
+    else:
+        # Обрабатываем аналоги по одному, чтобы учитывать уже созданные виртуальные товары
+        for analog_name, analog_items in all_analogs_for_matching.items():
+            check_build_budget()
+            # Проверяем сходство со ВСЕМИ основными товарами (включая уже созданные виртуальные)
+            best_similarity = 0
+            best_main_product = None
+            is_virtual = False
+
+            # Получаем количество аналога
+            analog_qty = analog_items[0]['requested_qty'] if analog_items else None
+
+            print(f"\n--- АНАЛИЗ АНАЛОГА: '{analog_name}' (кол-во: {analog_qty}) ---")
+
+            # Кандидаты нечеткого сходства из LSH-индекса (одним запросом на аналог)
+            fuzzy_scores = lsh_query(lsh_index, analog_name) if lsh_index else {}
+
+            # Проверяем сходство с исходными основными товарами
+            for main_product in main_products_order:
+                if pair_is_blocked(analog_name, main_product):
+                    continue
+                increment_stat('similarity_comparisons')
+                # Находим количество основного товара
+                main_qty = main_product_quantities.get(main_product, None)
+                similarity = calculate_weighted_similarity(analog_name, main_product, qty1=analog_qty, qty2=main_qty,
+                                                           fuzzy_score=fuzzy_scores.get(main_product))
+                print(f"  Сходство с '{main_product}' (кол-во: {main_qty}): {similarity:.3f}")
+                if similarity > best_similarity:
+                    best_similarity = similarity
+                    best_main_product = main_product
+                    is_virtual = main_product in virtual_main_products
+
+            # Также проверяем сходство с уже созданными виртуальными товарами
+            for virtual_main_name in virtual_main_products.keys():
+                if virtual_main_name not in main_products_order:
+                    continue  # Уже проверили выше
+                if pair_is_blocked(analog_name, virtual_main_name):
+                    continue
+                increment_stat('similarity_comparisons')
+                # Для виртуальных товаров используем количество первого аналога
+                virtual_qty = virtual_main_products[virtual_main_name][0]['items'][0]['requested_qty'] if virtual_main_products[virtual_main_name] else None
+                similarity = calculate_weighted_similarity(analog_name, virtual_main_name, qty1=analog_qty, qty2=virtual_qty,
+                                                           fuzzy_score=fuzzy_scores.get(virtual_main_name))
+                print(f"  Сходство с виртуальным '{virtual_main_name}' (кол-во: {virtual_qty}): {similarity:.3f}")
+                if similarity > best_similarity:
+                    best_similarity = similarity
+                    best_main_product = virtual_main_name
+                    is_virtual = True
+
+            print(f"  ИТОГ: лучшее сходство {best_similarity:.3f} с '{best_main_product}' {'(виртуальный)' if is_virtual else '(исходный)'}")
+
+            # Решаем: привязать к существующему или создать виртуальный товар
+            # Находим количество лучшего основного товара
+            best_main_qty = None
+            if best_main_product in main_product_quantities:
+                best_main_qty = main_product_quantities[best_main_product]
+            elif best_main_product in virtual_main_products:
+                # Для виртуальных товаров берем количество первого аналога
+                if virtual_main_products[best_main_product]:
+                    best_main_qty = virtual_main_products[best_main_product][0]['items'][0]['requested_qty']
+
+            # Используем универсальную функцию для проверки группировки
+            if should_group_items(best_similarity, analog_qty, best_main_qty):
+                if is_virtual:
+                    # Привязываем к виртуальному основному товару
+                    virtual_main_products[best_main_product].append({
+                        'name': analog_name,
+                        'items': analog_items
+                    })
+                    print(f"  → Привязан к виртуальному товару '{best_main_product}'")
+                else:
+                    # Привязываем к исходному основному товару
+                    if best_main_product not in analogs_by_main_product:
+                        analogs_by_main_product[best_main_product] = []
+                    analogs_by_main_product[best_main_product].append({
+                        'name': analog_name,
+                        'items': analog_items
+                    })
+                    print(f"  → Привязан к исходному товару '{best_main_product}'")
+            else:
+                # Создаем новый виртуальный основной товар
+                virtual_main_name = generate_main_product_name(analog_name)
+
+                # Проверяем, не существует ли уже виртуальный товар с таким же названием
+                if virtual_main_name in virtual_main_products:
+                    # Добавляем к существующему виртуальному товару
+                    virtual_main_products[virtual_main_name].append({
+                        'name': analog_name,
+                        'items': analog_items
+                    })
+                    print(f"  → Аналог добавлен к существующему виртуальному товару: '{virtual_main_name}'")
+                else:
+                    # Создаем новый виртуальный товар
+                    virtual_main_products[virtual_main_name] = []
+                    virtual_main_products[virtual_main_name].append({
+                        'name': analog_name,
+                        'items': analog_items
+                    })
+
+                    # Добавляем виртуальный основной товар в общий список
+                    main_products_order.append(virtual_main_name)
+                    if lsh_index:
+                        lsh_add(lsh_index, virtual_main_name)
+                    print(f"  → Создан новый виртуальный основной товар: '{virtual_main_name}'")
+
+    print(f"Создано виртуальных основных товаров: {len(virtual_main_products)}")
+
+    stats = get_build_stats()['counters']
+    print(f"Сравнений сходства выполнено: {stats.get('similarity_comparisons', 0)}, "
+          f"пропущено благодаря категорийной блокировке: {stats.get('comparisons_skipped_by_category', 0)}")
+    print(f"Кэш оценок пар: попаданий {stats.get('pair_score_cache_hits', 0)}, "
+          f"промахов {stats.get('pair_score_cache_misses', 0)}")
+
+    return {
+        'main_products_order': main_products_order,
+        'analogs_by_main_product': analogs_by_main_product,
+        'orphan_analogs_by_main_product': orphan_analogs_by_main_product,
+        'virtual_main_products': virtual_main_products
+    }
+
+def _analog_summary_rows(analog_name, analog_items, main_product_name):
+    """
+    Строки свода для аналога: предложения всех листов, количество - из первой позиции с количеством.
+    Если поставщик предлагает аналог под другим написанием той же сущности, это предложение
+    попадает в отдельную строку, а не заменяет предыдущее. Повтор под тем же написанием,
+    как и у основных товаров, заменяет предыдущее предложение (в свод идет последнее).
+    
+    Args:
+        analog_name: Название аналога (сущности)
+        analog_items: Позиции аналога в порядке появления
+        main_product_name: Основной товар, к которому привязан аналог
+        
+    Returns:
+        list: Строки свода без 'name' (номер аналога назначает emit_summary_rows)
+    """
+    rows = []
+    # Написание, под которым лист предложил аналог в каждой строке: {(номер строки, лист): написание}
+    spellings = {}
+    for analog_item in analog_items:
+        sheet_name = analog_item['sheet_name']
+        spelling = analog_item['product_name']
+        row_index = next((index for index, row in enumerate(rows)
+                          if spellings.get((index, sheet_name), spelling) == spelling), None)
+        row = rows[row_index] if row_index is not None else None
+        if row is None:
+            if rows:
+                increment_stat('analog_offers_split')
+                print(f"  Поставщик '{sheet_name}' предлагает аналог '{analog_name}' несколько раз: "
+                      f"'{analog_item['product_name']}' выведен отдельной строкой")
+            row = {
+                'requested_qty': None,
+                'suppliers': {},
+                'row_type': 'analog',
+                'main_product': main_product_name,
+                'item_name': analog_item['product_name'] if rows else analog_name
+            }
+            row_index = len(rows)
+            rows.append(row)
+        spellings[row_index, sheet_name] = spelling
+        row['suppliers'][sheet_name] = analog_item['offered_data']
+        if row['requested_qty'] is None:
+            row['requested_qty'] = analog_item['requested_qty']
+    if not rows:
+        rows.append({'requested_qty': None, 'suppliers': {}, 'row_type': 'analog',
+                     'main_product': main_product_name, 'item_name': analog_name})
+    return rows
+
+def emit_summary_rows(product_index, matching):
+    """
+    Стадия "вывод": выдает строки свода товар за товаром - основной товар, его варианты и аналоги.
+
+    Args:
+        product_index: Результат group_supplier_items
+        matching: Результат match_analogs
+
+    Yields:
+        dict: Строка свода (см. collect_data_sequentially)
+    """
+    items_by_name = product_index['items_by_name']
+    analogs_by_main_product = matching['analogs_by_main_product']
+    orphan_analogs_by_main_product = matching['orphan_analogs_by_main_product']
+    virtual_main_products = matching['virtual_main_products']
+
+    for main_product_name in matching['main_products_order']:
+        check_build_budget()
+        product_items = items_by_name.get(main_product_name, [])
+
+        # Собираем предложения по основному товару
+        main_product_offers = {}
+        main_requested_qty = None
+        variant_items = []
+
+        for item in product_items:
+            if item['is_analog']:
+                # Аналог с названием основного товара - вариант этого товара
+                variant_items.append(item)
+                continue
+            main_product_offers[item['sheet_name']] = item['offered_data']
+            if main_requested_qty is None:
+                main_requested_qty = item['requested_qty']
+
+        # Если нет предложений по основному товару, но есть варианты или аналоги,
+        # берем количество из первого варианта/аналога
+        if main_requested_qty is None:
+            # Ищем количество в вариантах
+            for item in variant_items:
+                if item['requested_qty'] is not None:
+                    main_requested_qty = item['requested_qty']
+                    break
+
+            # Если не нашли в вариантах, ищем в аналогах
+            if main_requested_qty is None:
+                for analog in analogs_by_main_product.get(main_product_name, []):
+                    if analog['items'] and analog['items'][0]['requested_qty'] is not None:
+                        main_requested_qty = analog['items'][0]['requested_qty']
+                        break
+
+        # Строка основного товара (может быть пустой, если нет предложений)
+        yield {
+            'name': main_product_name,
+            'requested_qty': main_requested_qty,
+            'suppliers': main_product_offers,
+            'row_type': 'main',
+            'main_product': main_product_name,
+            'item_name': main_product_name
+        }
+
+        # Варианты основного товара
+        for variant_counter, item in enumerate(variant_items, start=1):
+            yield {
+                'name': f"{main_product_name} (вариант {variant_counter})",
+                'requested_qty': item['requested_qty'],
+                'suppliers': {item['sheet_name']: item['offered_data']},
+                'row_type': 'variant',
+                'main_product': main_product_name,
+                'item_name': item['product_name']
+            }
+
+        # Аналоги: найденные текстовым сопоставлением, сиротские, затем из виртуальных товаров
+        analog_groups = [(analog['name'], analog['items'])
+                         for analog in analogs_by_main_product.get(main_product_name, [])]
+        analog_groups.extend((orphan_analog['name'], _entity_items(product_index, orphan_analog['name']))
+                             for orphan_analog in orphan_analogs_by_main_product.get(main_product_name, []))
+        analog_groups.extend((virtual_analog['name'], virtual_analog['items'])
+                             for virtual_analog in virtual_main_products.get(main_product_name, []))
+
+        analog_counter = 1
+        processed_analogs = set()
+        for analog_name, analog_items in analog_groups:
+            if analog_name in processed_analogs:
+                continue
+            for analog_row in _analog_summary_rows(analog_name, analog_items, main_product_name):
+                yield {'name': f"{analog_row['item_name']} (аналог {analog_counter})", **analog_row}
+                analog_counter += 1
+            processed_analogs.add(analog_name)
+
+def iter_summary_rows(wb, sheet_names, use_category_blocking=True, use_fuzzy_matching=None,
+                      assignment_mode='greedy'):
+    """
+    Конвейер построения свода: чтение → классификация → группировка → сопоставление → вывод.
+
+    Чтение и классификация - генераторы, группировка потребляет их за один проход и хранит
+    позиции, проиндексированные по названию товара; строки свода выдаются лениво, по мере
+    потребления писателем, и не накапливаются списком.
+
+    Args:
+        wb: Рабочая книга Excel
+        sheet_names: Список имен листов для обработки
+        use_category_blocking: Сравнивать аналоги только с товарами из общей категорийной корзины
+        use_fuzzy_matching: Учитывать нечеткое сходство MinHash/LSH (по умолчанию - из правил сопоставления)
+        assignment_mode: 'greedy' - аналоги по очереди (исходная логика), 'global' - глобальное назначение
+
+    Returns:
+        generator: Строки свода (см. collect_data_sequentially)
+    """
+    if assignment_mode not in ('greedy', 'global'):
+        raise ValueError(f"Неизвестный режим назначения аналогов: {assignment_mode!r} (ожидается 'greedy' или 'global')")
+
+    product_index = group_supplier_items(classify_supplier_items(iter_supplier_items(wb, sheet_names)))
+    check_comparison_estimate(len(product_index['main_products_order']), len(product_index['analog_entities']))
+    matching = match_analogs(product_index, use_category_blocking=use_category_blocking,
+                             use_fuzzy_matching=use_fuzzy_matching, assignment_mode=assignment_mode)
+    return emit_summary_rows(product_index, matching)
+
+def collect_data_sequentially(wb, sheet_names, use_category_blocking=True, use_fuzzy_matching=None,
+                              assignment_mode='greedy'):
+    """
+    Последовательно собирает данные товар за товаром в правильном порядке.
+    Правильно обрабатывает основные товары, их варианты и аналоги.
+
+    Args:
+        wb: Рабочая книга Excel
+        sheet_names: Список имен листов для обработки
+        use_category_blocking: Сравнивать аналоги только с товарами из общей категорийной корзины
+        use_fuzzy_matching: Учитывать нечеткое сходство MinHash/LSH (по умолчанию - из правил сопоставления)
+        assignment_mode: 'greedy' - аналоги по очереди (исходная логика), 'global' - глобальное назначение
+
+    Returns:
+        list: Список строк для сводной таблицы в правильном порядке. Каждая строка - словарь
+            {'name': отображаемое название, 'requested_qty', 'suppliers': {лист: [кол-во, цена, срок, комментарий]},
+             'row_type': 'main'/'variant'/'analog', 'main_product': основной товар группы, 'item_name': название позиции}
+    """
+    return list(iter_summary_rows(wb, sheet_names, use_category_blocking=use_category_blocking,
+                                  use_fuzzy_matching=use_fuzzy_matching, assignment_mode=assignment_mode))
+
+def find_main_products(wb, sheet_names):
+    """
+    Находит названия всех основных товаров (без желтой заливки и отступов) на листах поставщиков.
+    
+    Args:
+        wb: Рабочая книга Excel
+        sheet_names: Список имен листов поставщиков
+        
+    Returns:
+        set: Названия основных товаров
+    """
+    all_main_products = set()
+    
+    for sheet_name in sheet_names:
+        for _, name_value, is_yellow, _ in iter_supplier_rows(wb, sheet_name):
+            if not name_value:
+                continue
+
+            # Проверяем, является ли это основным товаром (не имеет желтой заливки и отступов)
+            product_name, has_indent = describe_row_name(wb, name_value)
+            if not (is_yellow or has_indent):
+                all_main_products.add(product_name)
+    
+    return all_main_products
+
+def sort_suppliers_by_filled_prices(wb, sheet_names):
+    """
+    Сортирует поставщиков по количеству заполненных ценой строк (по убыванию).
+    
+    Args:
+        wb: Рабочая книга Excel
+        sheet_names: Список имен листов поставщиков
+        
+    Returns:
+        list: Отсортированный список имен листов
+    """
+    # Подсчитываем количество заполненных ценой строк для каждого поставщика
+    supplier_filled_counts = {}
+    
+    for sheet_name in sheet_names:
+        filled_count = 0
+
+        for _, name_value, _, values in iter_supplier_rows(wb, sheet_name):
+            if not name_value:
+                continue
+
+            # Проверяем, заполнена ли цена (4-я колонка)
+            price_value = values[2]
+            
+            if price_value is not None:
+                try:
+                    # Пытаемся преобразовать в число
+                    float(price_value)
+                    filled_count += 1
+                except (ValueError, TypeError):
+                    # Текстовая цена с валютой ('95,50 €') тоже заполнена; прочий текст пропускаем
+                    if isinstance(price_value, str) and _parse_price_text(price_value) is not None:
+                        filled_count += 1
+        
+        supplier_filled_counts[sheet_name] = filled_count
+        print(f"Поставщик '{sheet_name}': {filled_count} заполненных ценой строк")
+    
+    # Сортируем поставщиков по количеству заполненных строк (по убыванию)
+    sheet_names = sorted(sheet_names, key=lambda x: supplier_filled_counts[x], reverse=True)
+    print(f"\nПорядок поставщиков после сортировки по заполненности:")
+    for i, sheet_name in enumerate(sheet_names, 1):
+        print(f"  {i}. '{sheet_name}' - {supplier_filled_counts[sheet_name]} строк")
+    
+    return sheet_names
+
+# Расчетные колонки справа от колонок поставщиков
+PRICE_METRIC_HEADERS = ['Минимальная цена', 'Лучший поставщик', 'Разброс цен', 'Сумма по мин. цене']
+
+def _numeric_value(value):
+    """Число из значения ячейки (как в highlight_minimum_prices) или None."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+# Курсы валют и ставка НДС для приведения цен к рублям без НДС (см. normalize_price)
+DEFAULT_FX_RATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fx_rates.json')
+
+# Колонка цены на листе поставщика (D) - ее заголовок задает валюту и НДС листа
+PRICE_COLUMN_INDEX = 3
+
+# Таблица на случай, если fx_rates.json нет рядом со скриптом (например, не попал в сборку):
+# только рубли, поэтому рублевые тендеры собираются, а цены в других валютах не пересчитываются
+FALLBACK_FX_RATES = {
+    'as_of': None,
+    'base_currency': 'RUB',
+    'vat_rate': 0.2,
+    'currencies': {
+        'RUB': {'rate': 1.0, 'markers': ['₽', 'руб', 'rub', 'rur'], 'number_format': '#,##0.00 ₽'}
+    },
+    'vat_included_markers': ['с ндс', 'с учетом ндс', 'включая ндс', 'вкл. ндс', 'вкл ндс', 'в т.ч. ндс', 'в том числе ндс'],
+    'vat_excluded_markers': ['без ндс', 'без учета ндс', 'не облагается ндс', 'ндс не облагается']
+}
+
+@lru_cache(maxsize=8)
+def _load_fx_rates(fx_path):
+    try:
+        with open(fx_path, encoding='utf-8') as fx_file:
+            raw_rates = json.load(fx_file)
+    except FileNotFoundError:
+        print(f"⚠️ Файл курсов валют {fx_path} не найден: цены считаются рублевыми, "
+              f"другие валюты не пересчитываются")
+        raw_rates = FALLBACK_FX_RATES
+    
+    base_currency = raw_rates['base_currency']
+    currencies = raw_rates['currencies']
+    if base_currency not in currencies:
+        raise ValueError(f"{fx_path}: нет курса базовой валюты {base_currency}")
+    
+    currency_by_marker = {}
+    for code, currency in currencies.items():
+        for marker in currency['markers']:
+            currency_by_marker[marker.lower()] = code
+    # Длинные обозначения проверяются первыми ('бел. руб' раньше 'руб'); буквенные - только с начала слова
+    marker_patterns = [
+        (r'(?<![a-zа-яё])' if marker[0].isalpha() else '') + re.escape(marker)
+        for marker in sorted(currency_by_marker, key=len, reverse=True)
+    ]
+    
+    # Текстовая цена - вся ячейка: число, обозначение валюты до или после него (с окончанием слова:
+    # 'руб.', 'рублей'), признак НДС и единица ('/шт'). Прочий текст ('по запросу (2 недели)') ценой не считается
+    currency_pattern = '(?:' + '|'.join(marker_patterns) + r')[a-zа-яё]*\.?'
+    vat_pattern = '|'.join(re.escape(marker) for marker in
+                           sorted(raw_rates['vat_included_markers'] + raw_rates['vat_excluded_markers'],
+                                  key=len, reverse=True))
+    price_text_re = re.compile(
+        rf'(?:{currency_pattern})?\s*(-?\d(?:[\d\s.,]*\d)?)[.,]?\s*(?:{currency_pattern})?'
+        rf'(?:\s*[,(]?\s*(?:{vat_pattern})\)?)?(?:\s*(?:/|за)\s*шт\.?)?')
+    
+    if raw_rates is not FALLBACK_FX_RATES:
+        print(f"Загружены курсы валют на {raw_rates.get('as_of')} из {fx_path}")
+    return MappingProxyType({
+        'as_of': raw_rates.get('as_of'),
+        'base_currency': base_currency,
+        'vat_rate': float(raw_rates['vat_rate']),
+        'rates': MappingProxyType({code: float(currency['rate']) for code, currency in currencies.items()}),
+        'number_formats': MappingProxyType({code: currency.get('number_format') or f'#,##0.00 "{code}"'
+                                            for code, currency in currencies.items()}),
+        'currency_by_marker': MappingProxyType(currency_by_marker),
+        'currency_re': re.compile('|'.join(marker_patterns)),
+        'price_text_re': price_text_re,
+        'vat_included_markers': tuple(raw_rates['vat_included_markers']),
+        'vat_excluded_markers': tuple(raw_rates['vat_excluded_markers'])
+    })
+
+def get_fx_rates(fx_path=None):
+    """
+    Возвращает таблицу курсов валют. Файл читается один раз на процесс.
+    
+    Args:
+        fx_path: Путь к файлу курсов (по умолчанию SUMMARY_FX_RATES или fx_rates.json рядом со скриптом)
+        
+    Returns:
+        MappingProxyType: {'as_of', 'base_currency', 'vat_rate', 'rates': {валюта: курс к базовой}, ...}
+    """
+    return _load_fx_rates(os.path.abspath(fx_path or os.environ.get('SUMMARY_FX_RATES') or DEFAULT_FX_RATES_PATH))
+
+def detect_price_markers(text, fx_rates):
+    """
+    Ищет в тексте обозначение валюты и признак НДС ('$', 'руб', 'с НДС', 'без НДС').
+    
+    Args:
+        text: Заголовок колонки цены или значение ячейки
+        fx_rates: Таблица курсов (get_fx_rates)
+        
+    Returns:
+        tuple: (код валюты или None, True - цена с НДС / False - без НДС / None - не указано)
+    """
+    if not isinstance(text, str):
+        return None, None
+    text = ' '.join(text.lower().split())
+    
+    match = fx_rates['currency_re'].search(text)
+    currency = fx_rates['currency_by_marker'][match.group(0)] if match else None
+    
+    vat_included = None
+    if any(marker in text for marker in fx_rates['vat_excluded_markers']):
+        vat_included = False
+    elif any(marker in text for marker in fx_rates['vat_included_markers']):
+        vat_included = True
+    return currency, vat_included
+
+def supplier_price_header(wb, sheet_name):
+    """Заголовок колонки цены листа поставщика (None, если его нет)."""
+    if isinstance(wb, xlsx_stream_reader.StreamWorkbook):
+        header = wb.supplier_headers.get(sheet_name)
+        return header[PRICE_COLUMN_INDEX] if header else None
+    return wb[sheet_name].cell(row=1, column=PRICE_COLUMN_INDEX + 1).value
+
+def detect_supplier_pricing(wb, sheet_names, fx_rates=None):
+    """
+    Определяет валюту и включение НДС в цены каждого листа поставщика по заголовку колонки цены.
+    Без обозначений в заголовке цены считаются рублевыми без НДС (как в заголовках свода);
+    обозначения в самой ячейке цены ('120 $', '1 500 руб. с НДС') имеют приоритет (см. normalize_price).
+    
+    Args:
+        wb: Книга из load_source_workbook
+        sheet_names: Листы поставщиков
+        fx_rates: Таблица курсов (по умолчанию get_fx_rates())
+        
+    Returns:
+        dict: {лист: {'currency': код валюты, 'vat_included': цены с НДС}}
+    """
+    fx_rates = fx_rates or get_fx_rates()
+    supplier_pricing = {}
+    for sheet_name in sheet_names:
+        currency, vat_included = detect_price_markers(supplier_price_header(wb, sheet_name), fx_rates)
+        pricing = supplier_pricing[sheet_name] = {
+            'currency': currency or fx_rates['base_currency'],
+            'vat_included': bool(vat_included)
+        }
+        if pricing['currency'] != fx_rates['base_currency'] or pricing['vat_included']:
+            print(f"Поставщик '{sheet_name}': цены в {pricing['currency']}"
+                  f"{' с НДС' if pricing['vat_included'] else ''} - приводятся к рублям без НДС")
+    return supplier_pricing
+
+def _parse_price_text(text, fx_rates=None):
+    """
+    Число из текстовой цены ('1 200,50 $', '$1,200.50', '1 500 руб. с НДС') или None.
+    Ячейка должна целиком быть ценой: текст с числом внутри ('по запросу (2 недели)',
+    '12-15 тыс.') ценой не считается.
+    """
+    fx_rates = fx_rates or get_fx_rates()
+    match = fx_rates['price_text_re'].fullmatch(' '.join(text.lower().split()))
+    if not match:
+        return None
+    number = re.sub(r'\s', '', match.group(1))
+    if ',' in number and '.' in number:
+        # Разделитель дробной части - последний из двух
+        number = number.replace(',', '') if number.rfind('.') > number.rfind(',') else number.replace('.', '').replace(',', '.')
+    elif number.count(',') == 1:
+        number = number.replace(',', '.')
+    elif number.count(',') > 1 or number.count('.') > 1:
+        number = number.replace(',', '').replace('.', '')
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+def normalize_price(value, pricing, fx_rates):
+    """
+    Приводит цену предложения к рублям без НДС.
+    
+    Args:
+        value: Значение ячейки цены (число или текст с обозначением валюты)
+        pricing: Валюта и НДС листа (см. detect_supplier_pricing) или None - рубли без НДС
+        fx_rates: Таблица курсов (get_fx_rates)
+        
+    Returns:
+        tuple: (цена без НДС в валюте, код валюты, цена без НДС в рублях) или None, если цены нет
+    """
+    currency = pricing['currency'] if pricing else fx_rates['base_currency']
+    vat_included = pricing['vat_included'] if pricing else False
+    
+    amount = _numeric_value(value)
+    if amount is None:
+        if not isinstance(value, str):
+            return None
+        amount = _parse_price_text(value, fx_rates)
+        if amount is None:
+            return None
+        cell_currency, cell_vat_included = detect_price_markers(value, fx_rates)
+        currency = cell_currency or currency
+        if cell_vat_included is not None:
+            vat_included = cell_vat_included
+    
+    if vat_included:
+        amount = round(amount / (1 + fx_rates['vat_rate']), 2)
+    if currency == fx_rates['base_currency']:
+        return amount, currency, amount
+    return amount, currency, round(amount * fx_rates['rates'][currency], 2)
+
+def iter_price_metrics(summary_rows, sheet_names, supplier_totals, supplier_pricing=None):
+    """
+    Потоковая стадия расчета метрик: дополняет каждую строку свода минимальной ценой,
+    лучшим поставщиком, разбросом цен и суммами с учетом количества и сразу выдает ее дальше.
+    Итоги по поставщикам накапливаются в supplier_totals и готовы, когда строки исчерпаны.
+    
+    В том же проходе цены приводятся к рублям без НДС (normalize_price): пересчитанная цена
+    заменяет цену в предложении, поэтому свод и выделение минимальных цен сравнивают сопоставимые цены.
+    
+    В каждую строку добавляются ключи:
+        'min_price': минимальная цена без НДС за шт (None, если цен нет),
+        'best_supplier': поставщики с минимальной ценой через запятую,
+        'price_spread': разница между максимальной и минимальной ценой,
+        'best_total': запрошенное количество × минимальная цена,
+        'extended_prices': {поставщик: запрошенное количество × цена}
+    
+    Args:
+        summary_rows: Строки свода (список или генератор, см. iter_summary_rows)
+        sheet_names: Поставщики в порядке колонок свода
+        supplier_totals: Словарь для итогов {поставщик: {'price_sum': сумма цен за шт,
+            'extended_total': сумма количество × цена, 'priced_rows': число строк с ценой}}
+        supplier_pricing: Валюта и НДС листов (см. detect_supplier_pricing); по умолчанию - рубли без НДС
+        
+    Yields:
+        dict: Строка свода с метриками
+    """
+    fx_rates = get_fx_rates()
+    supplier_pricing = supplier_pricing or {}
+    for sheet_name in sheet_names:
+        supplier_totals[sheet_name] = {'price_sum': 0.0, 'extended_total': 0.0, 'priced_rows': 0}
+    
+    for row in summary_rows:
+        qty = _numeric_value(row['requested_qty'])
+        suppliers = row['suppliers']
+        prices = {}
+        for sheet_name in sheet_names:
+            offer = suppliers.get(sheet_name)
+            if offer is None:
+                continue
+            normalized = normalize_price(offer[1], supplier_pricing.get(sheet_name), fx_rates)
+            if normalized is None:
+                continue
+            price = normalized[2]
+            if price != offer[1]:
+                # Цена пересчитана или разобрана из текста - в свод идет цена в рублях без НДС
+                suppliers[sheet_name] = (offer[0], price) + tuple(offer[2:])
+                increment_stat('prices_normalized')
+            prices[sheet_name] = price
+        
+        extended_prices = {}
+        for sheet_name, price in prices.items():
+            totals = supplier_totals[sheet_name]
+            totals['price_sum'] += price
+            totals['priced_rows'] += 1
+            if qty is not None:
+                extended_prices[sheet_name] = round(qty * price, 2)
+                totals['extended_total'] += extended_prices[sheet_name]
+        
+        if prices:
+            min_price = min(prices.values())
+            row['min_price'] = min_price
+            row['best_supplier'] = ', '.join(name for name, price in prices.items() if price == min_price)
+            row['price_spread'] = round(max(prices.values()) - min_price, 2)
+            row['best_total'] = round(qty * min_price, 2) if qty is not None else None
+        else:
+            row['min_price'] = row['best_supplier'] = row['price_spread'] = row['best_total'] = None
+        row['extended_prices'] = extended_prices
+        yield row
+    
+    # Суммы округляем до копеек, чтобы в выгрузках не было хвостов плавающей точки
+    for totals in supplier_totals.values():
+        totals['price_sum'] = round(totals['price_sum'], 2)
+        totals['extended_total'] = round(totals['extended_total'], 2)
+
+def compute_price_metrics(summary_rows, sheet_names, supplier_pricing=None):
+    """
+    За один проход по строкам свода считает метрики цен (см. iter_price_metrics).
+    Результаты записываются в строки свода, поэтому доступны и писателям форматов данных.
+    
+    Args:
+        summary_rows: Строки свода (см. collect_data_sequentially)
+        sheet_names: Поставщики в порядке колонок свода
+        supplier_pricing: Валюта и НДС листов (см. detect_supplier_pricing)
+        
+    Returns:
+        dict: {поставщик: {'price_sum': сумма цен за шт, 'extended_total': сумма количество × цена,
+               'priced_rows': число строк с ценой}}
+    """
+    supplier_totals = {}
+    for _ in iter_price_metrics(summary_rows, sheet_names, supplier_totals, supplier_pricing):
+        pass
+    return supplier_totals
+
+def build_summary_data(filename, rules_path=None, assignment_mode='greedy', reader=None, stream_rows=False):
+    """
+    Собирает данные свода без оформления - для выгрузки в CSV, JSON и Parquet.
+    
+    Args:
+        filename: Путь к выгрузке ЯЗакупок (.xlsx) или список путей для объединения выгрузок
+        rules_path: Путь к файлу правил сопоставления (опционально)
+        assignment_mode: Режим назначения аналогов ('greedy' или 'global')
+        reader: Способ чтения выгрузки (см. load_source_workbook)
+        stream_rows: Выдавать строки свода генератором - они формируются по мере записи
+            и не накапливаются списком; supplier_totals заполняется, когда строки прочитаны
+        
+    Returns:
+        dict: {
+            'source': путь к исходному файлу,
+            'sheet_names': поставщики в порядке колонок свода,
+            'payment_terms': {поставщик: условия оплаты},
+            'supplier_pricing': {поставщик: валюта и НДС цен} (см. detect_supplier_pricing),
+            'summary_rows': строки свода (см. collect_data_sequentially и compute_price_metrics),
+            'supplier_totals': итоги по поставщикам (см. compute_price_metrics)
+        }
+    """
+    reset_build_stats()
+    activate_matching_rules(rules_path)
+    
+    with stage_timer('загрузка'):
+        wb = load_source_workbook(filename, reader=reader)
+    
+    return collect_summary_data(wb, filename, assignment_mode=assignment_mode, stream_rows=stream_rows)
+
+def collect_summary_data(wb, filename, assignment_mode='greedy', stream_rows=False):
+    """
+    Собирает данные свода по загруженной выгрузке (см. build_summary_data).
+    
+    Args:
+        wb: Книга из load_source_workbook
+        filename: Путь к выгрузке (попадает в результат как 'source')
+        assignment_mode: Режим назначения аналогов ('greedy' или 'global')
+        stream_rows: Выдавать строки свода генератором
+        
+    Returns:
+        dict: Данные свода (см. build_summary_data)
+    """
+    sheet_names = sort_suppliers_by_filled_prices(wb, wb.sheetnames[1:])
+    payment_terms = extract_payment_terms(wb, sheet_names)
+    
+    with stage_timer('сопоставление'):
+        summary_rows = iter_summary_rows(wb, sheet_names, assignment_mode=assignment_mode)
+        if not stream_rows:
+            summary_rows = list(summary_rows)
+    supplier_pricing = detect_supplier_pricing(wb, sheet_names)
+    supplier_totals = {}
+    summary_rows = iter_price_metrics(summary_rows, sheet_names, supplier_totals, supplier_pricing)
+    if not stream_rows:
+        summary_rows = list(summary_rows)
+    
+    return {
+        'source': filename,
+        'sheet_names': sheet_names,
+        'payment_terms': payment_terms,
+        'supplier_pricing': supplier_pricing,
+        'summary_rows': summary_rows,
+        'supplier_totals': supplier_totals
+    }
+
+def export_summary(filename, output_path, output_format='xlsx', rules_path=None, assignment_mode='greedy',
+                   reader=None, layout=None, profile_path=None):
+    """
+    Строит свод и сохраняет его в указанном формате.
+    Для форматов данных (csv, json, jsonl, parquet, arrow) оформление не выполняется.
+    
+    Args:
+        filename: Путь к выгрузке ЯЗакупок (.xlsx) или список путей для объединения выгрузок
+        output_path: Путь к файлу результата
+        output_format: 'xlsx', 'csv', 'json', 'jsonl', 'parquet' или 'arrow'
+        rules_path: Путь к файлу правил сопоставления (опционально)
+        assignment_mode: Режим назначения аналогов ('greedy' или 'global')
+        reader: Способ чтения выгрузки (см. load_source_workbook)
+        layout: Раскладка xlsx-свода из SUMMARY_LAYOUTS (см. resolve_summary_layout)
+        profile_path: Куда сохранить профиль сборки вместе с записью результата (см. build_profiler);
+            без пути сборка профилируется, только если задана SUMMARY_PROFILE (профиль - рядом с результатом)
+        
+    Returns:
+        str: Путь к сохраненному файлу
+    """
+    if output_format != 'xlsx' and output_format not in summary_writers.DATA_WRITERS:
+        raise ValueError(f"Неподдерживаемый формат свода: {output_format!r}. "
+                         f"Доступны: xlsx, {', '.join(summary_writers.DATA_WRITERS)}")
+    
+    profile_format = summary_profiling.env_profile_format()
+    if profile_path is None and profile_format:
+        profile_path = summary_profiling.profile_path_for(output_path, profile_format)
+    
+    with build_profiler(profile_path):
+        if output_format == 'xlsx':
+            summary_wb = build_summary_table(filename, rules_path=rules_path, assignment_mode=assignment_mode,
+                                             reader=reader, layout=layout)
+            if not summary_wb:
+                raise ValueError('Не удалось построить свод')
+            with stage_timer('запись'):
+                summary_wb.save(output_path)
+            return output_path
+        
+        # Построчные форматы получают строки свода потоком, прямо из стадии вывода;
+        # JSON-документу нужны итоги по поставщикам до строк, поэтому строки собираются списком
+        summary_data = build_summary_data(filename, rules_path=rules_path, assignment_mode=assignment_mode,
+                                          reader=reader, stream_rows=output_format != 'json')
+        with stage_timer('запись'):
+            summary_writers.write_summary(summary_data, output_path, output_format)
+        return output_path
+
+def export_summary_formats(filename, output_paths, rules_path=None, assignment_mode='greedy', reader=None,
+                           layout=None, profile_path=None):
+    """
+    Строит свод один раз и сохраняет его в нескольких форматах: выгрузка читается
+    и сопоставляется однократно, каждый формат записывается из одних и тех же данных.
+    
+    Args:
+        filename: Путь к выгрузке ЯЗакупок (.xlsx) или список путей для объединения выгрузок
+        output_paths: {формат: путь к файлу результата}, форматы - как в export_summary
+        rules_path: Путь к файлу правил сопоставления (опционально)
+        assignment_mode: Режим назначения аналогов ('greedy' или 'global')
+        reader: Способ чтения выгрузки (см. load_source_workbook)
+        layout: Раскладка xlsx-свода из SUMMARY_LAYOUTS (см. resolve_summary_layout)
+        profile_path: Куда сохранить профиль сборки (см. build_profiler)
+        
+    Returns:
+        dict: {формат: путь к сохраненному файлу}
+    """
+    unknown = [fmt for fmt in output_paths if fmt != 'xlsx' and fmt not in summary_writers.DATA_WRITERS]
+    if unknown:
+        raise ValueError(f"Неподдерживаемый формат свода: {unknown[0]!r}. "
+                         f"Доступны: xlsx, {', '.join(summary_writers.DATA_WRITERS)}")
+    
+    with build_profiler(profile_path):
+        reset_build_stats()
+        activate_matching_rules(rules_path)
+        with stage_timer('загрузка'):
+            wb = load_source_workbook(filename, reader=reader)
+        
+        # Строки собираются списком: их читают все форматы
+        summary_data = collect_summary_data(wb, filename, assignment_mode=assignment_mode)
+        for output_format, output_path in output_paths.items():
+            if output_format == 'xlsx':
+                summary_wb = render_summary_table(wb, summary_data, layout=layout)
+                with stage_timer('запись'):
+                    summary_wb.save(output_path)
+            else:
+                with stage_timer('запись'):
+                    summary_writers.write_summary(summary_data, output_path, output_format)
+    return dict(output_paths)
+
+def export_summary_with_admission(filename, output_path, output_format='xlsx', **export_options):
+    """
+    Строит свод через контроль допуска - для веб-интерфейсов. Выгрузка сначала оценивается
+    (admit_build), большая идет через очередь низкого приоритета, а сборка ограничена
+    сроком и бюджетом сравнений (build_limits). Сама сборка выполняется в пуле прогретых
+    процессов (summary_workers), если он не отключен.
+    
+    Args:
+        filename: Путь к выгрузке ЯЗакупок (.xlsx) или список путей для объединения выгрузок
+        output_path: Путь к файлу результата
+        output_format: Формат результата (см. export_summary)
+        **export_options: Остальные параметры export_summary
+        
+    Returns:
+        str: Путь к сохраненному файлу
+        
+    Raises:
+        AdmissionError: Выгрузка отклонена, очередь занята или сборка прервана по лимиту
+    """
+    estimate = admit_build(filename)
+    queue = low_priority_slot() if estimate['priority'] == 'low' else nullcontext()
+    pool = summary_workers.get_worker_pool()
+    with queue:
+        if pool is not None:
+            return pool.run(summary_workers.export_in_worker, filename, output_path, output_format,
+                            estimate['deadline_seconds'], export_options)
+        with build_limits(estimate['deadline_seconds']):
+            return export_summary(filename, output_path, output_format, **export_options)
+
+# Раскладки xlsx-свода: 'wide' - колонки по поставщикам, 'long' - строка на предложение,
+# 'topk' - лучшие предложения по каждой позиции; 'auto' выбирает по числу поставщиков
+SUMMARY_LAYOUTS = ('auto', 'wide', 'long', 'topk')
+DEFAULT_SUMMARY_LAYOUT = 'auto'
+
+# При большем числе поставщиков режим 'auto' строит вместо широкого свода листы 'topk' и 'long':
+# сотни колонок с объединенными заголовками и жирными границами Excel отображает медленно
+WIDE_LAYOUT_MAX_SUPPLIERS = int(os.environ.get('SUMMARY_WIDE_MAX_SUPPLIERS', 30))
+
+# Сколько лучших предложений показывать в раскладке 'topk'
+TOP_K_SUPPLIERS = 5
+
+LONG_LAYOUT_HEADERS = [
+    'Наименование', 'Основной товар', 'Тип строки', 'Количество запрошенное', 'Поставщик',
+    'Количество предложенное', 'Цена без НДС за шт', 'Сроки поставки', 'Комментарий поставщика',
+    'Сумма (кол-во × цена)', 'Минимальная цена', 'Условия оплаты'
+]
+
+def resolve_summary_layout(layout, supplier_count):
     """
-    Последовательно собирает данные товар за товаром в правильном порядке.
-    Правильно обрабатывает основные товары, их варианты и аналоги.
+    Определяет раскладку свода.
     
     Args:
-        wb: Рабочая книга Excel
-        sheet_names: Список имен листов для обработки
+        layout: Раскладка из SUMMARY_LAYOUTS или None (переменная окружения SUMMARY_LAYOUT
+            или DEFAULT_SUMMARY_LAYOUT)
+        supplier_count: Количество поставщиков
         
     Returns:
-        list: Список строк для сводной таблицы в правильном порядке
+        str: 'wide', 'long', 'topk' или 'topk+long' (для 'auto' при большом числе поставщиков)
+    """
+    layout = layout or os.environ.get('SUMMARY_LAYOUT') or DEFAULT_SUMMARY_LAYOUT
+    if layout not in SUMMARY_LAYOUTS:
+        raise ValueError(f"Неизвестная раскладка свода: {layout!r}. Доступны: {', '.join(SUMMARY_LAYOUTS)}")
+    if layout != 'auto':
+        return layout
+    if supplier_count > WIDE_LAYOUT_MAX_SUPPLIERS:
+        print(f"Поставщиков {supplier_count} > {WIDE_LAYOUT_MAX_SUPPLIERS}: используются раскладки 'topk' и 'long'")
+        return 'topk+long'
+    return 'wide'
+
+def _header_cells(worksheet, headers):
+    """Ячейки строки заголовков для листа в потоковом режиме: жирный шрифт, заливка, перенос."""
+    header_font = Font(bold=True)
+    header_fill = PatternFill(start_color='ADD8E6', end_color='ADD8E6', fill_type='solid')
+    header_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(worksheet, value=header)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_alignment
+        cells.append(cell)
+    return cells
+
+def _price_cell(worksheet, value, is_min=False):
+    """Ячейка с ценой в валютном формате; минимальная цена выделяется зеленым, как в highlight_minimum_prices."""
+    cell = WriteOnlyCell(worksheet, value=value)
+    cell.number_format = '#,##0.00 ₽'
+    if is_min:
+        cell.font = Font(color='008000')
+    return cell
+
+def write_long_layout_sheet(summary_wb, summary_rows, sheet_names, payment_terms):
     """
-    summary_rows = []
+    Добавляет в книгу (режим write_only) лист "Предложения": строка на каждое предложение
+    (позиция, поставщик) с автофильтром и закрепленной строкой заголовков.
     
-    # ЭТАП 1: Собираем все данные по листам в правильном порядке
-    all_data_sequence = []
+    Args:
+        summary_wb: Книга openpyxl в режиме write_only
+        summary_rows: Строки свода с метриками (см. compute_price_metrics)
+        sheet_names: Поставщики в порядке колонок свода
+        payment_terms: {поставщик: условия оплаты}
+    """
+    worksheet = summary_wb.create_sheet("Предложения")
+    for col_letter, width in zip('ABCDEFGHIJKL', (63.45, 40, 10, 12, 30, 10.27, 17.18, 8.45, 22.73, 17.18, 17.18, 30)):
+        worksheet.column_dimensions[col_letter].width = width
+    worksheet.freeze_panes = 'B2'
+    worksheet.append(_header_cells(worksheet, LONG_LAYOUT_HEADERS))
     
-    # Проходим по всем листам и собираем данные в том порядке, как они идут
-    for sheet_name in sheet_names:
-        ws = wb[sheet_name]
-        for row_idx, row in enumerate(ws.iter_rows(min_row=2), start=2):
-            if not row[0].value:
+    row_count = 1
+    for row_data in summary_rows:
+        suppliers = row_data['suppliers']
+        extended_prices = row_data['extended_prices']
+        min_price = row_data['min_price']
+        for sheet_name in sheet_names:
+            offer = suppliers.get(sheet_name)
+            if offer is None:
                 continue
-            
-            name_cell = row[0]
-            product_name = name_cell.value.strip() if isinstance(name_cell.value, str) else str(name_cell.value)
-            row_data = [cell.value for cell in row]
-            
-            all_data_sequence.append({
-                'sheet_name': sheet_name,
-                'row_idx': row_idx,
-                'name_cell': name_cell,
-                'product_name': product_name,
-                'requested_qty': row_data[1],
-                'offered_data': row_data[2:6]
-            })
-    
-    # ЭТАП 2: Находим все основные товары в порядке их первого появления
-    main_products_order = []
-    seen_main_products = set()
-    
-    for item in all_data_sequence:
-        # Для определения типа используем пустую строку как основной товар
-        item_type = get_item_type(item['name_cell'], "")
-        if item_type == 'main' and item['product_name'] not in seen_main_products:
-            main_products_order.append(item['product_name'])
-            seen_main_products.add(item['product_name'])
-    
-    # ЭТАП 2.1: Находим "сиротские" аналоги (аналоги без основного товара)
-    # Это могут быть аналоги ТВ или любых других товаров
-    orphan_analogs = []
-    tv_main_products = []  # Инициализируем переменную
-    
-    # Проходим по всем данным и ищем аналоги, которые не имеют основного товара
-    for item in all_data_sequence:
-        item_type = get_item_type(item['name_cell'], "")
-        if item_type == 'analog':
-            # Проверяем, есть ли основной товар для этого аналога
-            has_main_product = False
-            
-            # Ищем в том же листе основной товар перед этим аналогом
-            sheet_items = [x for x in all_data_sequence if x['sheet_name'] == item['sheet_name']]
-            for sheet_item in sheet_items:
-                if sheet_item['row_idx'] >= item['row_idx']:
-                    break
-                sheet_item_type = get_item_type(sheet_item['name_cell'], "")
-                if sheet_item_type == 'main':
-                    has_main_product = True
-                    break
-            
-            # Если нет основного товара, это "сиротский" аналог
-            if not has_main_product:
-                analog_info = {
-                    'name': item['product_name'],
-                    'sheet_name': item['sheet_name'],
-                    'row_idx': item['row_idx']
-                }
-                if analog_info not in orphan_analogs:
-                    orphan_analogs.append(analog_info)
-    
-    # Группируем сиротские аналоги и создаем для них основные товары
-    orphan_analogs_by_main_product = {}  # Группируем аналоги по основным товарам
-    tv_main_products = []
-    
+            price = _numeric_value(offer[1])
+            worksheet.append([
+                row_data['name'],
+                row_data.get('main_product'),
+                row_data.get('row_type'),
+                row_data['requested_qty'],
+                sheet_name,
+                offer[0],
+                _price_cell(worksheet, offer[1], is_min=price is not None and price == min_price),
+                offer[2],
+                offer[3],
+                _price_cell(worksheet, extended_prices.get(sheet_name)),
+                _price_cell(worksheet, min_price),
+                payment_terms.get(sheet_name)
+            ])
+            row_count += 1
+    
+    worksheet.auto_filter.ref = f"A1:{get_column_letter(len(LONG_LAYOUT_HEADERS))}{row_count}"
+    print(f"✓ Лист 'Предложения': {row_count - 1} предложений")
+
+def write_top_k_layout_sheet(summary_wb, summary_rows, sheet_names, top_k=TOP_K_SUPPLIERS):
+    """
+    Добавляет в книгу (режим write_only) компактный лист "Свод (топ-K)": по строке на позицию
+    и K лучших по цене предложений (поставщик, цена, срок поставки, сумма).
     
-    if orphan_analogs:
-        # Разделяем аналоги на ТВ и обычные товары
-        tv_analogs = [a for a in orphan_analogs if any(tv_keyword in a['name'].upper() for tv_keyword in ['OLED', 'LG', 'ТЕЛЕВИЗОР'])]
-        regular_analogs = [a for a in orphan_analogs if not any(tv_keyword in a['name'].upper() for tv_keyword in ['OLED', 'LG', 'ТЕЛЕВИЗОР'])]
+    Args:
+        summary_wb: Книга openpyxl в режиме write_only
+        summary_rows: Строки свода с метриками (см. compute_price_metrics)
+        sheet_names: Поставщики в порядке колонок свода
+        top_k: Сколько лучших предложений показывать
+    """
+    worksheet = summary_wb.create_sheet(f"Свод (топ-{top_k})")
+    headers = ['Наименование', 'Количество запрошенное', 'Предложений', 'Разброс цен']
+    widths = [63.45, 12, 12, 17.18]
+    for place in range(1, top_k + 1):
+        headers.extend([f"{place}. Поставщик", f"{place}. Цена без НДС за шт", f"{place}. Сроки поставки",
+                        f"{place}. Сумма (кол-во × цена)"])
+        widths.extend([30, 17.18, 8.45, 17.18])
+    for col_idx, width in enumerate(widths, start=1):
+        worksheet.column_dimensions[get_column_letter(col_idx)].width = width
+    worksheet.freeze_panes = 'B2'
+    worksheet.append(_header_cells(worksheet, headers))
+    
+    main_product_font = Font(size=13, bold=True)
+    row_count = 1
+    for row_data in summary_rows:
+        suppliers = row_data['suppliers']
+        priced_offers = []
+        for sheet_name in sheet_names:
+            offer = suppliers.get(sheet_name)
+            if offer is None:
+                continue
+            price = _numeric_value(offer[1])
+            if price is not None:
+                priced_offers.append((price, sheet_name, offer))
+        priced_offers.sort(key=lambda item: item[0])
         
-        # Обрабатываем обычные сиротские аналоги
-        if regular_analogs and main_products_order:
-            for analog in regular_analogs:
-                # Получаем количество аналога
-                analog_qty = None
-                for item in all_data_sequence:
-                    if item['product_name'] == analog['name']:
-                        analog_qty = item['requested_qty']
-                        break
-                
-                # Находим наиболее подходящий основной товар для этого аналога
-                best_main_product = find_best_main_product_for_analog(
-                    analog['name'],
-                    main_products_order,
-                    all_data_sequence,
-                    analog_qty
-                )
-                
-                if best_main_product:
-                    if best_main_product not in orphan_analogs_by_main_product:
-                        orphan_analogs_by_main_product[best_main_product] = []
-                    orphan_analogs_by_main_product[best_main_product].append(analog)
-    
-    # ЭТАП 2.2: Собираем ВСЕ аналоги для текстового сопоставления (исключаем варианты)
-    all_analogs_for_matching = {}  # {analog_name: [analog_data, ...]}
-    
-    for item in all_data_sequence:
-        item_type = get_item_type(item['name_cell'], "")
-        if item_type == 'analog':
-            # Проверяем, не является ли этот "аналог" на самом деле вариантом
-            # (т.е. его название совпадает с каким-то основным товаром)
-            is_variant = False
-            for main_product in main_products_order:
-                if item['product_name'] == main_product:
-                    is_variant = True
-                    break
-            
-            # Добавляем только настоящие аналоги (не варианты)
-            if not is_variant:
-                analog_name = item['product_name']
-                if analog_name not in all_analogs_for_matching:
-                    all_analogs_for_matching[analog_name] = []
-                all_analogs_for_matching[analog_name].append(item)
-    
-    # ЭТАП 2.3: Умное сопоставление аналогов с проверкой сходства
-    print("\n=== УМНОЕ СОПОСТАВЛЕНИЕ АНАЛОГОВ ===")
-    
-    analogs_by_main_product = {}
-    virtual_main_products = {}  # Для хранения виртуальных основных товаров
+        name_cell = WriteOnlyCell(worksheet, value=row_data['name'])
+        if row_data.get('row_type', 'main') == 'main':
+            name_cell.font = main_product_font
+        values = [name_cell, row_data['requested_qty'], len(priced_offers),
+                  _price_cell(worksheet, row_data['price_spread'])]
+        for price, sheet_name, offer in priced_offers[:top_k]:
+            values.extend([
+                sheet_name,
+                _price_cell(worksheet, offer[1], is_min=price == row_data['min_price']),
+                offer[2],
+                _price_cell(worksheet, row_data['extended_prices'].get(sheet_name))
+            ])
+        worksheet.append(values)
+        row_count += 1
+    
+    worksheet.auto_filter.ref = f"A1:{get_column_letter(len(headers))}{row_count}"
+    print(f"✓ Лист 'Свод (топ-{top_k})': {row_count - 1} позиций")
+
+def build_streaming_summary(summary_rows, sheet_names, payment_terms, layout, top_k=None):
+    """
+    Строит свод в раскладке 'long' и/или 'topk'. Книга создается в режиме write_only:
+    строки пишутся потоком, без объединенных ячеек и границ по колонкам поставщиков.
     
-    # Обрабатываем аналоги по одному, чтобы учитывать уже созданные виртуальные товары
-    for analog_name, analog_items in all_analogs_for_matching.items():
-        # Проверяем сходство со ВСЕМИ основными товарами (включая уже созданные виртуальные)
-        best_similarity = 0
-        best_main_product = None
-        is_virtual = False
-        
-        # Получаем количество аналога
-        analog_qty = analog_items[0]['requested_qty'] if analog_items else None
-        
-        # Создаем словарь количеств основных товаров для быстрого поиска
-        main_product_quantities = {}
-        for item in all_data_sequence:
-            item_type = get_item_type(item['name_cell'], "")
-            if item_type == 'main':
-                main_product_quantities[item['product_name']] = item['requested_qty']
-        
-        print(f"\n--- АНАЛИЗ АНАЛОГА: '{analog_name}' (кол-во: {analog_qty}) ---")
+    Args:
+        summary_rows: Строки свода с метриками (см. compute_price_metrics)
+        sheet_names: Поставщики в порядке убывания заполненности
+        payment_terms: {поставщик: условия оплаты}
+        layout: 'long', 'topk' или 'topk+long'
+        top_k: Сколько лучших предложений показывать (по умолчанию TOP_K_SUPPLIERS)
         
-        # Проверяем сходство с исходными основными товарами
-        for main_product in main_products_order:
-            # Находим количество основного товара
-            main_qty = main_product_quantities.get(main_product, None)
-            similarity = calculate_weighted_similarity(analog_name, main_product, qty1=analog_qty, qty2=main_qty)
-            print(f"  Сходство с '{main_product}' (кол-во: {main_qty}): {similarity:.3f}")
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_main_product = main_product
-                is_virtual = main_product in virtual_main_products
-        
-        # Также проверяем сходство с уже созданными виртуальными товарами
-        for virtual_main_name in virtual_main_products.keys():
-            if virtual_main_name not in main_products_order:
-                continue  # Уже проверили выше
-            # Для виртуальных товаров используем количество первого аналога
-            virtual_qty = virtual_main_products[virtual_main_name][0]['items'][0]['requested_qty'] if virtual_main_products[virtual_main_name] else None
-            similarity = calculate_weighted_similarity(analog_name, virtual_main_name, qty1=analog_qty, qty2=virtual_qty)
-            print(f"  Сходство с виртуальным '{virtual_main_name}' (кол-во: {virtual_qty}): {similarity:.3f}")
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_main_product = virtual_main_name
-                is_virtual = True
-        
-        print(f"  ИТОГ: лучшее сходство {best_similarity:.3f} с '{best_main_product}' {'(виртуальный)' if is_virtual else '(исходный)'}")
-        
-        # Решаем: привязать к существующему или создать виртуальный товар
-        # Находим количество лучшего основного товара
-        best_main_qty = None
-        if best_main_product in main_product_quantities:
-            best_main_qty = main_product_quantities[best_main_product]
-        elif best_main_product in virtual_main_products:
-            # Для виртуальных товаров берем количество первого аналога
-            if virtual_main_products[best_main_product]:
-                best_main_qty = virtual_main_products[best_main_product][0]['items'][0]['requested_qty']
-        
-        # Используем универсальную функцию для проверки группировки
-        if should_group_items(best_similarity, analog_qty, best_main_qty):
-            if is_virtual:
-                # Привязываем к виртуальному основному товару
-                virtual_main_products[best_main_product].append({
-                    'name': analog_name,
-                    'items': analog_items
-                })
-                print(f"  → Привязан к виртуальному товару '{best_main_product}'")
-            else:
-                # Привязываем к исходному основному товару
-                if best_main_product not in analogs_by_main_product:
-                    analogs_by_main_product[best_main_product] = []
-                analogs_by_main_product[best_main_product].append({
-                    'name': analog_name,
-                    'items': analog_items
-                })
-                print(f"  → Привязан к исходному товару '{best_main_product}'")
-        else:
-            # Создаем новый виртуальный основной товар
-            virtual_main_name = generate_main_product_name(analog_name)
-            
-            # Проверяем, не существует ли уже виртуальный товар с таким же названием
-            if virtual_main_name in virtual_main_products:
-                # Добавляем к существующему виртуальному товару
-                virtual_main_products[virtual_main_name].append({
-                    'name': analog_name,
-                    'items': analog_items
-                })
-                print(f"  → Аналог добавлен к существующему виртуальному товару: '{virtual_main_name}'")
-            else:
-                # Создаем новый виртуальный товар
-                virtual_main_products[virtual_main_name] = []
-                virtual_main_products[virtual_main_name].append({
-                    'name': analog_name,
-                    'items': analog_items
-                })
-                
-                # Добавляем виртуальный основной товар в общий список
-                main_products_order.append(virtual_main_name)
-                print(f"  → Создан новый виртуальный основной товар: '{virtual_main_name}'")
+    Returns:
+        openpyxl.Workbook: Книга в режиме write_only (сохраняется один раз)
+    """
+    summary_wb = openpyxl.Workbook(write_only=True)
+    if 'topk' in layout:
+        write_top_k_layout_sheet(summary_wb, summary_rows, sheet_names, top_k or TOP_K_SUPPLIERS)
+    if 'long' in layout:
+        write_long_layout_sheet(summary_wb, summary_rows, sheet_names, payment_terms)
+    return summary_wb
+
+def build_summary_table(filename, rules_path=None, assignment_mode='greedy', reader=None, layout=None,
+                        top_k=None, profile_path=None):
+    """
+    Строит оформленный xlsx-свод.
     
-    print(f"Создано виртуальных основных товаров: {len(virtual_main_products)}")
+    Args:
+        filename: Путь к выгрузке ЯЗакупок (.xlsx) или список путей для объединения выгрузок
+        rules_path: Путь к файлу правил сопоставления (опционально)
+        assignment_mode: Режим назначения аналогов ('greedy' или 'global')
+        reader: Способ чтения выгрузки (см. load_source_workbook)
+        layout: Раскладка свода из SUMMARY_LAYOUTS (см. resolve_summary_layout)
+        top_k: Сколько лучших предложений показывать в раскладке topk
+        profile_path: Куда сохранить профиль сборки (см. build_profiler); без пути сборка
+            профилируется, только если задана SUMMARY_PROFILE (профиль - в summary_profiling.PROFILE_DIR)
+        
+    Returns:
+        openpyxl.Workbook: Книга свода
+    """
+    profile_format = summary_profiling.env_profile_format()
+    if profile_path is None and profile_format:
+        profile_path = summary_profiling.default_profile_path(filename, profile_format)
+    with build_profiler(profile_path):
+        return _build_summary_table(filename, rules_path, assignment_mode, reader, layout, top_k)
+
+def _build_summary_table(filename, rules_path, assignment_mode, reader, layout, top_k):
+    reset_build_stats()
     
+    # Подхватываем актуальные правила сопоставления (файл перечитывается только при изменении)
+    activate_matching_rules(rules_path)
     
-    # ЭТАП 3: Обрабатываем каждый основной товар последовательно
-    for main_product_name in main_products_order:
-        
-        # 3.1: Собираем предложения по основному товару
-        main_product_offers = {}
-        main_requested_qty = None
-        
-        for item in all_data_sequence:
-            item_type = get_item_type(item['name_cell'], main_product_name)
-            if item_type == 'main' and item['product_name'] == main_product_name:
-                main_product_offers[item['sheet_name']] = item['offered_data']
-                if main_requested_qty is None:
-                    main_requested_qty = item['requested_qty']
-        
-        
-        # Если нет предложений по основному товару, но есть варианты или аналоги,
-        # берем количество из первого варианта/аналога
-        if main_requested_qty is None:
-            # Ищем количество в вариантах
-            for item in all_data_sequence:
-                item_type = get_item_type(item['name_cell'], main_product_name)
-                if item_type == 'variant' and item['requested_qty'] is not None:
-                    main_requested_qty = item['requested_qty']
-                    break
-            
-            # Если не нашли в вариантах, ищем в аналогах
-            if main_requested_qty is None:
-                if main_product_name in analogs_by_main_product:
-                    for analog in analogs_by_main_product[main_product_name]:
-                        if analog['items'] and analog['items'][0]['requested_qty'] is not None:
-                            main_requested_qty = analog['items'][0]['requested_qty']
-                            break
-        
-        # Добавляем строку основного товара (может быть пустой, если нет предложений)
-        main_row = {
-            'name': main_product_name,
-            'requested_qty': main_requested_qty,
-            'suppliers': main_product_offers
-        }
-        summary_rows.append(main_row)
-        
-        # 3.2: Ищем и добавляем варианты основного товара
-        variant_counter = 1
-        
-        for item in all_data_sequence:
-            item_type = get_item_type(item['name_cell'], main_product_name)
-            if item_type == 'variant':
-                variant_row = {
-                    'name': f"{main_product_name} (вариант {variant_counter})",
-                    'requested_qty': item['requested_qty'],
-                    'suppliers': {item['sheet_name']: item['offered_data']}
-                }
-                summary_rows.append(variant_row)
-                variant_counter += 1
-        
-        # 3.3: Ищем и добавляем аналоги основного товара
-        analog_counter = 1
-        processed_analogs = set()
-        
-        # Добавляем аналоги, найденные через текстовое сопоставление
-        if main_product_name in analogs_by_main_product:
-            for analog in analogs_by_main_product[main_product_name]:
-                if analog['name'] not in processed_analogs:
-                    # Собираем все предложения по этому аналогу из всех листов
-                    analog_offers = {}
-                    analog_requested_qty = None
-                    
-                    for analog_item in analog['items']:
-                        analog_offers[analog_item['sheet_name']] = analog_item['offered_data']
-                        if analog_requested_qty is None:
-                            analog_requested_qty = analog_item['requested_qty']
-                    
-                    analog_row = {
-                        'name': f"{analog['name']} (аналог {analog_counter})",
-                        'requested_qty': analog_requested_qty,
-                        'suppliers': analog_offers
-                    }
-                    summary_rows.append(analog_row)
-                    processed_analogs.add(analog['name'])
-                    analog_counter += 1
-        
-        # Добавляем сиротские аналоги, которые не попали в общее сопоставление
-        if main_product_name in orphan_analogs_by_main_product:
-            for orphan_analog in orphan_analogs_by_main_product[main_product_name]:
-                if orphan_analog['name'] not in processed_analogs:
-                    # Собираем все предложения по этому аналогу из всех листов
-                    analog_offers = {}
-                    analog_requested_qty = None
-                    
-                    for analog_item in all_data_sequence:
-                        if analog_item['product_name'] == orphan_analog['name']:
-                            analog_offers[analog_item['sheet_name']] = analog_item['offered_data']
-                            if analog_requested_qty is None:
-                                analog_requested_qty = analog_item['requested_qty']
-                    
-                    analog_row = {
-                        'name': f"{orphan_analog['name']} (аналог {analog_counter})",
-                        'requested_qty': analog_requested_qty,
-                        'suppliers': analog_offers
-                    }
-                    summary_rows.append(analog_row)
-                    processed_analogs.add(orphan_analog['name'])
-                    analog_counter += 1
-        
-        # Добавляем аналоги из виртуальных основных товаров
-        if main_product_name in virtual_main_products:
-            for virtual_analog in virtual_main_products[main_product_name]:
-                if virtual_analog['name'] not in processed_analogs:
-                    # Собираем все предложения по этому аналогу из всех листов
-                    analog_offers = {}
-                    analog_requested_qty = None
-                    
-                    for analog_item in virtual_analog['items']:
-                        analog_offers[analog_item['sheet_name']] = analog_item['offered_data']
-                        if analog_requested_qty is None:
-                            analog_requested_qty = analog_item['requested_qty']
-                    
-                    analog_row = {
-                        'name': f"{virtual_analog['name']} (аналог {analog_counter})",
-                        'requested_qty': analog_requested_qty,
-                        'suppliers': analog_offers
-                    }
-                    summary_rows.append(analog_row)
-                    processed_analogs.add(virtual_analog['name'])
-                    analog_counter += 1
-    
-    return summary_rows
-
-def build_summary_table(filename):
     # Загружаем исходный Excel
-    wb = openpyxl.load_workbook(filename)
+    with stage_timer('загрузка'):
+        wb = load_source_workbook(filename, reader=reader)
+    
+    return render_summary_table(wb, assignment_mode=assignment_mode, layout=layout, top_k=top_k)
+
+def render_summary_table(wb, summary_data=None, assignment_mode='greedy', layout=None, top_k=None):
+    """
+    Строит оформленный xlsx-свод по загруженной выгрузке.
     
+    Args:
+        wb: Книга из load_source_workbook
+        summary_data: Данные свода той же выгрузки из collect_summary_data (строки списком) -
+            тогда сопоставление и расчет цен не повторяются
+        assignment_mode: Режим назначения аналогов ('greedy' или 'global'), если summary_data нет
+        layout: Раскладка свода из SUMMARY_LAYOUTS (см. resolve_summary_layout)
+        top_k: Сколько лучших предложений показывать в раскладке topk
+        
+    Returns:
+        openpyxl.Workbook: Книга свода
+    """
     # Получаем список листов поставщиков (пропускаем первый лист)
     sheet_names = wb.sheetnames[1:]
     
     # ЭТАП 1: Определяем количество основных товаров
-    all_main_products = set()
-    
-    for sheet_name in sheet_names:
-        ws = wb[sheet_name]
-        for row in ws.iter_rows(min_row=2):
-            if not row[0].value:
-                continue
-            
-            name_cell = row[0]
-            # Проверяем, является ли это основным товаром (не имеет желтой заливки и отступов)
-            if not (is_yellow_cell(name_cell) or (isinstance(name_cell.value, str) and name_cell.value.startswith('      '))):
-                product_name = name_cell.value.strip() if isinstance(name_cell.value, str) else str(name_cell.value)
-                all_main_products.add(product_name)
+    all_main_products = find_main_products(wb, sheet_names)
     
     print(f"Найдено основных товаров: {len(all_main_products)}")
     print(f"Список основных товаров: {list(all_main_products)}")
@@ -1345,44 +3474,33 @@ def build_summary_table(filename):
     # ЭТАП 2: Выбираем формат свода в зависимости от количества основных товаров
     if len(all_main_products) == 1:
         print("Используется упрощенный формат для одного товара")
-        return build_single_product_summary(wb, sheet_names)
+        with stage_timer('форматирование'):
+            return build_single_product_summary(wb, sheet_names)
     else:
         print(f"Используется стандартный формат для {len(all_main_products)} товаров")
         
-        # ЭТАП 2.5: Подсчитываем количество заполненных ценой строк для каждого поставщика
-        supplier_filled_counts = {}
-        
-        for sheet_name in sheet_names:
-            ws = wb[sheet_name]
-            filled_count = 0
-            
-            for row in ws.iter_rows(min_row=2):
-                if not row[0].value:
-                    continue
-                
-                # Проверяем, заполнена ли цена (колонка с индексом 3, т.е. 4-я колонка)
-                price_value = row[3].value if len(row) > 3 else None
-                
-                if price_value is not None:
-                    try:
-                        # Пытаемся преобразовать в число
-                        float(price_value)
-                        filled_count += 1
-                    except (ValueError, TypeError):
-                        # Если не число, пропускаем
-                        pass
-            
-            supplier_filled_counts[sheet_name] = filled_count
-            print(f"Поставщик '{sheet_name}': {filled_count} заполненных ценой строк")
-        
-        # ЭТАП 2.6: Сортируем поставщиков по количеству заполненных строк (по убыванию)
-        sheet_names = sorted(sheet_names, key=lambda x: supplier_filled_counts[x], reverse=True)
-        print(f"\nПорядок поставщиков после сортировки по заполненности:")
-        for i, sheet_name in enumerate(sheet_names, 1):
-            print(f"  {i}. '{sheet_name}' - {supplier_filled_counts[sheet_name]} строк")
-        
-        # Продолжаем со стандартной логикой
-        pass
+        # ЭТАП 2.5-2.6: Сортируем поставщиков по количеству заполненных ценой строк
+        if summary_data is not None:
+            sheet_names = summary_data['sheet_names']
+        else:
+            sheet_names = sort_suppliers_by_filled_prices(wb, sheet_names)
+    
+    # ЭТАП 2.7: При большом числе поставщиков строим потоковые раскладки вместо широкой таблицы
+    layout = resolve_summary_layout(layout, len(sheet_names))
+    if layout != 'wide':
+        if summary_data is not None:
+            payment_terms = summary_data['payment_terms']
+            summary_rows = summary_data['summary_rows']
+        else:
+            payment_terms = extract_payment_terms(wb, sheet_names)
+            with stage_timer('сопоставление'):
+                summary_rows = iter_summary_rows(wb, sheet_names, assignment_mode=assignment_mode)
+            summary_rows = iter_price_metrics(summary_rows, sheet_names, {}, detect_supplier_pricing(wb, sheet_names))
+        if layout == 'topk+long':
+            # Два листа читают строки дважды
+            summary_rows = list(summary_rows)
+        with stage_timer('форматирование'):
+            return build_streaming_summary(summary_rows, sheet_names, payment_terms, layout, top_k=top_k)
 
     # Создаём новый файл для свода
     summary_wb = openpyxl.Workbook()
@@ -1390,7 +3508,10 @@ def build_summary_table(filename):
     summary_ws.title = "Свод"
 
     # Извлекаем условия оплаты с первого листа
-    payment_terms = extract_payment_terms(wb, sheet_names)
+    if summary_data is not None:
+        payment_terms = summary_data['payment_terms']
+    else:
+        payment_terms = extract_payment_terms(wb, sheet_names)
     
     # Формируем заголовки
     headers_row_1 = ["Наименование", "Количество запрошенное"]
@@ -1401,6 +3522,11 @@ def build_summary_table(filename):
         headers_row_1.extend([sheet_name, "", "", ""])
         headers_row_2.extend(["Количество предложенное", "Цена без НДС за шт", "Сроки поставки", "Комментарий поставщика"])
         col += 4
+    
+    # Расчетные колонки (значения, а не формулы - Excel не пересчитывает их при открытии)
+    metric_start_col = col
+    headers_row_1.extend(PRICE_METRIC_HEADERS)
+    headers_row_2.extend(PRICE_METRIC_HEADERS)
 
     summary_ws.append(headers_row_1)
     summary_ws.append(headers_row_2)
@@ -1413,66 +3539,69 @@ def build_summary_table(filename):
     summary_ws["B1"].alignment = Alignment(horizontal="center", vertical="center")
 
     # Объединение заголовков по поставщикам
-    for col in range(3, len(headers_row_1) + 1, 4):
+    for col in range(3, metric_start_col, 4):
         summary_ws.merge_cells(start_row=1, start_column=col, end_row=1, end_column=col+3)
         summary_ws.cell(row=1, column=col).alignment = Alignment(horizontal="center", vertical="center")
+    
+    # Заголовки расчетных колонок занимают обе строки, как "Наименование"
+    for col in range(metric_start_col, len(headers_row_1) + 1):
+        summary_ws.merge_cells(start_row=1, start_column=col, end_row=2, end_column=col)
+        summary_ws.cell(row=1, column=col).alignment = Alignment(horizontal="center", vertical="center")
 
     # ПОСЛЕДОВАТЕЛЬНАЯ ЛОГИКА: Обрабатываем товары один за другим в правильном порядке
-    summary_rows = collect_data_sequentially(wb, sheet_names)
+    if summary_data is not None:
+        # Цены в строках уже приведены к рублям без НДС - повторный расчет пересчитал бы их снова
+        summary_rows = summary_data['summary_rows']
+        supplier_totals = summary_data['supplier_totals']
+    else:
+        with stage_timer('сопоставление'):
+            summary_rows = collect_data_sequentially(wb, sheet_names, assignment_mode=assignment_mode)
+        supplier_totals = compute_price_metrics(summary_rows, sheet_names, detect_supplier_pricing(wb, sheet_names))
+    formatting_started = time.perf_counter()
 
     # Заполняем свод
     row_idx = 3
     for row_data in summary_rows:
-        summary_ws.cell(row=row_idx, column=1, value=row_data['name'])
-        summary_ws.cell(row=row_idx, column=2, value=row_data['requested_qty'])
-
-        col = 3
-        for sheet_name in sheet_names:
-            if sheet_name in row_data['suppliers']:
-                vals = row_data['suppliers'][sheet_name]
-                for i in range(4):
-                    summary_ws.cell(row=row_idx, column=col+i, value=vals[i])
-            col += 4
-
+        check_build_budget()
+        for col, value in wide_row_values(row_data, sheet_names):
+            summary_ws.cell(row=row_idx, column=col, value=value)
         row_idx += 1
 
     # Добавляем строку с суммами
     if row_idx > 3:  # Если есть данные
+        last_data_row = row_idx - 1
+        
         # Добавляем пустую строку для разделения
         row_idx += 1
         
-        # Добавляем строку "ИТОГО"
+        # Добавляем строку "ИТОГО" (сумма цен за шт) и строку с учетом запрошенного количества.
+        # Суммы записываются значениями из compute_price_metrics, чтобы Excel не пересчитывал формулы
         summary_ws.cell(row=row_idx, column=1, value="ИТОГО")
+        summary_ws.cell(row=row_idx + 1, column=1, value="ИТОГО с учетом количества")
         
-        # Вычисляем суммы по колонкам "Цена без НДС за шт"
         col = 3
         for sheet_name in sheet_names:
-            # Находим колонку с ценами для текущего поставщика
-            price_col = None
-            for i, header in enumerate(headers_row_2):
-                if header == 'Цена без НДС за шт' and i >= col - 1 and i < col + 3:
-                    price_col = i + 1
-                    break
-            
-            if price_col:
-                # Создаем формулу суммы для колонки с ценами
-                start_row = 3
-                end_row = row_idx - 2  # Исключаем пустую строку и строку ИТОГО
-                formula = f"=SUM({summary_ws.cell(row=start_row, column=price_col).coordinate}:{summary_ws.cell(row=end_row, column=price_col).coordinate})"
-                summary_ws.cell(row=row_idx, column=price_col, value=formula)
-            
+            # Колонка "Цена без НДС за шт" - вторая в блоке поставщика
+            price_col = col + 1
+            summary_ws.cell(row=row_idx, column=price_col, value=supplier_totals[sheet_name]['price_sum'])
+            summary_ws.cell(row=row_idx + 1, column=price_col, value=supplier_totals[sheet_name]['extended_total'])
             col += 4
         
+        best_totals = [row_data['best_total'] for row_data in summary_rows if row_data['best_total'] is not None]
+        summary_ws.cell(row=row_idx + 1, column=metric_start_col + 3, value=round(sum(best_totals), 2))
+        row_idx += 1
+        
         max_col = len(headers_row_1)
         
-        # Применяем валютный формат к столбцам с ценами (включая строку ИТОГО)
+        # Применяем валютный формат к столбцам с ценами (включая строки ИТОГО)
         apply_currency_format_to_price_columns(summary_ws, headers_row_2, 3, row_idx)
+        apply_currency_format_to_metric_columns(summary_ws, metric_start_col, 3, row_idx)
         
-        # Выделяем минимальные цены зеленым цветом (исключая строку ИТОГО)
-        highlight_minimum_prices(summary_ws, headers_row_2, 3, row_idx - 2)
+        # Выделяем минимальные цены зеленым цветом (исключая строки ИТОГО)
+        highlight_minimum_prices(summary_ws, headers_row_2, 3, last_data_row)
         
         # Устанавливаем ширину колонок и включаем перенос текста
-        set_column_widths_and_wrap_text(summary_ws, headers_row_2)
+        set_column_widths_and_wrap_text(summary_ws, headers_row_2, summary_rows, sheet_names)
         
         # СНАЧАЛА: Применяем базовые тонкие границы ко ВСЕМ ячейкам
         apply_borders_to_range(summary_ws, 1, 1, row_idx, max_col)
@@ -1485,8 +3614,7 @@ def build_summary_table(filename):
         format_main_product_groups(summary_ws, summary_rows, max_col, start_row=3)
         
         # ИСПРАВЛЕНИЕ: Добавляем жирную нижнюю границу к последней строке данных
-        # Последняя строка данных находится перед пустой строкой (row_idx - 2)
-        last_data_row = row_idx - 2
+        # Последняя строка данных находится перед пустой строкой
         thick_bottom_border = Border(
             left=Side(style='thin'),
             right=Side(style='thin'),
@@ -1510,10 +3638,11 @@ def build_summary_table(filename):
         # Применяем жирные границы для колонок поставщиков
         apply_thick_borders_to_supplier_columns(summary_ws, sheet_names, row_idx)
         
-        # Делаем строку ИТОГО жирной
+        # Делаем строки ИТОГО жирными
         from openpyxl.styles import Font
         bold_font = Font(bold=True)
         for col_idx in range(1, max_col + 1):
+            summary_ws.cell(row=row_idx - 1, column=col_idx).font = bold_font
             summary_ws.cell(row=row_idx, column=col_idx).font = bold_font
         
         # Добавляем условия оплаты
@@ -1561,12 +3690,13 @@ def build_summary_table(filename):
         
         # Применяем валютный формат к столбцам с ценами
         apply_currency_format_to_price_columns(summary_ws, headers_row_2, 3, row_idx - 1)
+        apply_currency_format_to_metric_columns(summary_ws, metric_start_col, 3, row_idx - 1)
         
         # Выделяем минимальные цены зеленым цветом
         highlight_minimum_prices(summary_ws, headers_row_2, 3, row_idx - 1)
         
         # Устанавливаем ширину колонок и включаем перенос текста
-        set_column_widths_and_wrap_text(summary_ws, headers_row_2)
+        set_column_widths_and_wrap_text(summary_ws, headers_row_2, summary_rows, sheet_names)
         
         # СНАЧАЛА: Применяем базовые тонкие границы ко ВСЕМ ячейкам
         apply_borders_to_range(summary_ws, 1, 1, row_idx - 1, max_col)
@@ -1605,100 +3735,164 @@ def build_summary_table(filename):
         # Применяем жирные границы для колонок поставщиков
         apply_thick_borders_to_supplier_columns(summary_ws, sheet_names, row_idx - 1)
 
+    add_stage_timing('форматирование', time.perf_counter() - formatting_started)
     return summary_wb
 
 
-def build_single_product_summary(wb, sheet_names):
-    """Создает сводную таблицу для случая с одним основным товаром"""
-    try:
-        summary_wb = openpyxl.Workbook()
-        ws = summary_wb.active
-        ws.title = "Свод"
-    
-        # Заголовки
-        headers = [
-            "Наименование",
-            "Количество запрошенное",
-            "Количество предложенное",
-            "Цена за единицу без НДС в валюте",
-            "Цена за единицу без НДС в рублях",
-            "Сумма рубли без НДС",
-            "Название поставщика",
-            "Сроки поставки",
-            "Условия оплаты",
-            "Комментарий поставщика"
-        ]
-        ws.append(headers)
-        
-        # Форматируем заголовки: светло-голубая заливка и жирный шрифт
-        light_blue_fill = PatternFill(start_color='ADD8E6', end_color='ADD8E6', fill_type='solid')
-        bold_font = Font(bold=True)
-        
-        for col in range(1, 11):  # Колонки A-J (1-10)
-            cell = ws.cell(row=1, column=col)
-            cell.fill = light_blue_fill
-            cell.font = bold_font
-        
-        # Получаем условия оплаты
-        payment_terms = extract_payment_terms(wb, sheet_names)
+# Заголовки свода для одного основного товара
+SINGLE_PRODUCT_HEADERS = [
+    "Наименование",
+    "Количество запрошенное",
+    "Количество предложенное",
+    "Цена за единицу без НДС в валюте",
+    "Цена за единицу без НДС в рублях",
+    "Сумма рубли без НДС",
+    "Название поставщика",
+    "Сроки поставки",
+    "Условия оплаты",
+    "Комментарий поставщика"
+]
+
+class SummaryRowError(ValueError):
+    """Ошибка при обработке строки листа поставщика; сообщение содержит имя листа и номер строки."""
+
+    def __init__(self, sheet_name, row_idx, reason):
+        super().__init__(f"Лист '{sheet_name}', строка {row_idx}: {reason}")
+        self.sheet_name = sheet_name
+        self.row_idx = row_idx
+        self.reason = reason
+
+    def __reduce__(self):
+        return type(self), (self.sheet_name, self.row_idx, str(self.reason))
+
+def _price_sort_key(row):
+    """Ключ сортировки строк поставщика по цене в рублях: строки без цены - в конце."""
+    normalized = row[3]
+    return (normalized is None, normalized[2] if normalized is not None else 0.0)
+
+def build_single_product_summary(wb, sheet_names, sort_by_price=True):
+    """
+    Создает сводную таблицу для случая с одним основным товаром.
+    
+    Строки поставщиков читаются в компактном виде (только значения колонок A-F) и сразу
+    пишутся полностью оформленными на лист в режиме write_only - за один проход,
+    поэтому память не растет с числом строк в своде. В памяти держатся только строки
+    одного поставщика - для сортировки по цене.
+    
+    Args:
+        wb: Книга из load_source_workbook
+        sheet_names: Листы поставщиков
+        sort_by_price: Сортировать предложения каждого поставщика по цене в рублях
         
-        # Собираем данные по поставщикам
-        row_num = 2
-        for sheet_name in sheet_names:
-            sheet = wb[sheet_name]
-            for row in sheet.iter_rows(min_row=2, values_only=True):
-                if not row[0]:  # Пропускаем пустые строки
-                    continue
-                    
-                # Добавляем данные поставщика
-                ws.cell(row=row_num, column=1, value=row[0])  # Наименование
-                ws.cell(row=row_num, column=2, value=row[1])  # Кол-во запрошенное
-                ws.cell(row=row_num, column=3, value=row[2])  # Кол-во предложенное
-                ws.cell(row=row_num, column=5, value=row[3])  # Цена в рублях
-                ws.cell(row=row_num, column=6, value=f"=C{row_num}*E{row_num}")  # Сумма
-                ws.cell(row=row_num, column=7, value=sheet_name)  # Поставщик
-                ws.cell(row=row_num, column=8, value=row[4])  # Сроки
-                ws.cell(row=row_num, column=9, value=payment_terms.get(sheet_name, ""))
-                ws.cell(row=row_num, column=10, value=row[5])  # Комментарий
-                
-                row_num += 1
-        
-        # Форматирование ширины колонок
-        ws.column_dimensions['A'].width = 50
-        ws.column_dimensions['B'].width = 7  # Зафиксирована ширина 7
-        ws.column_dimensions['C'].width = 7  # Зафиксирована ширина 7
-        ws.column_dimensions['E'].width = 25
-        ws.column_dimensions['F'].width = 25
-        ws.column_dimensions['G'].width = 25
-        ws.column_dimensions['H'].width = 20
-        ws.column_dimensions['I'].width = 30
-        ws.column_dimensions['J'].width = 40
-        
-        # Применяем валютный формат к колонкам E и F (цена и сумма в рублях)
-        currency_format = '#,##0.00 ₽'
-        for row in range(2, row_num):
-            ws.cell(row=row, column=5).number_format = currency_format  # Колонка E
-            ws.cell(row=row, column=6).number_format = currency_format  # Колонка F
-        
-        # Применяем тонкие границы ко всем заполненным ячейкам
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
+    Цена в валюте поставщика и цена в рублях (обе без НДС) заполняются по normalize_price.
         
-        for row in range(1, row_num):
-            for col in range(1, 11):  # Колонки A-J (1-10)
-                ws.cell(row=row, column=col).border = thin_border
+    Returns:
+        openpyxl.Workbook: Книга в режиме write_only (сохраняется один раз)
         
-        return summary_wb
+    Raises:
+        SummaryRowError: Строку поставщика не удалось записать (с именем листа и номером строки)
+    """
+    summary_wb = openpyxl.Workbook(write_only=True)
+    ws = summary_wb.create_sheet("Свод")
+    
+    # Форматирование ширины колонок (в режиме write_only задается до записи строк)
+    ws.column_dimensions['A'].width = 50
+    ws.column_dimensions['B'].width = 7  # Зафиксирована ширина 7
+    ws.column_dimensions['C'].width = 7  # Зафиксирована ширина 7
+    ws.column_dimensions['D'].width = 25
+    ws.column_dimensions['E'].width = 25
+    ws.column_dimensions['F'].width = 25
+    ws.column_dimensions['G'].width = 25
+    ws.column_dimensions['H'].width = 20
+    ws.column_dimensions['I'].width = 30
+    ws.column_dimensions['J'].width = 40
+    
+    # Общие объекты стилей: создаются один раз на весь лист
+    light_blue_fill = PatternFill(start_color='ADD8E6', end_color='ADD8E6', fill_type='solid')
+    bold_font = Font(bold=True)
+    currency_format = '#,##0.00 ₽'
+    thin_border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    
+    # Присваивание стиля ячейке ищет его в таблице стилей книги (с хэшированием объекта),
+    # поэтому каждый стиль задается один раз на ячейке-образце, а ячейкам строк
+    # копируется готовый набор индексов стиля
+    plain_template = WriteOnlyCell(ws)
+    plain_template.border = thin_border
+    currency_template = WriteOnlyCell(ws)
+    currency_template.border = thin_border
+    currency_template.number_format = currency_format
+    header_template = WriteOnlyCell(ws)
+    header_template.border = thin_border
+    header_template.fill = light_blue_fill
+    header_template.font = bold_font
+    
+    def styled_cell(value, template=plain_template):
+        cell = WriteOnlyCell(ws, value=value)
+        cell._style = copy(template._style)
+        return cell
+    
+    # Образцы ячеек цены в валюте - по одному на валюту, с ее числовым форматом
+    fx_rates = get_fx_rates()
+    currency_templates = {fx_rates['base_currency']: currency_template}
+    
+    def currency_template_for(currency):
+        template = currency_templates.get(currency)
+        if template is None:
+            template = currency_templates[currency] = WriteOnlyCell(ws)
+            template.border = thin_border
+            template.number_format = fx_rates['number_formats'][currency]
+        return template
+    
+    # Заголовки: светло-голубая заливка и жирный шрифт
+    ws.append([styled_cell(header, header_template) for header in SINGLE_PRODUCT_HEADERS])
+    
+    # Получаем условия оплаты, валюту и НДС цен поставщиков
+    payment_terms = extract_payment_terms(wb, sheet_names)
+    supplier_pricing = detect_supplier_pricing(wb, sheet_names, fx_rates)
+    
+    # Собираем данные по поставщикам
+    row_num = 2
+    for sheet_name in sheet_names:
+        check_build_budget()
+        pricing = supplier_pricing[sheet_name]
+        supplier_rows = [(row_idx, name_value, values, normalize_price(values[2], pricing, fx_rates))
+                         for row_idx, name_value, _, values in iter_supplier_rows(wb, sheet_name)
+                         if name_value]  # Пропускаем пустые строки
+        if sort_by_price:
+            supplier_rows.sort(key=_price_sort_key)
         
-    except Exception as e:
-        print(f"Ошибка при создании свода для одного товара: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
+        supplier_terms = payment_terms.get(sheet_name, "")
+        for row_idx, name_value, values, normalized in supplier_rows:
+            requested_qty, offered_qty, price, delivery, comment = values
+            if normalized is not None:
+                currency_price, currency, price = normalized
+                currency_price_cell = styled_cell(currency_price, currency_template_for(currency))
+            else:
+                currency_price_cell = styled_cell(None)
+            try:
+                ws.append([
+                    styled_cell(name_value),                                 # Наименование
+                    styled_cell(requested_qty),                              # Кол-во запрошенное
+                    styled_cell(offered_qty),                                # Кол-во предложенное
+                    currency_price_cell,                                     # Цена в валюте
+                    styled_cell(price, currency_template),                   # Цена в рублях
+                    styled_cell(f"=C{row_num}*E{row_num}", currency_template), # Сумма
+                    styled_cell(sheet_name),                                 # Поставщик
+                    styled_cell(delivery),                                   # Сроки
+                    styled_cell(supplier_terms),                             # Условия оплаты
+                    styled_cell(comment)                                     # Комментарий
+                ])
+            except Exception as e:
+                raise SummaryRowError(sheet_name, row_idx, e) from e
+            row_num += 1
+    
+    print(f"✓ Свод для одного товара: {row_num - 2} предложений")
+    return summary_wb
 
 
 # Flask веб-приложение
@@ -1706,11 +3900,109 @@ app = Flask(__name__)
 app.secret_key = 'your-secret-key-change-this'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
-ALLOWED_EXTENSIONS = {'xlsx', 'xls'}
+# .xls (старый двоичный формат) openpyxl не читает, поэтому принимаем только .xlsx
+ALLOWED_EXTENSIONS = {'xlsx'}
+
+# Потоковая загрузка (/upload/stream): тело запроса пишется на диск порциями,
+# поэтому ее размер ограничивается отдельно от MAX_CONTENT_LENGTH формы
+STREAM_UPLOAD_CHUNK_SIZE = 1024 * 1024
+STREAM_UPLOAD_MAX_SIZE = int(os.environ.get('STREAM_UPLOAD_MAX_MB', '512')) * 1024 * 1024
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+class UploadRejectedError(ValueError):
+    """Загрузка отклонена при проверке; status_code - HTTP-код ответа."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def spool_upload_stream(stream, destination_path, max_size=STREAM_UPLOAD_MAX_SIZE, chunk_size=STREAM_UPLOAD_CHUNK_SIZE):
+    """
+    Записывает тело запроса на диск порциями. Сигнатура zip проверяется по первым байтам,
+    размер - по мере записи, так что неподходящий файл отклоняется, не дочитываясь до конца.
+    
+    Args:
+        stream: Входной поток запроса
+        destination_path: Путь к временному файлу
+        max_size: Максимальный размер загрузки в байтах
+        chunk_size: Размер порции чтения
+        
+    Returns:
+        int: Количество записанных байт
+        
+    Raises:
+        UploadRejectedError: Файл не является xlsx или превышает допустимый размер
+    """
+    signature_length = len(xlsx_stream_reader.ZIP_SIGNATURE)
+    head = b''
+    written = 0
+    with open(destination_path, 'wb') as destination:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            if len(head) < signature_length:
+                head += chunk[:signature_length - len(head)]
+                if len(head) == signature_length and not xlsx_stream_reader.has_zip_signature(head):
+                    raise UploadRejectedError('Файл не является xlsx (нет сигнатуры zip)')
+            written += len(chunk)
+            if written > max_size:
+                raise UploadRejectedError(f'Файл больше допустимого размера ({max_size // (1024 * 1024)} МБ)', 413)
+            destination.write(chunk)
+    if not xlsx_stream_reader.has_zip_signature(head):
+        raise UploadRejectedError('Файл пустой или не является xlsx')
+    return written
+
+def _create_temp_path(suffix):
+    """Создает пустой временный файл и возвращает путь к нему."""
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    temp_file.close()
+    return temp_file.name
+
+def _remove_files(*paths):
+    """Удаляет временные файлы, если они существуют."""
+    for path in paths:
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+def _request_profile_path(original_filename, params=None):
+    """
+    Путь профиля для текущего запроса, если администратор включил профилирование
+    (параметр profile и токен в заголовке X-Admin-Token или параметре admin_token)
+    или задана SUMMARY_PROFILE. Результат запроса не хранится, поэтому профиль
+    пишется в summary_profiling.PROFILE_DIR.
+    
+    params - откуда читать параметры (по умолчанию request.values). Для потоковой
+    загрузки передается request.args: тело запроса - сам файл, и разбирать его как форму нельзя.
+    """
+    params = request.values if params is None else params
+    flag = params.get('profile')
+    token = request.headers.get('X-Admin-Token') or params.get('admin_token')
+    profile_format = summary_profiling.requested_profile_format(flag, token)
+    if not profile_format:
+        return None
+    return summary_profiling.default_profile_path(secure_filename(original_filename) or 'upload.xlsx',
+                                                  profile_format)
+
+def _send_summary_file(temp_input_path, temp_output_path, original_filename, output_format, profile_path=None):
+    """Отправляет построенный свод и удаляет временные файлы после отправки."""
+    # Генерируем имя для скачиваемого файла
+    base_name = os.path.splitext(secure_filename(original_filename))[0]
+    output_filename = f"{base_name}_свод.{output_format}"
+    
+    response = send_file(
+        temp_output_path,
+        as_attachment=True,
+        download_name=output_filename,
+        mimetype=summary_writers.FORMAT_MIMETYPES[output_format]
+    )
+    response.call_on_close(lambda: _remove_files(temp_input_path, temp_output_path))
+    if profile_path and os.path.exists(profile_path):
+        response.headers['X-Summary-Profile'] = os.path.basename(profile_path)
+    return response
+
 # HTML шаблон для веб-интерфейса
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -1838,7 +4130,15 @@ HTML_TEMPLATE = '''
         <form method="post" enctype="multipart/form-data">
             <div class="upload-area">
                 <h3>📁 Выберите Excel файл</h3>
-                <input type="file" name="file" accept=".xlsx,.xls" required>
+                <input type="file" name="file" accept=".xlsx" required>
+                <br>
+                <label for="format">Формат результата:</label>
+                <select name="format" id="format">
+                    <option value="xlsx" selected>Excel (.xlsx) с оформлением</option>
+                    <option value="csv">CSV (только данные)</option>
+                    <option value="jsonl">JSON Lines (только данные)</option>
+                    <option value="parquet">Parquet (только данные)</option>
+                </select>
                 <br>
                 <button type="submit">🚀 Создать сводную таблицу</button>
             </div>
@@ -1877,6 +4177,10 @@ def upload_file():
             return redirect(request.url)
         
         file = request.files['file']
+        output_format = request.form.get('format', 'xlsx')
+        if output_format not in summary_writers.FORMAT_MIMETYPES:
+            flash(f'Неподдерживаемый формат результата: {output_format}', 'error')
+            return redirect(request.url)
         
         # Проверяем, что файл выбран
         if file.filename == '':
@@ -1885,7 +4189,7 @@ def upload_file():
         
         # Проверяем расширение файла
         if not allowed_file(file.filename):
-            flash('Неподдерживаемый формат файла. Используйте .xlsx или .xls', 'error')
+            flash('Неподдерживаемый формат файла. Используйте .xlsx', 'error')
             return redirect(request.url)
         
         temp_input_path = None
@@ -1893,62 +4197,149 @@ def upload_file():
         
         try:
             # Создаем временный файл для загруженного файла
-            temp_input = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-            temp_input_path = temp_input.name
-            temp_input.close()
+            temp_input_path = _create_temp_path('.xlsx')
             file.save(temp_input_path)
             
-            # Обрабатываем файл с помощью существующей функции
-            summary_wb = build_summary_table(temp_input_path)
-            if not summary_wb:
-                flash('Ошибка при обработке файла', 'error')
-                return redirect(request.url)
+            # Проверяем структуру выгрузки до построения свода
+            xlsx_stream_reader.validate_xlsx_structure(temp_input_path)
             
             # Создаем временный файл для результата
-            temp_output = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-            temp_output_path = temp_output.name
-            temp_output.close()
-            
-            # Сохраняем результат
-            summary_wb.save(temp_output_path)
+            temp_output_path = _create_temp_path(f'.{output_format}')
             
-            # Генерируем имя для скачиваемого файла
-            original_name = secure_filename(file.filename)
-            base_name = os.path.splitext(original_name)[0]
-            output_filename = f"{base_name}_свод.xlsx"
+            # Обрабатываем файл: xlsx - с оформлением, остальные форматы - только данные
+            profile_path = _request_profile_path(file.filename)
+            export_summary_with_admission(temp_input_path, temp_output_path, output_format, profile_path=profile_path)
             
-            # Отправляем файл пользователю
-            response = send_file(
-                temp_output_path,
-                as_attachment=True,
-                download_name=output_filename,
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-            
-            # Удаляем временные файлы после отправки
-            def cleanup():
-                if temp_input_path and os.path.exists(temp_input_path):
-                    os.unlink(temp_input_path)
-                if temp_output_path and os.path.exists(temp_output_path):
-                    os.unlink(temp_output_path)
-            
-            response.call_on_close(cleanup)
-            return response
+            # Отправляем файл пользователю, временные файлы удаляются после отправки
+            return _send_summary_file(temp_input_path, temp_output_path, file.filename, output_format, profile_path)
             
         except Exception as e:
             # Очищаем временные файлы в случае ошибки
-            if temp_input_path and os.path.exists(temp_input_path):
-                os.unlink(temp_input_path)
-            if temp_output_path and os.path.exists(temp_output_path):
-                os.unlink(temp_output_path)
-                
-            flash(f'Ошибка при обработке файла: {str(e)}', 'error')
+            _remove_files(temp_input_path, temp_output_path)
+            
+            if isinstance(e, xlsx_stream_reader.XlsxShapeError):
+                flash(f'Файл не похож на выгрузку ЯЗакупок: {str(e)}', 'error')
+            elif isinstance(e, AdmissionError):
+                flash(str(e), 'error')
+            else:
+                flash(f'Ошибка при обработке файла: {str(e)}', 'error')
             return redirect(request.url)
     
     return render_template_string(HTML_TEMPLATE)
 
+@app.route('/upload/stream', methods=['POST', 'PUT'])
+def upload_stream():
+    """
+    Потоковая загрузка выгрузки: тело запроса - сам файл .xlsx (без multipart).
+    Параметры запроса: filename - имя исходного файла, format - формат результата.
+    
+    Файл пишется на диск порциями и проверяется по мере поступления (сигнатура zip, размер),
+    затем по центральному каталогу проверяется состав листов. Построение свода начинается
+    сразу после окончания загрузки.
+    """
+    filename = request.args.get('filename', 'upload.xlsx')
+    output_format = request.args.get('format', 'xlsx')
+    if output_format not in summary_writers.FORMAT_MIMETYPES:
+        return jsonify(error=f'Неподдерживаемый формат результата: {output_format}'), 400
+    if not allowed_file(filename):
+        return jsonify(error='Неподдерживаемый формат файла. Используйте .xlsx'), 400
+    if request.content_length is not None and request.content_length > STREAM_UPLOAD_MAX_SIZE:
+        return jsonify(error=f'Файл больше допустимого размера ({STREAM_UPLOAD_MAX_SIZE // (1024 * 1024)} МБ)'), 413
+    
+    temp_input_path = _create_temp_path('.xlsx')
+    temp_output_path = None
+    try:
+        stream = get_input_stream(request.environ, max_content_length=STREAM_UPLOAD_MAX_SIZE)
+        spool_upload_stream(stream, temp_input_path)
+        xlsx_stream_reader.validate_xlsx_structure(temp_input_path)
+    except UploadRejectedError as e:
+        _remove_files(temp_input_path)
+        return jsonify(error=str(e)), e.status_code
+    except RequestEntityTooLarge:
+        _remove_files(temp_input_path)
+        return jsonify(error=f'Файл больше допустимого размера ({STREAM_UPLOAD_MAX_SIZE // (1024 * 1024)} МБ)'), 413
+    except xlsx_stream_reader.XlsxShapeError as e:
+        _remove_files(temp_input_path)
+        return jsonify(error=f'Файл не похож на выгрузку ЯЗакупок: {str(e)}'), 422
+    
+    try:
+        temp_output_path = _create_temp_path(f'.{output_format}')
+        profile_path = _request_profile_path(filename, request.args)
+        export_summary_with_admission(temp_input_path, temp_output_path, output_format, profile_path=profile_path)
+        return _send_summary_file(temp_input_path, temp_output_path, filename, output_format, profile_path)
+    except AdmissionError as e:
+        _remove_files(temp_input_path, temp_output_path)
+        return jsonify(error=str(e)), e.status_code
+    except Exception as e:
+        _remove_files(temp_input_path, temp_output_path)
+        return jsonify(error=f'Ошибка при обработке файла: {str(e)}'), 500
+
+@app.route('/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """
+    Профиль сборки или его тайминги (имя - из заголовка X-Summary-Profile ответа).
+    Доступно только с токеном администратора (X-Admin-Token или параметр admin_token).
+    """
+    token = request.headers.get('X-Admin-Token') or request.args.get('admin_token')
+    if not summary_profiling.is_admin_token(token):
+        return jsonify(error='Требуется токен администратора'), 403
+    profile_path = os.path.join(summary_profiling.PROFILE_DIR, secure_filename(name))
+    if not os.path.isfile(profile_path):
+        return jsonify(error='Профиль не найден'), 404
+    return send_file(profile_path, as_attachment=True, download_name=os.path.basename(profile_path))
+
+def main(argv=None):
+    """
+    Точка входа: без аргументов запускает веб-приложение,
+    с путем к выгрузке - строит свод из командной строки.
+    
+    Args:
+        argv: Аргументы командной строки (по умолчанию sys.argv[1:])
+    """
+    import argparse
+    import multiprocessing
+    import sys
+    
+    # Процессы пула в сборке PyInstaller запускаются тем же исполняемым файлом
+    multiprocessing.freeze_support()
+    
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("Запуск веб-приложения Сравниватель КП...")
+        print("Откройте в браузере: http://localhost:5000")
+        print("Для остановки нажмите Ctrl+C")
+        # Пул прогревается в процессе сервера (с debug=True - в дочернем процессе перезагрузчика)
+        pool = summary_workers.get_worker_pool()
+        if pool is not None and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            pool.start()
+        app.run(debug=True, host='0.0.0.0', port=5000)
+        return
+    
+    parser = argparse.ArgumentParser(description='Свод КП из выгрузки ЯЗакупок')
+    parser.add_argument('input', nargs='+',
+                        help='Выгрузка ЯЗакупок (.xlsx); несколько выгрузок объединяются в один свод')
+    parser.add_argument('-o', '--output', help='Файл результата (по умолчанию <имя>_свод.<формат>)')
+    parser.add_argument('-f', '--format', default='xlsx', choices=sorted(summary_writers.FORMAT_MIMETYPES),
+                        help='Формат результата (xlsx - с оформлением, остальные - только данные)')
+    parser.add_argument('--rules', help='Файл правил сопоставления')
+    parser.add_argument('--assignment-mode', default='greedy', choices=['greedy', 'global'],
+                        help='Режим назначения аналогов основным товарам')
+    parser.add_argument('--reader', choices=SOURCE_READERS,
+                        help='Способ чтения выгрузки (по умолчанию auto: потоковый XML с откатом на openpyxl)')
+    parser.add_argument('--layout', choices=SUMMARY_LAYOUTS,
+                        help=f'Раскладка xlsx-свода (по умолчанию auto: wide до {WIDE_LAYOUT_MAX_SUPPLIERS} поставщиков, '
+                             f'дальше topk и long)')
+    parser.add_argument('--profile', nargs='?', const=summary_profiling.DEFAULT_PROFILE_FORMAT,
+                        choices=sorted(summary_profiling.PROFILE_FORMATS),
+                        help='Профилировать сборку; профиль и тайминги этапов сохраняются рядом с результатом')
+    args = parser.parse_args(argv)
+    
+    output_path = args.output or f"{os.path.splitext(args.input[0])[0]}_свод.{args.format}"
+    source = args.input if len(args.input) > 1 else args.input[0]
+    profile_path = summary_profiling.profile_path_for(output_path, args.profile) if args.profile else None
+    export_summary(source, output_path, args.format, rules_path=args.rules, assignment_mode=args.assignment_mode,
+                   reader=args.reader, layout=args.layout, profile_path=profile_path)
+    print(f"Свод сохранен: {output_path}")
+
 if __name__ == "__main__":
-    print("Запуск веб-приложения Сравниватель КП...")
-    print("Откройте в браузере: http://localhost:5000")
-    print("Для остановки нажмите Ctrl+C")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    main()
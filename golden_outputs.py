@@ -0,0 +1,451 @@
+# golden_outputs.py
+"""
+Регрессионная проверка оптимизированных путей сборки свода по эталонным результатам.
+
+Запуск:
+    python golden_outputs.py                    # сравнить с эталонами и эталонным путем
+    python golden_outputs.py --update           # перезаписать эталоны
+    python golden_outputs.py --corpus выгрузки/ --case tender_small --report отчет.json
+
+Корпус - синтетические выгрузки (генерируются детерминированно) и обезличенные выгрузки
+из каталога --corpus. Для каждой выгрузки:
+    1. Эталонный путь (чтение через openpyxl, холодные кэши, строки свода списком) сравнивается
+       с сохраненным эталоном в каталоге golden/ - так видно изменение самого результата.
+    2. Каждый оптимизированный путь из VARIANTS (потоковое чтение, пул процессов,
+       прогретые кэши, потоковая выдача строк) сравнивается с эталонным путем.
+
+Сравнивается каноническое представление: значения ячеек, объединения, границы, заливки,
+шрифты, выравнивание, числовые форматы, ширины колонок и закрепление областей.
+Отчет содержит расхождения и отношение времени эталонного пути к оптимизированному.
+"""
+import contextlib
+import gzip
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import openpyxl
+from openpyxl.styles import PatternFill
+
+import benchmarks
+import excel_summary_script as ess
+import summary_writers
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+# Сколько расхождений показывать в отчете для одного сравнения
+MAX_REPORTED_DIFFS = 10
+
+# Основные товары синтетических выгрузок: (название, количество) и их аналоги
+CORPUS_MAIN_PRODUCTS = [
+    ('Монитор Dell P2422HE 24"', 10), ('Кабель USB Type-C 2м', 50), ('SSD накопитель Samsung 1TB', 20),
+    ('Телевизор LG OLED 55"', 2), ('Зарядное устройство 65W USB-C', 30), ('Наушники Sony WH-1000XM5', 5),
+    ('Клавиатура Logitech K120', 40), ('Мышь Logitech M90', 40)
+]
+CORPUS_ANALOGS = {
+    0: ['Монитор Acer B247Y 24"', 'Монитор P2422 HE Dell'],
+    1: ['Кабель USB-C Ugreen 2м', 'Шнур Type-C Baseus'],
+    2: ['Твердотельный накопитель Kingston 1TB', 'SSD Crucial MX500 1TB'],
+    4: ['Адаптер питания 65W Type-C'],
+    5: ['Гарнитура JBL Tune 760'],
+    6: ['Клавиатура Defender Element']
+}
+
+# Корпус синтетических выгрузок: {имя: (генератор, параметры, параметры сборки)}
+SYNTHETIC_CORPUS = {
+    'tender_small': ('tender', {'suppliers': 4, 'seed': 1}, {}),
+    'tender_global': ('tender', {'suppliers': 6, 'seed': 2}, {'assignment_mode': 'global'}),
+    'single_product': ('tender', {'suppliers': 6, 'seed': 3, 'single_product': True}, {}),
+    'many_suppliers': ('tender', {'suppliers': 40, 'seed': 4}, {}),
+    'generated_names': ('names', {'suppliers': 12, 'rows': 200, 'seed': 11}, {}),
+    'merged_exports': ('merge', {'seed': 5}, {})
+}
+
+# Поставщики выгрузок для объединения: в первой - листы, имя одного из которых содержится в имени другого
+# (в одной выгрузке это разные поставщики), во второй - тот же поставщик с формой собственности
+CORPUS_MERGE_SUPPLIERS = [
+    ['Альфа', 'Альфа Плюс', 'Гамма'],
+    ['Бета', 'ООО "Альфа"', 'Гамма']
+]
+
+# Эталонный путь сборки для каждого вида результата
+REFERENCE_PATHS = {
+    'xlsx': {'reader': 'openpyxl'},
+    'records': {'reader': 'openpyxl', 'stream_rows': False}
+}
+
+# Оптимизированные пути: вид результата, параметры сборки и особенности запуска
+VARIANTS = {
+    'stream_reader': {'artifact': 'xlsx', 'options': {'reader': 'stream'}},
+    'process_pool_merge': {'artifact': 'xlsx', 'options': {'reader': 'stream'}, 'merge': True},
+    'warm_caches': {'artifact': 'xlsx', 'options': {'reader': 'stream'}, 'warm': True},
+    'streamed_rows': {'artifact': 'records', 'options': {'reader': 'stream', 'stream_rows': True}}
+}
+
+
+def generate_corpus_export(path, suppliers=4, seed=1, single_product=False, supplier_names=None):
+    """
+    Создает синтетическую выгрузку ЯЗакупок со всеми видами строк: основные товары,
+    аналоги с отступом и с желтой заливкой, варианты основных товаров, аналог без основного
+    товара на листе и условия оплаты на информационном листе.
+
+    Args:
+        path: Путь к создаваемому файлу
+        suppliers: Количество листов поставщиков
+        seed: Зерно генератора случайных чисел
+        single_product: Один основной товар (упрощенный формат свода)
+        supplier_names: Имена поставщиков (по умолчанию 'ООО "Поставщик N"' по числу suppliers)
+    """
+    rnd = random.Random(seed)
+    yellow_fill = PatternFill(start_color='FFFFFF00', end_color='FFFFFF00', fill_type='solid')
+    supplier_names = supplier_names or [f'ООО "Поставщик {number}"' for number in range(1, suppliers + 1)]
+    main_products = CORPUS_MAIN_PRODUCTS[:1] if single_product else CORPUS_MAIN_PRODUCTS
+
+    wb = openpyxl.Workbook()
+    info = wb.active
+    info.title = 'Общая информация'
+    info.cell(row=1, column=1, value='Параметр')
+    info.cell(row=5, column=1, value='Условия оплаты')
+    for index, supplier_name in enumerate(supplier_names):
+        col = 2 + index * 3
+        info.cell(row=1, column=col, value=supplier_name)
+        info.merge_cells(start_row=1, start_column=col, end_row=1, end_column=col + 2)
+        info.cell(row=5, column=col, value=f"Постоплата {rnd.choice([10, 30, 45])} дней")
+        info.merge_cells(start_row=5, start_column=col, end_row=5, end_column=col + 2)
+
+    for index, supplier_name in enumerate(supplier_names):
+        ws = wb.create_sheet(supplier_name.replace('"', '')[:31])
+        ws.append(['Наименование', 'Количество', 'Предложено', 'Цена', 'Срок', 'Комментарий'])
+        if index == 0 and not single_product:
+            ws.append(['      Телевизор Samsung QLED 55', 2, 2, 80000, '10 дней', 'без основного товара'])
+        for product_index, (product_name, qty) in enumerate(main_products):
+            if rnd.random() < 0.8:
+                ws.append([product_name, qty, qty, round(rnd.uniform(500, 90000), 2), f"{rnd.randint(1, 30)} дней",
+                           rnd.choice(['', 'в наличии', 'под заказ'])])
+            else:
+                ws.append([product_name, qty, None, None, None, None])
+            for analog_name in CORPUS_ANALOGS.get(product_index, []):
+                if rnd.random() >= 0.5:
+                    continue
+                price = round(rnd.uniform(500, 90000), 2)
+                if rnd.random() < 0.5:
+                    ws.append(['      ' + analog_name, qty, qty, price, '5 дней', 'аналог'])
+                else:
+                    ws.append([analog_name, qty, qty, price, '5 дней', 'аналог'])
+                    ws.cell(row=ws.max_row, column=1).fill = yellow_fill
+            if rnd.random() < 0.2:
+                ws.append(['      ' + product_name, qty, qty, round(rnd.uniform(500, 90000), 2), '7 дней', 'вариант'])
+    wb.save(path)
+
+
+def generate_merge_corpus(path, seed=1):
+    """
+    Создает выгрузки одного тендера для режима объединения (см. CORPUS_MERGE_SUPPLIERS).
+
+    Args:
+        path: Путь, от которого образуются имена выгрузок (_1.xlsx, _2.xlsx, ...)
+        seed: Зерно генератора случайных чисел
+
+    Returns:
+        list: Пути к выгрузкам
+    """
+    base_path = os.path.splitext(path)[0]
+    paths = []
+    for index, supplier_names in enumerate(CORPUS_MERGE_SUPPLIERS, start=1):
+        export_path = f"{base_path}_{index}.xlsx"
+        generate_corpus_export(export_path, seed=seed * 100 + index, supplier_names=supplier_names)
+        paths.append(export_path)
+    return paths
+
+
+# Генераторы корпуса; генератор может вернуть список выгрузок - тогда они собираются в режиме объединения
+CORPUS_GENERATORS = {
+    'tender': generate_corpus_export,
+    'names': benchmarks.generate_tender_export,
+    'merge': generate_merge_corpus
+}
+
+
+def clear_caches():
+    """Сбрасывает кэши модуля сборки (lru_cache), чтобы эталонный путь шел с холодными кэшами."""
+    for value in list(vars(ess).values()):
+        # Проверяем тип, а не объект: прокси Flask (request) нельзя трогать вне запроса
+        if hasattr(type(value), 'cache_clear'):
+            value.cache_clear()
+
+
+def _canonical_color(color):
+    if color is None:
+        return None
+    return str(color.rgb) if color.type == 'rgb' else f"{color.type}:{getattr(color, color.type)}"
+
+
+def _canonical_value(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def canonicalize_workbook(path):
+    """
+    Каноническое представление книги для сравнения результатов разных путей сборки.
+    Пустые ячейки без оформления пропускаются.
+
+    Args:
+        path: Путь к сохраненной книге
+
+    Returns:
+        dict: {лист: {'cells': {адрес: [значение, формат, шрифт, заливка, границы, выравнивание]},
+               'merged': [...], 'widths': {...}, 'freeze_panes': ...}}
+    """
+    wb = openpyxl.load_workbook(path)
+    canonical = {}
+    for ws in wb.worksheets:
+        cells = {}
+        for row in ws.iter_rows():
+            for cell in row:
+                if cell.value is None and not cell.has_style:
+                    continue
+                font, fill, border, alignment = cell.font, cell.fill, cell.border, cell.alignment
+                cells[cell.coordinate] = [
+                    _canonical_value(cell.value),
+                    cell.number_format,
+                    [bool(font.b), bool(font.i), font.sz, _canonical_color(font.color)],
+                    [fill.fill_type, _canonical_color(fill.start_color) if fill.fill_type else None],
+                    [getattr(border, side).style for side in ('left', 'right', 'top', 'bottom')],
+                    [alignment.horizontal, alignment.vertical, bool(alignment.wrap_text)]
+                ]
+        canonical[ws.title] = {
+            'cells': cells,
+            'merged': sorted(str(cell_range) for cell_range in ws.merged_cells.ranges),
+            'widths': {letter: dimension.width for letter, dimension in sorted(ws.column_dimensions.items())
+                       if dimension.customWidth},
+            'freeze_panes': ws.freeze_panes
+        }
+    return canonical
+
+
+def canonicalize_records(summary_data):
+    """Плоские записи свода (см. summary_writers.iter_summary_records) в виде списков значений."""
+    return [[_canonical_value(record[field]) for field in summary_writers.SUMMARY_RECORD_FIELDS]
+            for record in summary_writers.iter_summary_records(summary_data)]
+
+
+def diff_canonical(expected, actual, max_diffs=MAX_REPORTED_DIFFS):
+    """
+    Сравнивает два канонических представления.
+
+    Args:
+        expected: Эталон (canonicalize_workbook или canonicalize_records)
+        actual: Проверяемый результат
+        max_diffs: Сколько расхождений включить в отчет
+
+    Returns:
+        dict: {'count': число расхождений, 'examples': [(где, эталон, результат), ...]}
+    """
+    differences = []
+    if isinstance(expected, list):
+        for index in range(max(len(expected), len(actual))):
+            left = expected[index] if index < len(expected) else None
+            right = actual[index] if index < len(actual) else None
+            if left != right:
+                differences.append((f"запись {index + 1}", left, right))
+    else:
+        for sheet_name in sorted(expected.keys() | actual.keys(), key=str):
+            left_sheet = expected.get(sheet_name)
+            right_sheet = actual.get(sheet_name)
+            if left_sheet is None or right_sheet is None:
+                differences.append((f"лист {sheet_name}", left_sheet is not None, right_sheet is not None))
+                continue
+            for key in ('merged', 'widths', 'freeze_panes'):
+                if left_sheet[key] != right_sheet[key]:
+                    differences.append((f"{sheet_name}: {key}", left_sheet[key], right_sheet[key]))
+            left_cells, right_cells = left_sheet['cells'], right_sheet['cells']
+            for coordinate in left_cells.keys() | right_cells.keys():
+                if left_cells.get(coordinate) != right_cells.get(coordinate):
+                    differences.append((f"{sheet_name}!{coordinate}", left_cells.get(coordinate),
+                                        right_cells.get(coordinate)))
+    return {'count': len(differences), 'examples': differences[:max_diffs]}
+
+
+def run_build(source_path, artifact, options, build_options, merge=False, warm=False):
+    """
+    Собирает свод одним путем и возвращает каноническое представление и время сборки.
+    Вывод сборки в консоль подавляется.
+
+    Args:
+        source_path: Путь к выгрузке или список выгрузок для объединения
+        artifact: 'xlsx' (build_summary_table) или 'records' (build_summary_data)
+        options: Параметры пути (reader, stream_rows)
+        build_options: Параметры сборки из корпуса (assignment_mode)
+        merge: Читать выгрузку через объединение в пуле процессов (список из одного пути;
+            список выгрузок объединяется всегда)
+        warm: Не сбрасывать кэши перед сборкой (прогрев - предыдущей сборкой того же файла)
+
+    Returns:
+        tuple: (каноническое представление, секунды)
+    """
+    if not warm:
+        clear_caches()
+    source = [source_path] if merge and not isinstance(source_path, list) else source_path
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        if artifact == 'records':
+            summary_data = ess.build_summary_data(source, **build_options, **options)
+            canonical = canonicalize_records(summary_data)
+            elapsed = time.perf_counter() - started
+            return canonical, elapsed
+
+        handle, output_path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(handle)
+        try:
+            ess.build_summary_table(source, **build_options, **options).save(output_path)
+            elapsed = time.perf_counter() - started
+            canonical = canonicalize_workbook(output_path)
+        finally:
+            os.remove(output_path)
+    return canonical, elapsed
+
+
+def _golden_path(golden_dir, case_name, artifact):
+    return os.path.join(golden_dir, f"{case_name}.{artifact}.json.gz")
+
+
+def _load_golden(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as golden_file:
+        return json.load(golden_file)
+
+
+def _save_golden(path, canonical):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # mtime=0 - одинаковый результат дает побайтно одинаковый эталон
+    with open(path, 'wb') as raw_file, gzip.GzipFile(fileobj=raw_file, mode='wb', mtime=0) as golden_file:
+        golden_file.write(json.dumps(canonical, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+
+
+def _normalize(canonical):
+    """Приводит представление к виду после чтения из JSON (кортежи - списки, ключи - строки)."""
+    return json.loads(json.dumps(canonical, ensure_ascii=False))
+
+
+def check_case(case_name, source_path, build_options, golden_dir=GOLDEN_DIR, update=False, variants=None):
+    """
+    Проверяет одну выгрузку корпуса: эталонный путь против эталона, оптимизированные пути
+    против эталонного пути.
+
+    Args:
+        case_name: Имя выгрузки в корпусе
+        source_path: Путь к выгрузке или список выгрузок для объединения
+        build_options: Параметры сборки (assignment_mode)
+        golden_dir: Каталог эталонов
+        update: Перезаписать эталоны результатом эталонного пути
+        variants: Имена проверяемых путей из VARIANTS (по умолчанию все)
+
+    Returns:
+        list: Результаты сравнений {'case', 'path', 'artifact', 'diffs', 'seconds', 'speedup'}
+    """
+    results = []
+    references = {}
+    for artifact, options in REFERENCE_PATHS.items():
+        canonical, seconds = run_build(source_path, artifact, options, build_options)
+        canonical = _normalize(canonical)
+        references[artifact] = (canonical, seconds)
+
+        golden_path = _golden_path(golden_dir, case_name, artifact)
+        if update or not os.path.exists(golden_path):
+            _save_golden(golden_path, canonical)
+            diffs = {'count': 0, 'examples': [], 'golden_written': True}
+        else:
+            diffs = diff_canonical(_load_golden(golden_path), canonical)
+        results.append({'case': case_name, 'path': 'reference', 'artifact': artifact, 'diffs': diffs,
+                        'seconds': seconds, 'speedup': 1.0})
+
+    for variant_name in variants or VARIANTS:
+        variant = VARIANTS[variant_name]
+        artifact = variant['artifact']
+        reference, reference_seconds = references[artifact]
+        if variant.get('warm'):
+            run_build(source_path, artifact, variant['options'], build_options)
+        canonical, seconds = run_build(source_path, artifact, variant['options'], build_options,
+                                       merge=variant.get('merge', False), warm=variant.get('warm', False))
+        results.append({
+            'case': case_name,
+            'path': variant_name,
+            'artifact': artifact,
+            'diffs': diff_canonical(reference, _normalize(canonical)),
+            'seconds': seconds,
+            'speedup': reference_seconds / seconds if seconds else float('inf')
+        })
+    return results
+
+
+def iter_corpus(work_dir, corpus_dir=None, case_names=None):
+    """
+    Выгрузки корпуса: синтетические (создаются в work_dir) и обезличенные из corpus_dir.
+
+    Yields:
+        tuple: (имя, путь к выгрузке или список выгрузок для объединения, параметры сборки)
+    """
+    for case_name, (generator_name, params, build_options) in SYNTHETIC_CORPUS.items():
+        if case_names and case_name not in case_names:
+            continue
+        path = os.path.join(work_dir, f"{case_name}.xlsx")
+        yield case_name, CORPUS_GENERATORS[generator_name](path, **params) or path, build_options
+
+    if corpus_dir:
+        for filename in sorted(os.listdir(corpus_dir)):
+            case_name = os.path.splitext(filename)[0]
+            if not filename.endswith('.xlsx') or (case_names and case_name not in case_names):
+                continue
+            yield case_name, os.path.join(corpus_dir, filename), {}
+
+
+def print_report(results):
+    """Печатает таблицу результатов и примеры расхождений."""
+    print(f"{'выгрузка':<20} {'путь':<20} {'результат':<9} {'расхождений':>11} {'секунд':>8} {'ускорение':>9}")
+    for result in results:
+        print(f"{result['case']:<20} {result['path']:<20} {result['artifact']:<9} {result['diffs']['count']:>11} "
+              f"{result['seconds']:>8.3f} {result['speedup']:>8.2f}x")
+    for result in results:
+        for where, expected, actual in result['diffs']['examples']:
+            print(f"  {result['case']} / {result['path']}: {where}: эталон {expected!r}, результат {actual!r}")
+
+
+def main(argv=None):
+    """
+    Запуск проверки из командной строки. Код возврата 1, если есть расхождения.
+
+    Args:
+        argv: Аргументы командной строки (по умолчанию sys.argv[1:])
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Сравнение оптимизированных путей сборки свода с эталонами')
+    parser.add_argument('--update', action='store_true', help='Перезаписать эталоны результатом эталонного пути')
+    parser.add_argument('--corpus', help='Каталог обезличенных выгрузок (.xlsx), добавляемых к синтетическим')
+    parser.add_argument('--golden-dir', default=GOLDEN_DIR, help='Каталог эталонов')
+    parser.add_argument('--case', action='append', help='Проверить только эту выгрузку (можно несколько раз)')
+    parser.add_argument('--path', action='append', choices=sorted(VARIANTS),
+                        help='Проверить только этот оптимизированный путь (можно несколько раз)')
+    parser.add_argument('--report', help='Сохранить отчет в JSON')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='golden_') as work_dir:
+        for case_name, source_path, build_options in iter_corpus(work_dir, args.corpus, args.case):
+            results.extend(check_case(case_name, source_path, build_options, golden_dir=args.golden_dir,
+                                      update=args.update, variants=args.path))
+
+    print_report(results)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as report_file:
+            json.dump(results, report_file, ensure_ascii=False, indent=2, default=str)
+    return 1 if any(result['diffs']['count'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
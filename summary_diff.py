@@ -0,0 +1,334 @@
+# summary_diff.py
+"""
+Сравнение двух сводов одной закупки (до и после пересмотра предложений поставщиками).
+
+Запуск:
+    python summary_diff.py старая.xlsx новая.xlsx [-o изменения.xlsx] [--json отчет.json]
+
+На вход принимаются выгрузки ЯЗакупок (.xlsx) или своды в формате JSON (-f json).
+Строки сопоставляются по ключу (основной товар, тип строки, позиция), предложения -
+по ключу строки и поставщику. Сопоставление выполняется через словари (hash join),
+поэтому время сравнения линейно зависит от числа строк и поставщиков.
+"""
+import json
+import os
+
+import openpyxl
+from openpyxl.styles import Alignment, Font, PatternFill
+
+import excel_summary_script as ess
+import summary_writers
+
+# Виды изменений и их подписи на листе "Изменения"
+CHANGE_LABELS = {
+    'price_changed': 'Изменение цены',
+    'offer_added': 'Новое предложение',
+    'offer_withdrawn': 'Предложение отозвано',
+    'min_price_changed': 'Смена лидера по цене'
+}
+
+# Поля записи об изменении (в JSON-отчете и на листе)
+DIFF_FIELDS = [
+    'change',
+    'main_product',
+    'row_type',
+    'item_name',
+    'supplier',
+    'old_price',
+    'new_price',
+    'price_delta',
+    'price_delta_percent',
+    'old_min_suppliers',
+    'new_min_suppliers'
+]
+
+CHANGES_SHEET_HEADERS = [
+    'Изменение', 'Основной товар', 'Тип строки', 'Позиция', 'Поставщик',
+    'Было, цена', 'Стало, цена', 'Разница', 'Разница, %', 'Лидер по цене (было)', 'Лидер по цене (стало)'
+]
+
+
+def load_summary_for_diff(path, rules_path=None, reader=None):
+    """
+    Загружает модель свода для сравнения.
+
+    Args:
+        path: Выгрузка ЯЗакупок (.xlsx) или свод в формате JSON (.json)
+        rules_path: Путь к файлу правил сопоставления (для выгрузок)
+        reader: Способ чтения выгрузки (см. ess.load_source_workbook)
+
+    Returns:
+        dict: Данные свода в формате ess.build_summary_data
+    """
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as summary_file:
+            document = json.load(summary_file)
+        if 'summary_rows' not in document:
+            raise ValueError(f"{path}: файл не является сводом в формате JSON")
+        return document
+    return ess.build_summary_data(path, rules_path=rules_path, reader=reader)
+
+
+def _price_value(offer):
+    """Цена предложения как число (как в highlight_minimum_prices) или None, если цены нет."""
+    if not offer or len(offer) < 2 or offer[1] is None:
+        return None
+    try:
+        return float(offer[1])
+    except (ValueError, TypeError):
+        return None
+
+
+def index_summary_rows(summary_data):
+    """
+    Строит индекс строк свода: {ключ строки: описание с ценами поставщиков}.
+    Строки с одинаковым ключом (например, одинаковые варианты разных поставщиков) объединяются.
+
+    Args:
+        summary_data: Данные свода (ess.build_summary_data)
+
+    Returns:
+        dict: {(основной товар, тип строки, позиция): {'main_product', 'row_type', 'item_name',
+               'prices': {ключ поставщика: (имя поставщика, цена)}}}
+    """
+    index = {}
+    for row in summary_data['summary_rows']:
+        main_product = row.get('main_product') or row['name']
+        item_name = row.get('item_name') or row['name']
+        row_type = row.get('row_type') or 'main'
+        key = (ess.clean_text_for_comparison(main_product), row_type, ess.clean_text_for_comparison(item_name))
+
+        entry = index.get(key)
+        if entry is None:
+            entry = index[key] = {
+                'main_product': main_product,
+                'row_type': row_type,
+                'item_name': item_name,
+                'prices': {}
+            }
+        for supplier, offer in row['suppliers'].items():
+            price = _price_value(offer)
+            if price is None:
+                continue
+            supplier_key = ess.merge_supplier_key(supplier)
+            # При повторе поставщика в объединенных строках оставляем первое предложение
+            entry['prices'].setdefault(supplier_key, (supplier, price))
+    return index
+
+
+def min_price_suppliers(prices):
+    """
+    Поставщики с минимальной ценой в строке (все при равенстве цен).
+
+    Args:
+        prices: {ключ поставщика: (имя поставщика, цена)}
+
+    Returns:
+        tuple: (минимальная цена или None, отсортированный список имен поставщиков)
+    """
+    if not prices:
+        return None, []
+    min_price = min(price for _, price in prices.values())
+    return min_price, sorted(name for name, price in prices.values() if price == min_price)
+
+
+def _change(kind, entry, **values):
+    record = dict.fromkeys(DIFF_FIELDS)
+    record.update({
+        'change': kind,
+        'main_product': entry['main_product'],
+        'row_type': entry['row_type'],
+        'item_name': entry['item_name']
+    })
+    record.update(values)
+    return record
+
+
+def diff_rows(old_entry, new_entry):
+    """
+    Изменения в одной строке свода.
+
+    Args:
+        old_entry: Строка из index_summary_rows старого свода (пустая, если строки не было)
+        new_entry: Строка из index_summary_rows нового свода (пустая, если строки нет)
+
+    Returns:
+        list: Записи об изменениях с полями DIFF_FIELDS
+    """
+    entry = new_entry or old_entry
+    old_prices = old_entry['prices'] if old_entry else {}
+    new_prices = new_entry['prices'] if new_entry else {}
+    changes = []
+
+    for supplier_key, (supplier, new_price) in new_prices.items():
+        old_offer = old_prices.get(supplier_key)
+        if old_offer is None:
+            changes.append(_change('offer_added', entry, supplier=supplier, new_price=new_price))
+        elif old_offer[1] != new_price:
+            old_price = old_offer[1]
+            delta = new_price - old_price
+            changes.append(_change('price_changed', entry, supplier=supplier, old_price=old_price,
+                                   new_price=new_price, price_delta=delta,
+                                   price_delta_percent=round(delta / old_price * 100, 2) if old_price else None))
+    for supplier_key, (supplier, old_price) in old_prices.items():
+        if supplier_key not in new_prices:
+            changes.append(_change('offer_withdrawn', entry, supplier=supplier, old_price=old_price))
+
+    old_min, old_leaders = min_price_suppliers(old_prices)
+    new_min, new_leaders = min_price_suppliers(new_prices)
+    if {ess.merge_supplier_key(name) for name in old_leaders} != {ess.merge_supplier_key(name) for name in new_leaders}:
+        changes.append(_change('min_price_changed', entry, old_price=old_min, new_price=new_min,
+                               old_min_suppliers=old_leaders, new_min_suppliers=new_leaders))
+    return changes
+
+
+def diff_summaries(old_data, new_data):
+    """
+    Сравнивает два свода одной закупки.
+
+    Args:
+        old_data: Данные старого свода (ess.build_summary_data или JSON-свод)
+        new_data: Данные нового свода
+
+    Returns:
+        dict: {'old_source', 'new_source', 'totals': {вид изменения: количество, 'rows_compared': ...},
+               'changes': записи с полями DIFF_FIELDS}
+    """
+    with ess.stage_timer('сравнение'):
+        old_index = index_summary_rows(old_data)
+        new_index = index_summary_rows(new_data)
+
+        changes = []
+        # Сначала строки нового свода в его порядке, затем исчезнувшие строки старого
+        for key, new_entry in new_index.items():
+            changes.extend(diff_rows(old_index.get(key), new_entry))
+        for key, old_entry in old_index.items():
+            if key not in new_index:
+                changes.extend(diff_rows(old_entry, None))
+
+    totals = dict.fromkeys(CHANGE_LABELS, 0)
+    for change in changes:
+        totals[change['change']] += 1
+    totals['rows_compared'] = len(old_index.keys() | new_index.keys())
+
+    return {
+        'old_source': old_data.get('source'),
+        'new_source': new_data.get('source'),
+        'totals': totals,
+        'changes': changes
+    }
+
+
+def write_diff_json(report, output_path):
+    """
+    Записывает отчет об изменениях в JSON.
+
+    Args:
+        report: Результат diff_summaries
+        output_path: Путь к файлу результата
+    """
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, ensure_ascii=False, indent=2, default=summary_writers._json_default)
+
+
+def write_changes_sheet(worksheet, report):
+    """
+    Заполняет лист "Изменения": одна строка на изменение, цены в валютном формате,
+    снижение цены - зеленым, рост - красным.
+
+    Args:
+        worksheet: Лист Excel
+        report: Результат diff_summaries
+    """
+    worksheet.append(CHANGES_SHEET_HEADERS)
+    header_fill = PatternFill(start_color='ADD8E6', end_color='ADD8E6', fill_type='solid')
+    for cell in worksheet[1]:
+        cell.font = Font(bold=True)
+        cell.fill = header_fill
+        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+
+    green_font = Font(color='008000')
+    red_font = Font(color='FF0000')
+    # Номер строки считаем сами: worksheet.max_row пересчитывается по всем ячейкам листа
+    last_row = 1
+    for change in report['changes']:
+        worksheet.append([
+            CHANGE_LABELS[change['change']],
+            change['main_product'],
+            change['row_type'],
+            change['item_name'],
+            change['supplier'],
+            change['old_price'],
+            change['new_price'],
+            change['price_delta'],
+            change['price_delta_percent'],
+            ', '.join(change['old_min_suppliers'] or []),
+            ', '.join(change['new_min_suppliers'] or [])
+        ])
+        last_row += 1
+        if change['price_delta']:
+            worksheet.cell(row=last_row, column=8).font = green_font if change['price_delta'] < 0 else red_font
+
+    for col in (6, 7, 8):
+        for row in range(2, last_row + 1):
+            worksheet.cell(row=row, column=col).number_format = '#,##0.00 ₽'
+    ess.apply_borders_to_range(worksheet, 1, 1, last_row, len(CHANGES_SHEET_HEADERS))
+
+    for col_letter, width in zip('ABCDEFGHIJK', (22, 35, 12, 45, 25, 14, 14, 14, 12, 25, 25)):
+        worksheet.column_dimensions[col_letter].width = width
+    worksheet.freeze_panes = 'A2'
+    worksheet.auto_filter.ref = f"A1:K{last_row}"
+
+
+def build_changes_workbook(report):
+    """
+    Создает книгу с листом "Изменения".
+
+    Args:
+        report: Результат diff_summaries
+
+    Returns:
+        openpyxl.Workbook: Книга для сохранения
+    """
+    wb = openpyxl.Workbook()
+    worksheet = wb.active
+    worksheet.title = 'Изменения'
+    write_changes_sheet(worksheet, report)
+    return wb
+
+
+def main(argv=None):
+    """
+    Сравнение двух сводов из командной строки.
+
+    Args:
+        argv: Аргументы командной строки (по умолчанию sys.argv[1:])
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Сравнение двух сводов одной закупки')
+    parser.add_argument('old', help='Старая выгрузка ЯЗакупок (.xlsx) или свод в JSON')
+    parser.add_argument('new', help='Новая выгрузка ЯЗакупок (.xlsx) или свод в JSON')
+    parser.add_argument('-o', '--output', help='Файл с листом изменений (по умолчанию <новый>_изменения.xlsx)')
+    parser.add_argument('--json', dest='json_path', help='Файл JSON-отчета (по умолчанию <новый>_изменения.json)')
+    parser.add_argument('--rules', help='Файл правил сопоставления')
+    parser.add_argument('--reader', choices=ess.SOURCE_READERS, help='Способ чтения выгрузок')
+    args = parser.parse_args(argv)
+
+    base_name = os.path.splitext(args.new)[0]
+    output_path = args.output or f"{base_name}_изменения.xlsx"
+    json_path = args.json_path or f"{base_name}_изменения.json"
+
+    old_data = load_summary_for_diff(args.old, rules_path=args.rules, reader=args.reader)
+    new_data = load_summary_for_diff(args.new, rules_path=args.rules, reader=args.reader)
+    report = diff_summaries(old_data, new_data)
+
+    build_changes_workbook(report).save(output_path)
+    write_diff_json(report, json_path)
+    print(f"Изменений: {len(report['changes'])} ({', '.join(f'{k}: {v}' for k, v in report['totals'].items())})")
+    print(f"Лист изменений сохранен: {output_path}")
+    print(f"JSON-отчет сохранен: {json_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+# summary_profiling.py
+"""
+Профилирование сборки свода: семплирующий профилировщик и выгрузка профилей.
+
+Профилировщик раз в PROFILE_SAMPLE_INTERVAL секунд снимает стек потока, строящего свод,
+и считает одинаковые стеки. Накладные расходы не зависят от числа вызовов функций
+(в отличие от cProfile), поэтому профилировать можно рабочие сборки на файлах заказчиков.
+
+Профиль сохраняется в одном из форматов:
+    collapsed  - свернутые стеки ("a;b;c 12"), вход для flamegraph.pl и inferno
+    speedscope - JSON для https://www.speedscope.app
+
+Рядом с профилем пишется <профиль>.timings.json с таймингами этапов и счетчиками сборки.
+Размер профиля ограничен PROFILE_MAX_BYTES (редкие стеки сворачиваются в "[прочее]"),
+а число профилей в каталоге - PROFILE_MAX_COUNT (старые удаляются).
+
+Включение:
+    SUMMARY_PROFILE=speedscope|collapsed   - профилировать все сборки
+    SUMMARY_ADMIN_TOKEN=<токен>            - разрешает профилирование по запросу в веб-интерфейсах
+"""
+import hmac
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Форматы профиля и расширения файлов
+PROFILE_FORMATS = {
+    'speedscope': '.speedscope.json',
+    'collapsed': '.collapsed'
+}
+DEFAULT_PROFILE_FORMAT = 'speedscope'
+
+# Суффикс файла с таймингами этапов рядом с профилем
+TIMINGS_SUFFIX = '.timings.json'
+
+# Интервал снятия стеков
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('SUMMARY_PROFILE_INTERVAL_MS', '5')) / 1000
+
+# Ограничения хранения: размер одного профиля и число профилей в каталоге
+PROFILE_MAX_BYTES = int(os.environ.get('SUMMARY_PROFILE_MAX_KB', '5120')) * 1024
+PROFILE_MAX_COUNT = int(os.environ.get('SUMMARY_PROFILE_MAX_COUNT', '20'))
+
+# Сколько разных стеков держать в памяти; новые стеки сверх лимита считаются в "[прочее]"
+PROFILE_MAX_STACKS = 50000
+
+# Каталог профилей для сборок, результат которых не сохраняется (веб-приложение Flask)
+PROFILE_DIR = os.environ.get('SUMMARY_PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'summary_profiles')
+
+OTHER_STACK = ('[прочее]',)
+
+# Поток, который уже профилируется (вложенные сборки не запускают второй профилировщик)
+_active = threading.local()
+
+
+def env_profile_format():
+    """
+    Формат профиля из переменной окружения SUMMARY_PROFILE.
+
+    Returns:
+        str | None: Формат из PROFILE_FORMATS или None, если профилирование не включено
+    """
+    value = os.environ.get('SUMMARY_PROFILE', '').strip().lower()
+    if value in ('', '0', 'false', 'no', 'off'):
+        return None
+    return value if value in PROFILE_FORMATS else DEFAULT_PROFILE_FORMAT
+
+
+def is_admin_token(token):
+    """
+    Проверяет токен администратора, разрешающий профилирование по запросу.
+
+    Args:
+        token: Токен из запроса
+
+    Returns:
+        bool: True, если SUMMARY_ADMIN_TOKEN задан и совпадает с token
+    """
+    admin_token = os.environ.get('SUMMARY_ADMIN_TOKEN')
+    if not admin_token or not token:
+        return False
+    return hmac.compare_digest(str(token).encode('utf-8'), admin_token.encode('utf-8'))
+
+
+def requested_profile_format(flag, token):
+    """
+    Формат профиля для одного запроса веб-интерфейса: флаг администратора или SUMMARY_PROFILE.
+
+    Args:
+        flag: Значение флага профилирования из запроса ('1', 'speedscope', 'collapsed', True...)
+        token: Токен администратора из запроса
+
+    Returns:
+        str | None: Формат из PROFILE_FORMATS или None
+    """
+    if flag and str(flag).lower() not in ('0', 'false', 'no', 'off') and is_admin_token(token):
+        flag = str(flag).lower()
+        return flag if flag in PROFILE_FORMATS else DEFAULT_PROFILE_FORMAT
+    return env_profile_format()
+
+
+def profile_path_for(output_path, profile_format):
+    """
+    Путь профиля рядом с результатом: свод.xlsx -> свод_profile.speedscope.json.
+
+    Args:
+        output_path: Путь к результату сборки
+        profile_format: Формат из PROFILE_FORMATS
+
+    Returns:
+        str: Путь к файлу профиля
+    """
+    return f"{os.path.splitext(output_path)[0]}_profile{PROFILE_FORMATS[profile_format]}"
+
+
+def default_profile_path(source_path, profile_format):
+    """
+    Путь профиля в PROFILE_DIR - для сборок, результат которых не хранится.
+
+    Args:
+        source_path: Путь к исходной выгрузке (или список путей)
+        profile_format: Формат из PROFILE_FORMATS
+
+    Returns:
+        str: Путь вида PROFILE_DIR/<выгрузка>_<время>_profile.<расширение>
+    """
+    if isinstance(source_path, (list, tuple)):
+        source_path = source_path[0]
+    base_name = os.path.splitext(os.path.basename(source_path))[0]
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    return os.path.join(PROFILE_DIR, f"{base_name}_{stamp}_{os.getpid()}_profile{PROFILE_FORMATS[profile_format]}")
+
+
+def profile_format_for(profile_path):
+    """Формат профиля по расширению файла (по умолчанию speedscope)."""
+    for profile_format, suffix in PROFILE_FORMATS.items():
+        if profile_path.endswith(suffix):
+            return profile_format
+    return DEFAULT_PROFILE_FORMAT
+
+
+def is_profiling():
+    """True, если текущий поток уже профилируется."""
+    return getattr(_active, 'profiler', None) is not None
+
+
+class SamplingProfiler:
+    """
+    Семплирующий профилировщик одного потока.
+
+    Отдельный поток раз в interval секунд берет кадр профилируемого потока
+    из sys._current_frames() и увеличивает счетчик его стека. Стек - кортеж функций
+    от внешней к внутренней, функция - (имя, файл, строка начала).
+    Код в дочерних процессах (объединение выгрузок в пуле) не профилируется.
+    """
+
+    def __init__(self, interval=None, max_stacks=PROFILE_MAX_STACKS):
+        self.interval = interval or PROFILE_SAMPLE_INTERVAL
+        self.max_stacks = max_stacks
+        self.samples = {}
+        self.sample_count = 0
+        self.started_at = None
+        self.duration = 0.0
+        self._thread_id = None
+        self._stop_event = threading.Event()
+        self._sampler = None
+
+    def start(self):
+        """Начинает снимать стеки текущего потока."""
+        self._thread_id = threading.get_ident()
+        self.started_at = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name='summary-profiler', daemon=True)
+        self._sampler.start()
+        _active.profiler = self
+
+    def stop(self):
+        """Останавливает профилировщик и дожидается потока семплирования."""
+        _active.profiler = None
+        self._stop_event.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self.started_at
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self._record(frame)
+
+    def _record(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        if stack not in self.samples and len(self.samples) >= self.max_stacks:
+            stack = OTHER_STACK
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+        self.sample_count += 1
+
+
+def _frame_label(frame):
+    if frame == OTHER_STACK[0]:
+        return frame
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def _capped_samples(samples, max_bytes):
+    """
+    Оставляет самые частые стеки так, чтобы свернутый профиль уложился в max_bytes.
+    Отброшенные отсчеты сохраняются в стеке "[прочее]", поэтому общее время не теряется.
+    """
+    kept = {}
+    other = samples.get(OTHER_STACK, 0)
+    size = 0
+    for stack, count in sorted(samples.items(), key=lambda item: -item[1]):
+        if stack == OTHER_STACK:
+            continue
+        line_size = sum(len(_frame_label(frame)) + 1 for frame in stack) + 12
+        if size + line_size > max_bytes:
+            other += count
+            continue
+        kept[stack] = count
+        size += line_size
+    if other:
+        kept[OTHER_STACK] = other
+    return kept
+
+
+def write_collapsed(path, samples):
+    """
+    Записывает свернутые стеки: "внешняя;...;внутренняя <число отсчетов>" на строку.
+
+    Args:
+        path: Путь к файлу профиля
+        samples: {стек: число отсчетов}
+    """
+    with open(path, 'w', encoding='utf-8') as profile_file:
+        for stack, count in samples.items():
+            profile_file.write(';'.join(_frame_label(frame).replace(';', ',') for frame in stack))
+            profile_file.write(f" {count}\n")
+
+
+def write_speedscope(path, samples, seconds_per_sample, name):
+    """
+    Записывает профиль в формате speedscope (тип "sampled", вес отсчета - в секундах).
+
+    Args:
+        path: Путь к файлу профиля
+        samples: {стек: число отсчетов}
+        seconds_per_sample: Вес одного отсчета в секундах
+        name: Название профиля
+    """
+    frame_index = {}
+    frames = []
+    stacks = []
+    weights = []
+    for stack, count in samples.items():
+        indexes = []
+        for frame in stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                if frame == OTHER_STACK[0]:
+                    frames.append({'name': frame})
+                else:
+                    frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+            indexes.append(frame_index[frame])
+        stacks.append(indexes)
+        weights.append(round(count * seconds_per_sample, 6))
+
+    document = {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'summary_profiling',
+        'activeProfileIndex': 0,
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': round(sum(weights), 6),
+            'samples': stacks,
+            'weights': weights
+        }]
+    }
+    with open(path, 'w', encoding='utf-8') as profile_file:
+        json.dump(document, profile_file, ensure_ascii=False)
+
+
+def prune_profiles(directory, max_count=None):
+    """
+    Оставляет в каталоге не больше max_count последних профилей (вместе с таймингами).
+
+    Args:
+        directory: Каталог профилей
+        max_count: Сколько профилей хранить (по умолчанию PROFILE_MAX_COUNT)
+    """
+    max_count = PROFILE_MAX_COUNT if max_count is None else max_count
+    profiles = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(tuple(PROFILE_FORMATS.values())):
+            profiles.append((entry.stat().st_mtime, entry.path))
+    profiles.sort(reverse=True)
+    for _, path in profiles[max_count:]:
+        for stale_path in (path, path + TIMINGS_SUFFIX):
+            if os.path.exists(stale_path):
+                os.unlink(stale_path)
+
+
+def save_profile(profiler, profile_path, build_stats=None, max_bytes=None):
+    """
+    Сохраняет профиль и тайминги этапов, затем ограничивает число профилей в каталоге.
+
+    Args:
+        profiler: Остановленный SamplingProfiler
+        profile_path: Путь к файлу профиля (формат - по расширению, см. PROFILE_FORMATS)
+        build_stats: Тайминги этапов и счетчики (excel_summary_script.get_build_stats)
+        max_bytes: Предел размера профиля (по умолчанию PROFILE_MAX_BYTES)
+
+    Returns:
+        str: Путь к сохраненному профилю
+    """
+    directory = os.path.dirname(os.path.abspath(profile_path))
+    os.makedirs(directory, exist_ok=True)
+    profile_format = profile_format_for(profile_path)
+    samples = _capped_samples(profiler.samples, max_bytes or PROFILE_MAX_BYTES)
+
+    if profile_format == 'collapsed':
+        write_collapsed(profile_path, samples)
+    else:
+        # Поток семплирования ждет GIL, поэтому отсчетов меньше, чем длительность / интервал:
+        # вес отсчета берем по фактической длительности, чтобы время в профиле совпадало с настенным
+        seconds_per_sample = profiler.duration / profiler.sample_count if profiler.sample_count else profiler.interval
+        write_speedscope(profile_path, samples, seconds_per_sample, os.path.basename(profile_path))
+
+    build_stats = build_stats or {}
+    timings = {
+        'profile': os.path.basename(profile_path),
+        'format': profile_format,
+        'interval_seconds': profiler.interval,
+        'samples': profiler.sample_count,
+        'distinct_stacks': len(profiler.samples),
+        'duration_seconds': round(profiler.duration, 6),
+        'stage_timings': build_stats.get('stage_timings', {}),
+        'counters': build_stats.get('counters', {})
+    }
+    with open(profile_path + TIMINGS_SUFFIX, 'w', encoding='utf-8') as timings_file:
+        json.dump(timings, timings_file, ensure_ascii=False, indent=2)
+
+    prune_profiles(directory)
+    return profile_path
@@ -0,0 +1,303 @@
+# summary_workers.py
+"""
+Пул прогретых процессов для построения сводов из веб-интерфейсов (Flask, Gradio, API).
+
+Новый процесс (и каждый запуск сборки PyInstaller) заново импортирует openpyxl, компилирует
+правила сопоставления и регулярные выражения, поэтому первый запрос заметно медленнее
+остальных. Процессы пула делают это при старте (warm_up_engine): импортируют движок,
+компилируют правила и таблицы ключевых слов, загружают курсы валют, прогревают кэши
+признаков названий и строят пробный свод, который подгружает ленивые модули openpyxl.
+Прогрев только ускоряет первый запрос: если он не удался, процесс все равно принимает задачи.
+
+openpyxl со временем раздувает память процесса, поэтому процессы перезапускаются:
+после WORKER_MAX_JOBS задач (max_tasks_per_child) или когда память процесса после
+задачи превышает WORKER_MAX_RSS_MB - тогда пул заменяется новым, прогретым, а старый
+завершается, доделав начатые задачи.
+
+Переменные окружения:
+    SUMMARY_WORKER_POOL=0        - строить своды в процессе веб-интерфейса (без пула)
+    SUMMARY_WORKERS              - число процессов пула (по умолчанию - по числу ядер)
+    SUMMARY_WORKER_MAX_JOBS      - задач на процесс до перезапуска (0 - без ограничения)
+    SUMMARY_WORKER_MAX_RSS_MB    - память процесса, после которой пул перезапускается (0 - без ограничения)
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+WORKER_POOL_ENABLED = os.environ.get('SUMMARY_WORKER_POOL', '1').lower() not in ('0', 'false', 'no', 'off')
+WORKER_POOL_SIZE = int(os.environ.get('SUMMARY_WORKERS', os.cpu_count() or 1))
+WORKER_MAX_JOBS = int(os.environ.get('SUMMARY_WORKER_MAX_JOBS', 50))
+WORKER_MAX_RSS_MB = int(os.environ.get('SUMMARY_WORKER_MAX_RSS_MB', 1024))
+
+# max_tasks_per_child несовместим с fork, а spawn одинаково работает в Linux, Windows и сборках PyInstaller
+WORKER_START_METHOD = 'spawn'
+
+# Пробный свод при прогреве: поставщиков и товары (название, количество, аналог с желтой заливкой)
+WARM_UP_SUPPLIERS = 2
+WARM_UP_PRODUCTS = [
+    ('Монитор Dell P2422HE 24"', 10, 'Монитор Acer B247Y 24"'),
+    ('Кабель USB Type-C 2м', 50, 'Кабель USB-C Ugreen 2м'),
+    ('SSD накопитель Samsung 1TB', 20, 'SSD Crucial MX500 1TB')
+]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def current_rss_mb():
+    """
+    Резидентная память текущего процесса в МБ.
+
+    Returns:
+        float или None: RSS (в Linux - текущая, в macOS - пиковая) или None, если ее не узнать
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в macOS - в байтах, в остальных системах - в КБ
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def write_warm_up_export(path):
+    """
+    Создает маленькую выгрузку ЯЗакупок для пробного свода: информационный лист и листы
+    поставщиков с основными товарами и аналогами с желтой заливкой.
+
+    Args:
+        path: Путь к создаваемому файлу
+    """
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import PatternFill
+
+    yellow_fill = PatternFill(start_color='FFFFFF00', end_color='FFFFFF00', fill_type='solid')
+    wb = openpyxl.Workbook(write_only=True)
+    wb.create_sheet('Информация').append(['Закупка', 'Прогрев'])
+    for supplier in range(1, WARM_UP_SUPPLIERS + 1):
+        ws = wb.create_sheet(f"Поставщик {supplier}")
+        ws.append(['Наименование', 'Кол-во запрошенное', 'Кол-во предложенное', 'Цена', 'Срок', 'Комментарий'])
+        for index, (name, qty, analog_name) in enumerate(WARM_UP_PRODUCTS):
+            ws.append([name, qty, qty, 1000 * (index + supplier), '10 дней', None])
+            analog_cell = WriteOnlyCell(ws, value=analog_name)
+            analog_cell.fill = yellow_fill
+            ws.append([analog_cell, qty, qty, 900 * (index + supplier), '5 дней', 'аналог'])
+    wb.save(path)
+
+
+def warm_up_engine(rules_path=None):
+    """
+    Прогревает движок в процессе пула: правила, курсы валют, кэши признаков и пробный свод.
+    Ошибка прогрева не завершает процесс (иначе пул сломался бы и перезапускался по кругу).
+
+    Args:
+        rules_path: Путь к файлу правил сопоставления (по умолчанию - как в get_matching_rules)
+    """
+    import excel_summary_script as ess
+
+    started = time.perf_counter()
+    try:
+        rules = ess.activate_matching_rules(rules_path)
+        ess.get_fx_rates()
+
+        # Кэши признаков: ключевые слова категорий, синонимы и стандартные названия встречаются в каждой выгрузке
+        words = set(rules['category_keyword_index']) | set(rules['synonyms'])
+        words.update(category['standard_name'] for category in rules['product_categories'].values())
+        for word in words:
+            ess.determine_word_weight(word)
+            ess.classify_product_name(word)
+            ess.name_token_features(word)
+
+        # Пробный свод проходит все стадии и подгружает модули записи openpyxl
+        with tempfile.TemporaryDirectory() as warm_up_dir, contextlib.redirect_stdout(io.StringIO()):
+            source = os.path.join(warm_up_dir, 'warm_up.xlsx')
+            write_warm_up_export(source)
+            ess.export_summary(source, os.path.join(warm_up_dir, 'warm_up_свод.xlsx'))
+    except Exception as e:
+        print(f"⚠️ Процесс {os.getpid()}: прогрев не выполнен ({e}), своды строятся без прогрева")
+        return
+    finally:
+        ess.reset_build_stats()
+    print(f"Процесс {os.getpid()} прогрет за {time.perf_counter() - started:.2f} с")
+
+
+def _ping():
+    """Пустая задача: заставляет пул запустить процесс заранее."""
+    return os.getpid()
+
+
+def _call_in_worker(fn, args, kwargs):
+    """Выполняет задачу в процессе пула и сообщает память процесса после нее."""
+    return fn(*args, **kwargs), current_rss_mb()
+
+
+def export_in_worker(filename, output_path, output_format='xlsx', deadline_seconds=None, export_options=None):
+    """
+    Строит свод в процессе пула (см. excel_summary_script.export_summary).
+    Контроль допуска выполняется в веб-процессе, здесь действуют только срок и бюджет сборки.
+
+    Args:
+        filename: Путь к выгрузке или список путей
+        output_path: Путь к файлу результата
+        output_format: Формат результата
+        deadline_seconds: Предельное время сборки (см. ess.build_limits) или None
+        export_options: Остальные параметры export_summary
+
+    Returns:
+        str: Путь к сохраненному файлу
+    """
+    import excel_summary_script as ess
+
+    limits = ess.build_limits(deadline_seconds) if deadline_seconds else contextlib.nullcontext()
+    with limits:
+        return ess.export_summary(filename, output_path, output_format, **(export_options or {}))
+
+
+class WarmWorkerPool(Executor):
+    """
+    Пул прогретых процессов с перезапуском по числу задач и памяти.
+    Совместим с concurrent.futures.Executor, поэтому годится и для loop.run_in_executor.
+
+    Attributes:
+        workers: Число процессов
+        max_jobs: Задач на процесс до перезапуска (0 - без ограничения)
+        max_rss_mb: Память процесса после задачи, при превышении которой пул перезапускается
+        generation: Номер текущего поколения процессов (растет при каждом перезапуске)
+        recycled: Сколько раз пул перезапускался по памяти или после сбоя процесса
+    """
+
+    def __init__(self, workers=None, max_jobs=None, max_rss_mb=None, rules_path=None):
+        self.workers = workers or WORKER_POOL_SIZE
+        self.max_jobs = WORKER_MAX_JOBS if max_jobs is None else max_jobs
+        self.max_rss_mb = WORKER_MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+        self.rules_path = rules_path
+        self.generation = 0
+        self.recycled = 0
+        self._executor = None
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def _new_executor(self):
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(WORKER_START_METHOD),
+            initializer=warm_up_engine,
+            initargs=(self.rules_path,),
+            max_tasks_per_child=self.max_jobs or None
+        )
+        # Процессы запускаются и прогреваются сразу, а не при первом запросе
+        for _ in range(self.workers):
+            executor.submit(_ping)
+        self.generation += 1
+        return executor
+
+    def start(self):
+        """Запускает и прогревает процессы пула (вызывается при старте веб-интерфейса)."""
+        self._current_executor()
+        return self
+
+    def _current_executor(self):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('Пул процессов остановлен')
+            if self._executor is None:
+                self._executor = self._new_executor()
+            return self._executor
+
+    def _recycle(self, executor, reason):
+        with self._lock:
+            if self._executor is not executor or self._shutdown:
+                return  # Поколение уже заменено другой задачей
+            self._executor = self._new_executor()
+            self.recycled += 1
+        print(f"Пул процессов перезапущен ({reason}), поколение {self.generation}")
+        # Старые процессы доделывают начатые задачи и завершаются
+        executor.shutdown(wait=False)
+
+    def submit(self, fn, /, *args, **kwargs):
+        """
+        Ставит задачу в пул.
+
+        Args:
+            fn: Функция уровня модуля (передается в процесс по имени)
+            *args, **kwargs: Аргументы функции
+
+        Returns:
+            Future: Результат функции
+        """
+        executor = self._current_executor()
+        result_future = Future()
+        try:
+            job_future = executor.submit(_call_in_worker, fn, args, kwargs)
+        except BrokenProcessPool:
+            self._recycle(executor, 'процесс пула аварийно завершился')
+            job_future = self._current_executor().submit(_call_in_worker, fn, args, kwargs)
+
+        def job_done(done_future):
+            try:
+                result, rss_mb = done_future.result()
+            except BrokenProcessPool as e:
+                self._recycle(executor, 'процесс пула аварийно завершился')
+                result_future.set_exception(e)
+                return
+            except BaseException as e:
+                result_future.set_exception(e)
+                return
+            if self.max_rss_mb and rss_mb is not None and rss_mb > self.max_rss_mb:
+                self._recycle(executor, f"память процесса {rss_mb:.0f} МБ > {self.max_rss_mb} МБ")
+            result_future.set_result(result)
+
+        job_future.add_done_callback(job_done)
+        return result_future
+
+    def run(self, fn, *args, **kwargs):
+        """Выполняет задачу в пуле и ждет результат."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._lock:
+            self._shutdown = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def get_worker_pool(workers=None):
+    """
+    Общий пул процессов веб-интерфейса (создается при первом обращении).
+
+    Args:
+        workers: Число процессов (по умолчанию WORKER_POOL_SIZE)
+
+    Returns:
+        WarmWorkerPool или None, если пул отключен (SUMMARY_WORKER_POOL=0)
+    """
+    global _pool
+    if not WORKER_POOL_ENABLED:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = WarmWorkerPool(workers=workers)
+        return _pool
+
+
+def shutdown_worker_pool():
+    """Останавливает общий пул (при завершении веб-интерфейса)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
@@ -0,0 +1,296 @@
+# summary_writers.py
+"""
+Форматонезависимая выгрузка данных свода: CSV, JSON, JSON Lines, Parquet и Arrow.
+
+Писатели работают с моделью данных свода (см. excel_summary_script.build_summary_data)
+и не выполняют никакого оформления. Строки выдаются потоком - по одной записи
+на предложение поставщика, без построения промежуточных таблиц.
+"""
+import csv
+import json
+
+# Поля плоской записи: одна запись на пару (строка свода, поставщик)
+SUMMARY_RECORD_FIELDS = [
+    'row_number',
+    'row_type',
+    'main_product',
+    'name',
+    'item_name',
+    'requested_qty',
+    'supplier',
+    'offered_qty',
+    'price',
+    'delivery',
+    'comment',
+    'payment_terms',
+    'extended_price',
+    'min_price',
+    'best_supplier',
+    'price_spread'
+]
+
+# Размер пакета строк для колоночных форматов
+COLUMNAR_BATCH_SIZE = 10000
+
+
+def iter_summary_records(summary_data):
+    """
+    Превращает строки свода в плоские записи - по одной на предложение поставщика.
+    Строки без предложений выдаются одной записью с пустым поставщиком, чтобы позиции не терялись.
+
+    Args:
+        summary_data: Результат build_summary_data
+
+    Yields:
+        dict: Запись с полями SUMMARY_RECORD_FIELDS
+    """
+    sheet_names = summary_data['sheet_names']
+    payment_terms = summary_data.get('payment_terms') or {}
+
+    for row_number, row in enumerate(summary_data['summary_rows'], start=1):
+        base_record = {
+            'row_number': row_number,
+            'row_type': row.get('row_type'),
+            'main_product': row.get('main_product'),
+            'name': row['name'],
+            'item_name': row.get('item_name', row['name']),
+            'requested_qty': row['requested_qty'],
+            'min_price': row.get('min_price'),
+            'best_supplier': row.get('best_supplier'),
+            'price_spread': row.get('price_spread')
+        }
+        extended_prices = row.get('extended_prices') or {}
+
+        has_offers = False
+        # Поставщики выдаются в порядке колонок свода
+        for sheet_name in sheet_names:
+            offer = row['suppliers'].get(sheet_name)
+            if offer is None:
+                continue
+            has_offers = True
+            offer = list(offer) + [None] * (4 - len(offer))
+            record = dict(base_record)
+            record.update({
+                'supplier': sheet_name,
+                'offered_qty': offer[0],
+                'price': offer[1],
+                'delivery': offer[2],
+                'comment': offer[3],
+                'payment_terms': payment_terms.get(sheet_name),
+                'extended_price': extended_prices.get(sheet_name)
+            })
+            yield record
+
+        if not has_offers:
+            record = dict(base_record)
+            record.update({
+                'supplier': None,
+                'offered_qty': None,
+                'price': None,
+                'delivery': None,
+                'comment': None,
+                'payment_terms': None,
+                'extended_price': None
+            })
+            yield record
+
+
+def _json_default(value):
+    """Сериализует значения ячеек, которые не поддерживает json (даты и т.п.)."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def write_summary_csv(summary_data, output_path):
+    """
+    Записывает свод в CSV (UTF-8 с BOM, чтобы Excel корректно открывал кириллицу).
+
+    Args:
+        summary_data: Результат build_summary_data
+        output_path: Путь к файлу результата
+    """
+    with open(output_path, 'w', newline='', encoding='utf-8-sig') as output_file:
+        writer = csv.DictWriter(output_file, fieldnames=SUMMARY_RECORD_FIELDS)
+        writer.writeheader()
+        for record in iter_summary_records(summary_data):
+            writer.writerow(record)
+
+
+def write_summary_jsonl(summary_data, output_path):
+    """
+    Записывает свод в формате JSON Lines - одна запись на строку.
+
+    Args:
+        summary_data: Результат build_summary_data
+        output_path: Путь к файлу результата
+    """
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        for record in iter_summary_records(summary_data):
+            output_file.write(json.dumps(record, ensure_ascii=False, default=_json_default))
+            output_file.write('\n')
+
+
+def write_summary_json(summary_data, output_path):
+    """
+    Записывает свод одним JSON-документом: поставщики, условия оплаты, итоги по поставщикам
+    и строки свода в исходной структуре (предложения поставщиков - списком [кол-во, цена, срок, комментарий]).
+
+    Args:
+        summary_data: Результат build_summary_data
+        output_path: Путь к файлу результата
+    """
+    document = {
+        'source': summary_data.get('source'),
+        'sheet_names': summary_data['sheet_names'],
+        'payment_terms': summary_data.get('payment_terms') or {},
+        'supplier_totals': summary_data.get('supplier_totals') or {},
+        'summary_rows': summary_data['summary_rows']
+    }
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        json.dump(document, output_file, ensure_ascii=False, default=_json_default)
+
+
+def _import_pyarrow():
+    """Импортирует pyarrow - необязательную зависимость колоночных форматов."""
+    try:
+        import pyarrow
+    except ImportError:
+        raise RuntimeError('Для выгрузки в Parquet/Arrow установите пакет pyarrow: pip install pyarrow')
+    return pyarrow
+
+
+def _arrow_schema(pa):
+    """Схема колоночной выгрузки: количества, цены и суммы - числа (нечисловые значения пустые), остальное - текст."""
+    return pa.schema([
+        ('row_number', pa.int64()),
+        ('row_type', pa.string()),
+        ('main_product', pa.string()),
+        ('name', pa.string()),
+        ('item_name', pa.string()),
+        ('requested_qty', pa.float64()),
+        ('supplier', pa.string()),
+        ('offered_qty', pa.float64()),
+        ('price', pa.float64()),
+        ('delivery', pa.string()),
+        ('comment', pa.string()),
+        ('payment_terms', pa.string()),
+        ('extended_price', pa.float64()),
+        ('min_price', pa.float64()),
+        ('best_supplier', pa.string()),
+        ('price_spread', pa.float64())
+    ])
+
+
+def _to_float(value):
+    """Приводит значение к числу; нечисловые значения становятся пустыми."""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _to_text(value):
+    """Приводит значение к строке, сохраняя пустые значения."""
+    return None if value is None else str(value)
+
+
+def _iter_arrow_batches(summary_data, pa, schema):
+    """Выдает пакеты записей (RecordBatch) по COLUMNAR_BATCH_SIZE строк."""
+    converters = {
+        'row_number': int,
+        'requested_qty': _to_float,
+        'offered_qty': _to_float,
+        'price': _to_float,
+        'extended_price': _to_float,
+        'min_price': _to_float,
+        'price_spread': _to_float
+    }
+    columns = {field: [] for field in SUMMARY_RECORD_FIELDS}
+
+    def flush():
+        arrays = [pa.array(columns[field], type=schema.field(field).type) for field in SUMMARY_RECORD_FIELDS]
+        for values in columns.values():
+            values.clear()
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    count = 0
+    for record in iter_summary_records(summary_data):
+        for field in SUMMARY_RECORD_FIELDS:
+            columns[field].append(converters.get(field, _to_text)(record[field]))
+        count += 1
+        if count == COLUMNAR_BATCH_SIZE:
+            yield flush()
+            count = 0
+    if count:
+        yield flush()
+
+
+def write_summary_parquet(summary_data, output_path):
+    """
+    Записывает свод в Parquet пакетами строк (требуется pyarrow).
+
+    Args:
+        summary_data: Результат build_summary_data
+        output_path: Путь к файлу результата
+    """
+    pa = _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(pa)
+    with pq.ParquetWriter(output_path, schema) as writer:
+        for batch in _iter_arrow_batches(summary_data, pa, schema):
+            writer.write_batch(batch)
+
+
+def write_summary_arrow(summary_data, output_path):
+    """
+    Записывает свод в Arrow IPC (Feather v2) пакетами строк (требуется pyarrow).
+
+    Args:
+        summary_data: Результат build_summary_data
+        output_path: Путь к файлу результата
+    """
+    pa = _import_pyarrow()
+
+    schema = _arrow_schema(pa)
+    with pa.OSFile(output_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in _iter_arrow_batches(summary_data, pa, schema):
+                writer.write_batch(batch)
+
+
+# Писатели форматов данных (xlsx строится отдельно, с оформлением)
+DATA_WRITERS = {
+    'csv': write_summary_csv,
+    'json': write_summary_json,
+    'jsonl': write_summary_jsonl,
+    'parquet': write_summary_parquet,
+    'arrow': write_summary_arrow
+}
+
+# MIME-типы и расширения для веб-интерфейсов
+FORMAT_MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'json': 'application/json',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file'
+}
+
+
+def write_summary(summary_data, output_path, output_format):
+    """
+    Записывает данные свода в указанном формате.
+
+    Args:
+        summary_data: Результат build_summary_data
+        output_path: Путь к файлу результата
+        output_format: Ключ DATA_WRITERS
+    """
+    if output_format not in DATA_WRITERS:
+        raise ValueError(f"Неподдерживаемый формат: {output_format!r}. Доступны: {', '.join(DATA_WRITERS)}")
+    DATA_WRITERS[output_format](summary_data, output_path)
@@ -0,0 +1,675 @@
+# xlsx_stream_reader.py
+"""
+Быстрое чтение выгрузок ЯЗакупок напрямую из XML внутри xlsx.
+
+Для листов поставщиков нужны только колонка A (значение, цвет заливки, отступы)
+и колонки B-F. openpyxl строит полные объекты ячеек и стилей для каждой ячейки;
+здесь XML листа разбирается потоково (expat, порциями), индекс стиля ячейки A сразу
+переводится в признак желтой заливки по styles.xml, а строки выдаются компактными
+кортежами (номер строки, значение A, желтая заливка, значения B-F).
+
+Первый (информационный) лист читается целиком в легкий объект с интерфейсом,
+достаточным для extract_payment_terms (cell, max_row, max_column, merged_cells).
+
+Если файл не соответствует ожидаемой структуре, выбрасывается XlsxShapeError -
+вызывающий код должен вернуться к openpyxl.
+"""
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree
+from xml.parsers import expat
+
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+from openpyxl.utils.cell import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel, from_ISO8601
+from openpyxl.worksheet.cell_range import CellRange
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+WORKSHEET_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+OFFICE_DOCUMENT_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+
+# Желтые цвета в различных форматах (как в is_yellow_cell)
+YELLOW_COLORS = {'FFFFFF00', 'FFFF00', 'FFFF99', 'FFFFCC', 'FFC000', 'FFFF66'}
+
+# Колонки листа поставщика: A - наименование, B-F - запрошенное количество, предложенное количество,
+# цена, сроки, комментарий
+SUPPLIER_COLUMNS = 6
+
+# Размер порции XML, передаваемой парсеру листа
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class XlsxShapeError(ValueError):
+    """Файл не похож на ожидаемую выгрузку - нужно читать его через openpyxl."""
+
+
+class StreamCell:
+    """Минимальная ячейка: значение и адрес (как у openpyxl)."""
+    __slots__ = ('row', 'column', 'value')
+
+    def __init__(self, row, column, value=None):
+        self.row = row
+        self.column = column
+        self.value = value
+
+    @property
+    def coordinate(self):
+        return f"{get_column_letter(self.column)}{self.row}"
+
+
+class _MergedCells:
+    """Контейнер объединенных диапазонов с атрибутом ranges, как у openpyxl."""
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+
+
+class StreamSheet:
+    """Лист, прочитанный целиком: используется для небольшого информационного листа."""
+
+    def __init__(self, title, cells, merged_ranges, max_row, max_column):
+        self.title = title
+        self._cells = cells
+        self.merged_cells = _MergedCells(merged_ranges)
+        self.max_row = max_row
+        self.max_column = max_column
+
+    def cell(self, row, column):
+        return StreamCell(row, column, self._cells.get((row, column)))
+
+
+class StreamWorkbook:
+    """
+    Результат потокового чтения выгрузки.
+
+    Attributes:
+        sheetnames: Имена всех листов в порядке книги
+        dimensions: {лист: (max_row, max_column)}
+        payment_terms: Заранее извлеченные условия оплаты {лист: условия} или None,
+            если их нужно искать на информационном листе
+        supplier_headers: {лист: значения заголовков A-F} - первая строка листов поставщиков
+    """
+
+    def __init__(self, sheetnames, info_sheet, supplier_rows, dimensions, payment_terms=None, supplier_headers=None):
+        self.sheetnames = sheetnames
+        self._info_sheet = info_sheet
+        self._supplier_rows = supplier_rows
+        self.dimensions = dimensions
+        self.payment_terms = payment_terms
+        self.supplier_headers = supplier_headers or {}
+
+    def __getitem__(self, sheet_name):
+        if self._info_sheet is not None and sheet_name == self._info_sheet.title:
+            return self._info_sheet
+        raise KeyError(f"Лист '{sheet_name}' прочитан в компактном виде, используйте supplier_rows()")
+
+    def supplier_rows(self, sheet_name):
+        """
+        Возвращает компактные строки листа поставщика.
+
+        Args:
+            sheet_name: Имя листа
+
+        Returns:
+            list: Кортежи (номер строки, значение A, желтая заливка A, (значения B-F))
+        """
+        return self._supplier_rows[sheet_name]
+
+
+def _read_xml(archive, part_name):
+    try:
+        with archive.open(part_name) as part:
+            return ElementTree.parse(part).getroot()
+    except KeyError:
+        raise XlsxShapeError(f"В файле нет части {part_name}")
+    except ElementTree.ParseError as error:
+        raise XlsxShapeError(f"Некорректный XML в {part_name}: {error}")
+
+
+def _resolve_target(base_dir, target):
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(base_dir, target))
+
+
+def _find_workbook_part(archive):
+    root = _read_xml(archive, '_rels/.rels')
+    for relationship in root.iter(PKG_REL_NS + 'Relationship'):
+        if relationship.get('Type') == OFFICE_DOCUMENT_REL_TYPE:
+            return _resolve_target('', relationship.get('Target'))
+    raise XlsxShapeError('Не найдена основная часть книги (officeDocument)')
+
+
+def _read_sheet_parts(archive, workbook_part):
+    """Возвращает [(имя листа, путь к XML листа)], признак календаря 1904 и путь к styles.xml."""
+    workbook_dir = posixpath.dirname(workbook_part)
+    rels_part = posixpath.join(workbook_dir, '_rels', posixpath.basename(workbook_part) + '.rels')
+    relationships = {}
+    styles_part = None
+    shared_strings_part = None
+    for relationship in _read_xml(archive, rels_part).iter(PKG_REL_NS + 'Relationship'):
+        target = _resolve_target(workbook_dir, relationship.get('Target'))
+        rel_type = relationship.get('Type', '')
+        relationships[relationship.get('Id')] = (rel_type, target)
+        if rel_type.endswith('/styles'):
+            styles_part = target
+        elif rel_type.endswith('/sharedStrings'):
+            shared_strings_part = target
+
+    workbook = _read_xml(archive, workbook_part)
+    properties = workbook.find(MAIN_NS + 'workbookPr')
+    date1904 = properties is not None and properties.get('date1904') in ('1', 'true')
+
+    sheets = []
+    for sheet in workbook.iter(MAIN_NS + 'sheet'):
+        rel_type, target = relationships.get(sheet.get(REL_NS + 'id'), (None, None))
+        if rel_type != WORKSHEET_REL_TYPE:
+            raise XlsxShapeError(f"Лист '{sheet.get('name')}' не является обычным листом ({rel_type})")
+        sheets.append((sheet.get('name'), target))
+    if not sheets:
+        raise XlsxShapeError('В книге нет листов')
+    return sheets, date1904, styles_part, shared_strings_part
+
+
+def _open_part(archive, part_name):
+    """Открывает часть архива для потокового чтения (распаковка идет порциями по мере чтения)."""
+    try:
+        return archive.open(part_name)
+    except KeyError:
+        raise XlsxShapeError(f"В файле нет части {part_name}")
+
+
+def read_shared_strings(archive, part_name):
+    """
+    Потоково читает таблицу общих строк (sharedStrings.xml).
+
+    Args:
+        archive: Открытый zipfile.ZipFile
+        part_name: Путь к части с общими строками или None
+
+    Returns:
+        list: Строки в порядке индексов
+    """
+    strings = []
+    if part_name is None:
+        return strings
+    root = None
+    with _open_part(archive, part_name) as part:
+        for event, element in ElementTree.iterparse(part, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+            if element.tag == MAIN_NS + 'si':
+                # Форматированный текст состоит из нескольких фрагментов; фонетические подсказки пропускаем
+                texts = []
+                for child in element:
+                    if child.tag == MAIN_NS + 't':
+                        texts.append(child.text or '')
+                    elif child.tag == MAIN_NS + 'r':
+                        run_text = child.find(MAIN_NS + 't')
+                        if run_text is not None:
+                            texts.append(run_text.text or '')
+                strings.append(''.join(texts))
+                # Обработанные элементы удаляем из дерева, чтобы память не росла с размером таблицы
+                root.clear()
+    return strings
+
+
+# Разделы styles.xml, нужные для определения заливки и формата даты; остальные пропускаются
+_STYLE_SECTIONS = {MAIN_NS + 'numFmts', MAIN_NS + 'fills', MAIN_NS + 'cellXfs'}
+
+
+def read_style_flags(archive, part_name):
+    """
+    Потоково разбирает styles.xml и для каждого индекса стиля ячейки (cellXfs) определяет
+    желтую заливку и формат даты. Шрифты, границы, стили ячеек и условное форматирование
+    пропускаются без построения дерева.
+
+    Args:
+        archive: Открытый zipfile.ZipFile
+        part_name: Путь к styles.xml или None
+
+    Returns:
+        tuple: (yellow_styles, date_styles) - множество индексов стилей с желтой заливкой
+            и словарь {индекс стиля с форматом даты: формат длительности ли это}
+    """
+    if part_name is None:
+        return set(), {}
+
+    custom_formats = {}
+    yellow_fills = set()
+    cell_formats = []
+    fill_count = 0
+    depth = 0
+    section = None
+    try:
+        with _open_part(archive, part_name) as part:
+            for event, element in ElementTree.iterparse(part, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 2 and element.tag in _STYLE_SECTIONS:
+                        section = element.tag
+                    continue
+                depth -= 1
+                if depth == 1:
+                    # Закрылся раздел верхнего уровня - освобождаем его
+                    section = None
+                    element.clear()
+                elif depth == 2 and section == MAIN_NS + 'numFmts':
+                    custom_formats[int(element.get('numFmtId'))] = element.get('formatCode', '')
+                elif depth == 2 and section == MAIN_NS + 'fills':
+                    pattern = element.find(MAIN_NS + 'patternFill')
+                    foreground = pattern.find(MAIN_NS + 'fgColor') if pattern is not None else None
+                    color = foreground.get('rgb') if foreground is not None else None
+                    if color and color.upper() in YELLOW_COLORS:
+                        yellow_fills.add(fill_count)
+                    fill_count += 1
+                elif depth == 2 and section == MAIN_NS + 'cellXfs':
+                    cell_formats.append((int(element.get('fillId', 0)), int(element.get('numFmtId', 0))))
+    except ElementTree.ParseError as error:
+        raise XlsxShapeError(f"Некорректный XML в {part_name}: {error}")
+
+    yellow_styles = set()
+    date_styles = {}
+    for style_id, (fill_id, format_id) in enumerate(cell_formats):
+        if fill_id in yellow_fills:
+            yellow_styles.add(style_id)
+        format_code = custom_formats.get(format_id, BUILTIN_FORMATS.get(format_id))
+        if format_code and is_date_format(format_code):
+            date_styles[style_id] = is_timedelta_format(format_code)
+    return yellow_styles, date_styles
+
+
+def _convert_value(data_type, raw, style, shared_strings, date_styles, epoch):
+    """Преобразует значение XML-ячейки так же, как это делает openpyxl."""
+    if raw is None or data_type == 'inlineStr':
+        return raw
+    if data_type == 's':
+        return shared_strings[int(raw)]
+    if data_type in ('str', 'e'):
+        return raw
+    if data_type == 'b':
+        return bool(int(raw))
+    if data_type == 'd':
+        return from_ISO8601(raw)
+
+    if '.' in raw or 'E' in raw or 'e' in raw:
+        value = float(raw)
+    else:
+        value = int(raw)
+    if style in date_styles:
+        try:
+            return from_excel(value, epoch, timedelta=date_styles[style])
+        except (OverflowError, ValueError):
+            return '#VALUE!'
+    return value
+
+
+def iter_sheet_cells(archive, part_name, shared_strings, date_styles, epoch, max_column=None):
+    """
+    Потоково перебирает строки листа.
+
+    XML разбирается через expat порциями по READ_CHUNK_SIZE байт: объекты создаются
+    только для нужных значений, а не для каждого элемента документа.
+
+    Args:
+        archive: Открытый zipfile.ZipFile
+        part_name: Путь к XML листа
+        shared_strings: Таблица общих строк
+        date_styles: {индекс стиля с форматом даты: формат длительности ли это}
+        epoch: Календарь книги
+        max_column: Читать только колонки до этой включительно (опционально)
+
+    Yields:
+        tuple: ('row', номер строки, [(колонка, значение, индекс стиля), ...]) для каждой строки,
+            в конце - ('merged', [CellRange, ...]) с объединенными диапазонами
+    """
+    part = _open_part(archive, part_name)
+
+    ready_rows = []
+    merged_ranges = []
+    column_cache = {}
+    text_parts = []
+    # Имена элементов с префиксом пространства имен, который использует файл (обычно пустой)
+    row_tag = cell_tag = merge_tag = inline_tag = phonetic_tag = formula_tag = None
+
+    # Состояние разбора: текущая строка и ячейка
+    row_number = 0
+    row_cells = None
+    column = 0
+    style = 0
+    data_type = 'n'
+    collecting = False
+    has_inline = False
+
+    def start_root(tag, attributes):
+        nonlocal row_tag, cell_tag, merge_tag, inline_tag, phonetic_tag, formula_tag
+        prefix, _, local_name = tag.rpartition(':')
+        namespace = attributes.get(f"xmlns:{prefix}" if prefix else 'xmlns')
+        if local_name != 'worksheet' or '{' + (namespace or '') + '}' != MAIN_NS:
+            raise XlsxShapeError(f"{part_name} не является листом SpreadsheetML")
+        prefix = prefix + ':' if prefix else ''
+        row_tag, cell_tag, merge_tag = prefix + 'row', prefix + 'c', prefix + 'mergeCell'
+        inline_tag, phonetic_tag, formula_tag = prefix + 'is', prefix + 'rPh', prefix + 'f'
+        parser.StartElementHandler = start_element
+
+    def start_element(tag, attributes):
+        nonlocal row_number, row_cells, column, style, data_type, collecting, has_inline
+        if tag == cell_tag:
+            reference = attributes.get('r')
+            if reference:
+                letters = reference.rstrip('0123456789')
+                column = column_cache.get(letters)
+                if column is None:
+                    try:
+                        column = column_cache[letters] = column_index_from_string(letters)
+                    except ValueError:
+                        raise XlsxShapeError(f"Некорректный адрес ячейки: {reference}")
+            else:
+                column += 1
+            # Внутри <c> текст есть только у значения (<v> или <is><t>), его и собираем
+            collecting = max_column is None or column <= max_column
+            style = int(attributes.get('s', 0))
+            data_type = attributes.get('t', 'n')
+            has_inline = False
+            text_parts.clear()
+        elif tag == row_tag:
+            row_number = int(attributes.get('r', row_number + 1))
+            row_cells = []
+            column = 0
+        elif tag == merge_tag:
+            merged_ranges.append(CellRange(attributes['ref']))
+        elif tag == inline_tag:
+            has_inline = True
+        elif tag == phonetic_tag:
+            # Фонетические подсказки не входят в значение строки
+            collecting = False
+        elif tag == formula_tag and collecting:
+            # openpyxl возвращает для формул текст формулы - такие файлы читаем через него
+            raise XlsxShapeError(f"Ячейка {get_column_letter(column)}{row_number} листа {part_name} содержит формулу")
+
+    def end_element(tag):
+        nonlocal collecting
+        if tag == cell_tag:
+            if collecting:
+                collecting = False
+                if data_type == 'inlineStr':
+                    raw = ''.join(text_parts) if has_inline else None
+                else:
+                    # Пустой <v/> openpyxl считает отсутствующим значением
+                    raw = ''.join(text_parts) or None
+                row_cells.append((column, _convert_value(data_type, raw, style, shared_strings, date_styles, epoch),
+                                  style))
+        elif tag == row_tag:
+            ready_rows.append(('row', row_number, row_cells))
+        elif tag == phonetic_tag:
+            collecting = max_column is None or column <= max_column
+
+    def character_data(data):
+        if collecting:
+            text_parts.append(data)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_root
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+
+    with part:
+        try:
+            while True:
+                chunk = part.read(READ_CHUNK_SIZE)
+                parser.Parse(chunk, not chunk)
+                if ready_rows:
+                    yield from ready_rows
+                    ready_rows.clear()
+                if not chunk:
+                    break
+        except expat.ExpatError as error:
+            raise XlsxShapeError(f"Некорректный XML в {part_name}: {error}")
+    yield ('merged', merged_ranges)
+
+
+def _read_info_sheet(archive, title, part_name, shared_strings, date_styles, epoch):
+    cells = {}
+    merged_ranges = []
+    max_row = 0
+    max_column = 0
+    for event in iter_sheet_cells(archive, part_name, shared_strings, date_styles, epoch):
+        if event[0] == 'merged':
+            merged_ranges = event[1]
+            continue
+        _, row_number, row_cells = event
+        for column, value, _ in row_cells:
+            max_row = max(max_row, row_number)
+            max_column = max(max_column, column)
+            if value is not None:
+                cells[(row_number, column)] = value
+    for merged_range in merged_ranges:
+        max_row = max(max_row, merged_range.max_row)
+        max_column = max(max_column, merged_range.max_col)
+    return StreamSheet(title, cells, merged_ranges, max(max_row, 1), max(max_column, 1))
+
+
+def _read_supplier_sheet(archive, part_name, shared_strings, yellow_styles, date_styles, epoch):
+    rows = []
+    header = (None,) * SUPPLIER_COLUMNS
+    max_row = 0
+    max_column = 0
+    for event in iter_sheet_cells(archive, part_name, shared_strings, date_styles, epoch):
+        if event[0] == 'merged':
+            continue
+        _, row_number, row_cells = event
+        if row_cells:
+            max_row = max(max_row, row_number)
+            max_column = max(max_column, row_cells[-1][0])
+        if row_number < 2:
+            if row_number == 1:
+                header_values = [None] * SUPPLIER_COLUMNS
+                for column, value, _ in row_cells:
+                    if column <= SUPPLIER_COLUMNS:
+                        header_values[column - 1] = value
+                header = tuple(header_values)
+            continue
+        values = [None] * SUPPLIER_COLUMNS
+        name_style = 0
+        for column, value, style in row_cells:
+            if column <= SUPPLIER_COLUMNS:
+                values[column - 1] = value
+                if column == 1:
+                    name_style = style
+        rows.append((row_number, values[0], name_style in yellow_styles, tuple(values[1:])))
+    return rows, (max_row, max_column), header
+
+
+def open_archive(source):
+    """
+    Открывает xlsx как zip-архив. Части распаковываются потоково при чтении (см. _open_part).
+
+    Args:
+        source: Путь к файлу или файловый объект с произвольным доступом
+
+    Returns:
+        zipfile.ZipFile: Открытый архив
+    """
+    try:
+        return zipfile.ZipFile(source)
+    except zipfile.BadZipFile as error:
+        raise XlsxShapeError(f"Файл не является xlsx (zip): {error}")
+
+
+# Сигнатура локального заголовка zip - первые байты любого xlsx
+ZIP_SIGNATURE = b'PK\x03\x04'
+
+
+def has_zip_signature(first_bytes):
+    """
+    Проверяет по первым байтам, что файл является zip-архивом (xlsx).
+
+    Args:
+        first_bytes: Начало файла (не меньше 4 байт)
+
+    Returns:
+        bool: True если файл начинается с сигнатуры zip
+    """
+    return first_bytes[:len(ZIP_SIGNATURE)] == ZIP_SIGNATURE
+
+
+def validate_xlsx_structure(source):
+    """
+    Быстро проверяет структуру выгрузки по центральному каталогу zip и workbook.xml,
+    не распаковывая листы: должен быть информационный лист и хотя бы один лист поставщика.
+
+    Args:
+        source: Путь к xlsx или файловый объект с произвольным доступом
+
+    Returns:
+        list: Имена листов
+
+    Raises:
+        XlsxShapeError: Файл не является выгрузкой ожидаемой структуры
+    """
+    with open_archive(source) as archive:
+        workbook_part = _find_workbook_part(archive)
+        sheets, _, _, _ = _read_sheet_parts(archive, workbook_part)
+        present_parts = set(archive.namelist())
+    missing = [part_name for _, part_name in sheets if part_name not in present_parts]
+    if missing:
+        raise XlsxShapeError(f"В файле нет листов: {', '.join(missing)}")
+    if len(sheets) < 2:
+        raise XlsxShapeError('Ожидается информационный лист и хотя бы один лист поставщика')
+    return [title for title, _ in sheets]
+
+
+# Открывающие теги XML листа, по которым оценивается его объем без разбора
+_ROW_TAGS = (b'<row ', b'<row>')
+_CELL_TAGS = (b'<c ', b'<c>')
+_MERGE_CELL_TAGS = (b'<mergeCell ',)
+_TAG_TAIL = max(len(tag) for tag in _ROW_TAGS + _CELL_TAGS + _MERGE_CELL_TAGS) - 1
+_DIMENSION_RE = re.compile(rb'<dimension\s+ref="([A-Z]+[0-9]+(?::[A-Z]+[0-9]+)?)"')
+# Открывающий тег ячейки колонки A (наименование позиции, кроме заголовка A1) с индексом стиля, если он задан
+_NAME_CELL_RE = re.compile(rb'<c\s+r="A(?!1")[0-9]+"[^>]*>')
+_STYLE_ATTR_RE = re.compile(rb'\ss="([0-9]+)"')
+# Сколько байт предыдущей порции сохранять, чтобы тег ячейки на границе порций не потерялся
+_NAME_CELL_TAIL = 256
+
+
+def _count_tags(data, tags):
+    return sum(data.count(tag) for tag in tags)
+
+
+def scan_sheet_costs(source, max_bytes=None):
+    """
+    Оценивает объем листов без разбора XML: части листов распаковываются потоково,
+    а в байтах считаются открывающие теги строк, ячеек и объединений. В отличие от
+    <dimension> (его max_row и max_column бывают огромными из-за оформления пустых ячеек)
+    это реальный объем работы чтения.
+
+    Args:
+        source: Путь к xlsx или файловый объект с произвольным доступом
+        max_bytes: Остановить подсчет после стольких распакованных байт (защита от zip-бомб)
+
+    Returns:
+        list: [{'title', 'rows', 'cells', 'merged_ranges', 'dimension', 'compressed_bytes',
+                'uncompressed_bytes', 'name_cells', 'yellow_name_cells', 'complete'}] - по листу;
+            name_cells - заполненные ячейки колонки A под заголовком, yellow_name_cells - из них с желтой
+            заливкой (аналоги); complete=False, если подсчет прерван
+
+    Raises:
+        XlsxShapeError: Файл не является xlsx ожидаемой структуры
+    """
+    costs = []
+    scanned = 0
+    with open_archive(source) as archive:
+        workbook_part = _find_workbook_part(archive)
+        sheets, _, styles_part, _ = _read_sheet_parts(archive, workbook_part)
+        yellow_styles, _ = read_style_flags(archive, styles_part)
+        for title, part_name in sheets:
+            try:
+                info = archive.getinfo(part_name)
+            except KeyError:
+                raise XlsxShapeError(f"В файле нет части {part_name}")
+            cost = {'title': title, 'rows': 0, 'cells': 0, 'merged_ranges': 0, 'dimension': None,
+                    'compressed_bytes': info.compress_size, 'uncompressed_bytes': info.file_size,
+                    'name_cells': 0, 'yellow_name_cells': 0, 'complete': True}
+            costs.append(cost)
+            if max_bytes is not None and scanned >= max_bytes:
+                cost['complete'] = False
+                continue
+            tail = b''
+            name_tail = b''
+            with _open_part(archive, part_name) as part:
+                while True:
+                    chunk = part.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if cost['dimension'] is None and not tail:
+                        match = _DIMENSION_RE.search(chunk)
+                        cost['dimension'] = match.group(1).decode('ascii') if match else ''
+                    # Теги на границе порций: вхождения целиком в хвосте уже посчитаны
+                    data = tail + chunk
+                    cost['rows'] += _count_tags(data, _ROW_TAGS) - _count_tags(tail, _ROW_TAGS)
+                    cost['cells'] += _count_tags(data, _CELL_TAGS) - _count_tags(tail, _CELL_TAGS)
+                    cost['merged_ranges'] += (_count_tags(data, _MERGE_CELL_TAGS)
+                                              - _count_tags(tail, _MERGE_CELL_TAGS))
+                    tail = data[-_TAG_TAIL:]
+                    # Ячейки A, целиком лежащие в хвосте прошлой порции, уже посчитаны
+                    data = name_tail + chunk
+                    for match in _NAME_CELL_RE.finditer(data):
+                        if match.end() <= len(name_tail) or match.group().endswith(b'/>'):
+                            continue
+                        cost['name_cells'] += 1
+                        style = _STYLE_ATTR_RE.search(match.group())
+                        if style and int(style.group(1)) in yellow_styles:
+                            cost['yellow_name_cells'] += 1
+                    name_tail = data[-_NAME_CELL_TAIL:]
+                    scanned += len(chunk)
+                    if max_bytes is not None and scanned >= max_bytes:
+                        cost['complete'] = False
+                        break
+    return costs
+
+
+def load_stream_workbook(source):
+    """
+    Читает выгрузку ЯЗакупок напрямую из XML: первый лист целиком, листы поставщиков - компактно.
+    Из архива распаковываются только книга, связи, стили, общие строки и листы -
+    рисунки, изображения и прочие части не читаются.
+
+    Args:
+        source: Путь к xlsx или файловый объект с произвольным доступом
+
+    Returns:
+        StreamWorkbook: Прочитанная книга
+
+    Raises:
+        XlsxShapeError: Файл не соответствует ожидаемой структуре
+    """
+    with open_archive(source) as archive:
+        workbook_part = _find_workbook_part(archive)
+        sheets, date1904, styles_part, shared_strings_part = _read_sheet_parts(archive, workbook_part)
+        epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+
+        shared_strings = read_shared_strings(archive, shared_strings_part)
+        yellow_styles, date_styles = read_style_flags(archive, styles_part)
+
+        info_title, info_part = sheets[0]
+        info_sheet = _read_info_sheet(archive, info_title, info_part, shared_strings, date_styles, epoch)
+        dimensions = {info_title: (info_sheet.max_row, info_sheet.max_column)}
+
+        supplier_rows = {}
+        supplier_headers = {}
+        for title, part_name in sheets[1:]:
+            rows, dimension, header = _read_supplier_sheet(archive, part_name, shared_strings,
+                                                           yellow_styles, date_styles, epoch)
+            supplier_rows[title] = rows
+            supplier_headers[title] = header
+            dimensions[title] = dimension
+
+    return StreamWorkbook([title for title, _ in sheets], info_sheet, supplier_rows, dimensions,
+                          supplier_headers=supplier_headers)